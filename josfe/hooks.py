@@ -145,7 +145,29 @@ app_include_css = [
 scheduler_events = {
     "daily": [
         "josfe.sri_invoicing.core.numbering.validate.daily_check",
-    ]
+        # SRI/ tree vs queue xml_file consistency report (incremental walk)
+        "josfe.sri_invoicing.xml.consistency.scan_nightly",
+    ],
+    "monthly": [
+        # Pack closed periods into SRI/ARCHIVO (FE Settings.archive_after_months)
+        "josfe.sri_invoicing.xml.archive.archive_closed_periods",
+    ],
+    "cron": {
+        # SRI Autorización polling: one tick for every Enviado row that is due
+        "* * * * *": [
+            "josfe.sri_invoicing.core.transmission.poller2.poll_due",
+            # Async XML build: re-enqueue drains for rows left behind
+            "josfe.sri_invoicing.core.queue.async_build.enqueue_pending",
+            # Auto pipeline: start stage jobs that have work
+            "josfe.sri_invoicing.core.queue.pipeline.tick",
+            # SRI circuit breaker: drain rows parked while SRI was down
+            "josfe.sri_invoicing.core.transmission.breaker.drain_tick",
+        ],
+        # SRI/ file journal: settle moves of transactions that never finished
+        "*/10 * * * *": [
+            "josfe.sri_invoicing.xml.journal.reconcile",
+        ],
+    },
 }
 
 # Inject selection into boot
@@ -248,6 +270,9 @@ on_logout = "josfe.user_location.session.on_logout"
 # before_install = "josfe.install.before_install"
 # after_install = "josfe.install.after_install"
 
+# Settle SRI/ file moves left half-done by workers that died mid-transaction
+after_migrate = ["josfe.sri_invoicing.xml.journal.reconcile"]
+
 # Uninstallation
 # ------------
 
@@ -365,7 +390,7 @@ on_logout = "josfe.user_location.session.on_logout"
 # Job Events
 # ----------
 # before_job = ["josfe.utils.before_job"]
-# after_job = ["josfe.utils.after_job"]
+after_job = ["josfe.sri_invoicing.core.numbering.state.release_blocks_after_job"]
 
 # User Data Protection
 # --------------------
@@ -0,0 +1,27 @@
+# apps/josfe/josfe/patches/v1_0/normalize_sri_emission_points.py
+import frappe
+
+
+def execute():
+    """
+    Store emission_point_code zero-padded and estado trimmed on existing
+    SRI Puntos Emision rows, so numbering.state can find them by equality.
+    """
+    if not frappe.db.table_exists("SRI Puntos Emision"):
+        return
+
+    rows = frappe.db.sql(
+        "SELECT name, emission_point_code, estado FROM `tabSRI Puntos Emision`",
+        as_dict=True,
+    )
+    for r in rows:
+        code = (r.emission_point_code or "").strip()
+        if code.isdigit():
+            code = code.zfill(3)
+        estado = (r.estado or "").strip() or "Inactivo"
+        if code != r.emission_point_code or estado != r.estado:
+            frappe.db.set_value(
+                "SRI Puntos Emision", r.name,
+                {"emission_point_code": code, "estado": estado},
+                update_modified=False,
+            )
@@ -0,0 +1,229 @@
+# -*- coding: utf-8 -*-
+# apps/josfe/josfe/sri_invoicing/core/numbering/loadtest.py
+"""
+Load tests for the numbering hot paths.
+
+run(): N worker threads, each with its own site connection, allocate numbers
+on the same (warehouse, EP, doc_type) through numbering.state.allocate_sequential
+and commit after every allocation, like concurrent POS checkouts. Reports
+allocations/sec, latency percentiles and checks the issued numbers for
+duplicates and holes.
+
+    bench --site <site> execute josfe.sri_invoicing.core.numbering.loadtest.run \
+        --kwargs "{'warehouse': 'Sucursal Centro - JP', 'emission_point_code': '001', 'workers': 16}"
+
+Numbers are really consumed: use a test warehouse / emission point.
+
+run_xml_autoname(): SRI XML Queue inserts under concurrent submits. Each
+worker names a queue row (the xml_autoname counter, or the old LOCK TABLES
+scan with legacy=1), inserts it, keeps the transaction open for hold_ms like
+the rest of a Sales Invoice submit and rolls back. Reader threads poll the
+queue table meanwhile, as list views do. Names use a throwaway XML-LT<hash>-
+prefix whose tabSeries row is deleted at the end: the counter commits on its
+own connection, so the real XML-EC-YY- series would otherwise advance.
+
+    bench --site <site> execute josfe.sri_invoicing.core.numbering.loadtest.run_xml_autoname \
+        --kwargs "{'workers': 16, 'readers': 4}"
+"""
+from __future__ import annotations
+
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+import frappe
+from frappe.utils import now_datetime
+
+from josfe.sri_invoicing.core.numbering.state import allocate_sequential, release_blocks
+from josfe.sri_invoicing.core.utils.stats import percentile
+
+
+def _latency_ms(latencies: List[float]) -> Dict[str, float]:
+    latencies = sorted(latencies)
+    return {
+        "p50": round(percentile(latencies, 50) * 1000, 2),
+        "p95": round(percentile(latencies, 95) * 1000, 2),
+        "p99": round(percentile(latencies, 99) * 1000, 2),
+        "max": round((latencies[-1] if latencies else 0) * 1000, 2),
+    }
+
+
+def _worker(site: str, user: str, start: threading.Event, stop: Optional[threading.Event],
+            iterations: int, call: Callable[[], Any], out: dict) -> None:
+    """Run `call` `iterations` times (or until `stop` is set) on a fresh site connection."""
+    frappe.init(site=site)
+    frappe.connect()
+    frappe.set_user(user)
+    try:
+        start.wait()
+        done = 0
+        while (not stop.is_set()) if stop is not None else (done < iterations):
+            done += 1
+            t0 = time.perf_counter()
+            try:
+                value = call()
+            except Exception as e:
+                frappe.db.rollback()
+                out["errors"].append(f"{type(e).__name__}: {e}")
+                continue
+            out["latencies"].append(time.perf_counter() - t0)
+            out["values"].append(value)
+    finally:
+        frappe.destroy()
+
+
+def _run_threads(workers: int, per_worker: int, call: Callable[[], Any],
+                 readers: int = 0, read: Optional[Callable[[], Any]] = None) -> tuple:
+    """(elapsed_s, worker results, reader results); readers run until the workers finish."""
+    site = frappe.local.site
+    user = frappe.session.user
+    start, stop = threading.Event(), threading.Event()
+
+    results = [{"latencies": [], "values": [], "errors": []} for _ in range(int(workers))]
+    reads = [{"latencies": [], "values": [], "errors": []} for _ in range(int(readers or 0))]
+    threads = [
+        threading.Thread(target=_worker, args=(site, user, start, None, int(per_worker), call, res), daemon=True)
+        for res in results
+    ]
+    pollers = [
+        threading.Thread(target=_worker, args=(site, user, start, stop, 0, read, res), daemon=True)
+        for res in reads
+    ]
+    for t in threads + pollers:
+        t.start()
+
+    t0 = time.perf_counter()
+    start.set()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - t0
+    stop.set()
+    for t in pollers:
+        t.join()
+    return elapsed, results, reads
+
+
+def run(
+    warehouse: str,
+    emission_point_code: str = "001",
+    doc_type: str = "Factura",
+    workers: int = 8,
+    per_worker: int = 200,
+    autonomous: Optional[int] = None,
+    block_size: Optional[int] = None,
+) -> Dict[str, Any]:
+    """Run the allocator load test against the current site and return the measurements."""
+    frappe.only_for(("System Manager",))
+
+    block_size = int(block_size) if block_size is not None else None
+
+    def call():
+        n = allocate_sequential(warehouse, emission_point_code, doc_type, autonomous=autonomous, block_size=block_size)
+        frappe.db.commit()
+        return n
+
+    elapsed, results, _reads = _run_threads(workers, per_worker, call)
+
+    # Blocks are per process (shared by the threads): give the unused tail back once
+    released = release_blocks() if block_size else []
+
+    numbers = sorted(x for r in results for x in r["values"])
+    errors = [e for r in results for e in r["errors"]]
+    distinct = set(numbers)
+    holes = (numbers[-1] - numbers[0] + 1 - len(distinct)) if numbers else 0
+
+    summary = {
+        "workers": int(workers),
+        "block_size": block_size,
+        "allocations": len(numbers),
+        "errors": len(errors),
+        "elapsed_s": round(elapsed, 3),
+        "allocations_per_s": round(len(numbers) / elapsed, 2) if elapsed else 0,
+        "latency_ms": _latency_ms([x for r in results for x in r["latencies"]]),
+        "duplicates": len(numbers) - len(distinct),
+        "holes": holes,
+        "first": numbers[0] if numbers else None,
+        "last": numbers[-1] if numbers else None,
+        "released": released,
+        "sample_errors": errors[:5],
+    }
+    frappe.logger("sri_flow").info(f"[SEQ LOADTEST] {summary}")
+    return summary
+
+
+# ------------------------------
+# SRI XML Queue autoname
+# ------------------------------
+def _legacy_xml_name(prefix: str) -> str:
+    """The pre-counter scheme (LOCK TABLES + LIKE scan), kept only for comparison."""
+    frappe.db.sql("LOCK TABLES `tabSRI XML Queue` WRITE")
+    try:
+        row = frappe.db.sql(
+            "SELECT name FROM `tabSRI XML Queue` WHERE name LIKE %s ORDER BY name DESC LIMIT 1",
+            (f"{prefix}%",),
+        )
+        last_seq = int(row[0][0].split("-")[-1]) if row else 0
+        return f"{prefix}{last_seq + 1:05d}"
+    finally:
+        frappe.db.sql("UNLOCK TABLES")
+
+
+def run_xml_autoname(
+    workers: int = 8,
+    per_worker: int = 100,
+    hold_ms: int = 50,
+    readers: int = 2,
+    legacy: int = 0,
+) -> Dict[str, Any]:
+    """Queue-row insert throughput under concurrent submits; rows roll back, the throwaway series is dropped."""
+    from josfe.sri_invoicing.core.numbering.xml_autoname import next_queue_number
+
+    frappe.only_for(("System Manager",))
+
+    prefix = f"XML-LT{frappe.generate_hash(length=6)}-{now_datetime().year % 100:02d}-"
+
+    def call():
+        if int(legacy):
+            name = _legacy_xml_name(prefix)
+        else:
+            name = f"{prefix}{next_queue_number(prefix):05d}"
+        now = now_datetime()
+        frappe.db.sql(
+            """
+            INSERT INTO `tabSRI XML Queue` (name, creation, modified, owner, modified_by, docstatus, idx, state)
+            VALUES (%s, %s, %s, %s, %s, 0, 0, 'Generado')
+            """,
+            (name, now, now, frappe.session.user, frappe.session.user),
+        )
+        time.sleep(int(hold_ms) / 1000.0)  # rest of the submit transaction
+        frappe.db.rollback()
+        return name
+
+    def read():
+        return frappe.db.sql("SELECT COUNT(*) FROM `tabSRI XML Queue` WHERE state='Generado'")[0][0]
+
+    try:
+        elapsed, results, reads = _run_threads(workers, per_worker, call, readers=readers, read=read)
+    finally:
+        frappe.db.sql("DELETE FROM `tabSeries` WHERE name=%s", (prefix,))
+        frappe.db.commit()
+
+    names = [x for r in results for x in r["values"]]
+    errors = [e for r in results for e in r["errors"]]
+    summary = {
+        "mode": "lock_tables" if int(legacy) else "series_counter",
+        "prefix": prefix,
+        "workers": int(workers),
+        "readers": int(readers),
+        "hold_ms": int(hold_ms),
+        "inserts": len(names),
+        "errors": len(errors),
+        "elapsed_s": round(elapsed, 3),
+        "inserts_per_s": round(len(names) / elapsed, 2) if elapsed else 0,
+        "insert_latency_ms": _latency_ms([x for r in results for x in r["latencies"]]),
+        "reads": sum(len(r["values"]) for r in reads),
+        "read_latency_ms": _latency_ms([x for r in reads for x in r["latencies"]]),
+        "sample_errors": errors[:5],
+    }
+    frappe.logger("sri_flow").info(f"[XML AUTONAME LOADTEST] {summary}")
+    return summary
@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+# apps/josfe/josfe/sri_invoicing/core/numbering/reconcile.py
+"""
+Continuity reconciliation of SRI sequentials, built on SRI Secuencial Log.
+
+Log conventions (numbering.state):
+- AUTO / RESERVE / VOID cover the numbers old_value .. new_value - 1
+- INIT / EDIT / RETURN record counter moves (old "next" -> new "next")
+
+A hole is a number below the current counter that no document carries and
+that was not voided. Holes inside AUTO/RESERVE ranges were handed out and
+never issued (rolled-back documents, unused block numbers); the rest were
+skipped by counter edits.
+"""
+from __future__ import annotations
+
+import re
+from typing import Dict, List, Optional, Set
+
+import frappe
+
+from josfe.sri_invoicing.core.numbering import state
+
+# doc_type -> DocType whose names are EC-PE-#########
+DOC_SOURCES = {
+    "Factura": "Sales Invoice",
+    "Nota de Crédito": "Nota Credito FE",
+}
+
+ISSUE_ACTIONS = ("AUTO", "RESERVE")
+RANGE_ACTIONS = ("AUTO", "RESERVE", "VOID")
+
+# Safety cap for one report run
+MAX_SPAN = 1_000_000
+
+_NAME_RE = re.compile(r"^\d{3}-\d{3}-(\d{9})(?:-\d+)?$")
+
+
+def used_numbers(warehouse_name: str, emission_point_code: str, doc_type: str,
+                 first: Optional[int] = None, last: Optional[int] = None) -> Set[int]:
+    """Sequentials carried by existing documents (any docstatus, amendments included)."""
+    doc_type = state.DOC_TYPE_ALIASES.get(doc_type, doc_type)
+    dt = DOC_SOURCES.get(doc_type)
+    if not dt:
+        return set()
+
+    ec = state._get_establishment_code(warehouse_name)
+    prefix = f"{ec}-{state._zpad3(emission_point_code)}-"
+    out: Set[int] = set()
+    for (name,) in frappe.db.sql(f"SELECT name FROM `tab{dt}` WHERE name LIKE %s", (f"{prefix}%",)):
+        m = _NAME_RE.match(name or "")
+        if not m:
+            continue
+        n = int(m.group(1))
+        if (first is None or n >= first) and (last is None or n <= last):
+            out.add(n)
+    return out
+
+
+def _log_ranges(warehouse_name: str, ep: str, doc_type: str) -> Dict[str, List[tuple]]:
+    rows = frappe.get_all(
+        "SRI Secuencial Log",
+        filters={
+            "warehouse": warehouse_name,
+            "emission_point_code": ep,
+            "doc_type": doc_type,
+            "action": ["in", list(RANGE_ACTIONS)],
+        },
+        fields=["action", "old_value", "new_value"],
+        order_by="`when` asc",
+    )
+    out: Dict[str, List[tuple]] = {a: [] for a in RANGE_ACTIONS}
+    for r in rows:
+        lo, hi = int(r.old_value or 0), int(r.new_value or 0) - 1
+        if lo >= 1 and hi >= lo:
+            out[r.action].append((lo, hi))
+    return out
+
+
+def _in_ranges(ranges: List[tuple]) -> Set[int]:
+    out: Set[int] = set()
+    for lo, hi in ranges:
+        out.update(range(lo, hi + 1))
+    return out
+
+
+def _group(numbers: List[int], reason_of) -> List[dict]:
+    """Consecutive numbers with the same reason -> one row."""
+    rows: List[dict] = []
+    for n in numbers:
+        reason = reason_of(n)
+        last = rows[-1] if rows else None
+        if last and last["hasta"] == n - 1 and last["motivo"] == reason:
+            last["hasta"] = n
+            last["cantidad"] += 1
+        else:
+            rows.append({"desde": n, "hasta": n, "cantidad": 1, "motivo": reason})
+    return rows
+
+
+@frappe.whitelist()
+def get_sequential_holes(
+    warehouse_name: str,
+    emission_point_code: str,
+    doc_type: str = "Factura",
+    from_number: Optional[int] = None,
+    to_number: Optional[int] = None,
+) -> dict:
+    """
+    Holes in the sequence of (warehouse, EP, doc_type), grouped in ranges,
+    plus voided numbers that a document nevertheless carries (conflicts).
+    """
+    frappe.only_for(tuple(state.PRIV_ROLES))
+
+    doc_type = state.DOC_TYPE_ALIASES.get(doc_type, doc_type)
+    field = state.FIELD_BY_TYPE.get(doc_type)
+    if not field:
+        frappe.throw(f"Unsupported doc_type: {doc_type}")
+    ep = state._zpad3(emission_point_code)
+
+    counter = frappe.db.sql(
+        f"""
+        SELECT `{field}` FROM {state.CHILD_TABLE}
+        WHERE parent=%s AND emission_point_code=%s
+        ORDER BY (UPPER(TRIM(estado))='ACTIVO') DESC
+        LIMIT 1
+        """,
+        (warehouse_name, ep),
+    )
+    stored_next = int((counter[0][0] if counter else 0) or 1)
+
+    ranges = _log_ranges(warehouse_name, ep, doc_type)
+    used = used_numbers(warehouse_name, ep, doc_type)
+    issued = _in_ranges(ranges["AUTO"]) | _in_ranges(ranges["RESERVE"])
+    reserved = _in_ranges(ranges["RESERVE"])
+    voided = _in_ranges(ranges["VOID"])
+
+    known = used | issued
+    lo = int(from_number) if from_number else (min(known) if known else 1)
+    hi = int(to_number) if to_number else stored_next - 1
+    hi = min(hi, stored_next - 1)
+    if hi - lo + 1 > MAX_SPAN:
+        frappe.throw(f"Rango demasiado grande ({hi - lo + 1}); indique from_number/to_number.")
+
+    def reason_of(n: int) -> str:
+        if n in reserved:
+            return "Reservado en bloque sin comprobante"
+        if n in issued:
+            return "Asignado sin comprobante"
+        return "Sin registro de asignación"
+
+    missing = [n for n in range(lo, hi + 1) if n not in used and n not in voided]
+    conflicts = sorted(n for n in voided & used if lo <= n <= hi)
+
+    return {
+        "warehouse": warehouse_name,
+        "emission_point_code": ep,
+        "doc_type": doc_type,
+        "from": lo,
+        "to": hi,
+        "next_to_issue": stored_next,
+        "used": sum(1 for n in used if lo <= n <= hi),
+        "voided": sum(1 for n in voided if lo <= n <= hi),
+        "holes": _group(missing, reason_of),
+        "hole_count": len(missing),
+        "voided_but_used": conflicts,
+    }
@@ -3,6 +3,7 @@ import json
 import functools
 import frappe
 import re
+import threading
 from pymysql.err import OperationalError
 from frappe.utils import now_datetime, has_common
 from frappe.exceptions import DuplicateEntryError
@@ -21,6 +22,7 @@ FIELD_BY_TYPE = {
     "FC": "seq_factura",
     "NC": "seq_nc",
 }
+DOC_TYPE_ALIASES = {"FC": "Factura", "NC": "Nota de Crédito"}
 
 PRIV_ROLES = {"System Manager", "Accounts Manager"}
 CHILD_DOCTYPE = "SRI Puntos Emision"
@@ -129,28 +131,6 @@ def _find_row_in_same_warehouse_locked(warehouse_name: str, emission_point_code:
     )
     return rows[0] if rows else None
 
-def _get_active_row_by_parent_code_locked(warehouse_name: str, emission_point_code: str):
-    pf = _choose_parentfield_for_wh()
-    target = _zpad3(emission_point_code)
-    rows = frappe.db.sql(
-        f"""
-        SELECT {SELECT_COLS}
-        FROM {CHILD_TABLE}
-        WHERE parent=%s
-          AND parenttype='{WAREHOUSE}'
-          AND parentfield=%s
-          AND LPAD(TRIM(emission_point_code), 3, '0')=%s
-          AND UPPER(TRIM(estado))='ACTIVO'
-        FOR UPDATE
-        """,
-        (warehouse_name, pf, target),
-        as_dict=True,
-    )
-    if not rows:
-        frappe.throw(f"No active emission point {target} in Warehouse {warehouse_name}.")
-    return rows[0]
-
-
 # =========================
 # Insert / Upsert logic
 # =========================
@@ -201,18 +181,8 @@ def _get_or_create_row_by_parent_code_locked(warehouse_name: str, emission_point
 # Logging & retries
 # =========================
 def _log(warehouse, emission_point_code, doc_type, action, old_val, new_val, note=""):
-    frappe.get_doc({
-        "doctype": "SRI Secuencial Log",
-        "warehouse": warehouse,
-        "emission_point_code": emission_point_code,
-        "doc_type": doc_type,           # Factura, Retención, etc.
-        "action": action,               # INIT / EDIT / AUTO
-        "old_value": int(old_val),
-        "new_value": int(new_val),
-        "note": note,
-        "by_user": frappe.session.user,
-        "when": now_datetime(),
-    }).insert(ignore_permissions=True)
+    """INIT / EDIT entries; same naming scheme as the AUTO ones (see _log_fast)."""
+    _log_fast(frappe.db, warehouse, emission_point_code, doc_type, action, old_val, new_val, note)
 
 def _with_retry(fn, *args, **kwargs):
     """Retry on deadlock/lock-wait (1205/1213)."""
@@ -227,6 +197,310 @@ def _with_retry(fn, *args, **kwargs):
             raise
 
 
+# =========================
+# Atomic allocator
+# =========================
+# Resolved (site, warehouse, EP) -> child row name. Row names never change,
+# so only estado/parent are re-checked, by the UPDATE itself.
+_ROW_NAMES: dict[tuple, str] = {}
+_ROW_NAMES_LOCK = threading.Lock()
+
+# One autocommit-style connection per thread for autonomous allocations
+_ALLOC = threading.local()
+
+# MySQL client errors that mean the cached allocator connection is gone
+_CONN_LOST = (0, 2006, 2013)
+
+
+def _autonomous_enabled() -> bool:
+    try:
+        return bool(int(frappe.db.get_single_value("FE Settings", "sequential_autonomous") or 0))
+    except Exception:
+        return False
+
+def _resolve_active_row_name(warehouse_name: str, emission_point_code: str, refresh: bool = False) -> str | None:
+    """
+    Non-locking lookup of the ACTIVO row for (warehouse, EP).
+    Normalized rows match by equality on parent + emission_point_code (both indexed);
+    the LPAD/TRIM form is only a fallback for rows saved before normalization.
+    """
+    target = _zpad3(emission_point_code)
+    key = (frappe.local.site, warehouse_name, target)
+    if not refresh:
+        cached = _ROW_NAMES.get(key)
+        if cached:
+            return cached
+
+    pf = _choose_parentfield_for_wh()
+    rows = frappe.db.sql(
+        f"""
+        SELECT name
+        FROM {CHILD_TABLE}
+        WHERE parent=%s
+          AND parenttype='{WAREHOUSE}'
+          AND parentfield=%s
+          AND emission_point_code=%s
+          AND estado=%s
+        """,
+        (warehouse_name, pf, target, _active_estado_value()),
+    )
+    if not rows:
+        rows = frappe.db.sql(
+            f"""
+            SELECT name
+            FROM {CHILD_TABLE}
+            WHERE parent=%s
+              AND parenttype='{WAREHOUSE}'
+              AND parentfield=%s
+              AND LPAD(TRIM(emission_point_code), 3, '0')=%s
+              AND UPPER(TRIM(estado))='ACTIVO'
+            """,
+            (warehouse_name, pf, target),
+        )
+
+    with _ROW_NAMES_LOCK:
+        if not rows:
+            _ROW_NAMES.pop(key, None)
+            return None
+        _ROW_NAMES[key] = rows[0][0]
+        return rows[0][0]
+
+def _forget_row_name(warehouse_name: str, emission_point_code: str) -> None:
+    with _ROW_NAMES_LOCK:
+        _ROW_NAMES.pop((frappe.local.site, warehouse_name, _zpad3(emission_point_code)), None)
+
+def _alloc_db():
+    """
+    Dedicated connection (per thread, per site) for autonomous allocations:
+    each bump commits on its own, so the counter row is locked for one statement
+    instead of for the whole invoice transaction.
+    """
+    from frappe.database import get_db
+
+    site = frappe.local.site
+    db = getattr(_ALLOC, "db", None)
+    if db is None or getattr(_ALLOC, "site", None) != site:
+        conf = frappe.local.conf
+        db = get_db(
+            socket=conf.db_socket,
+            host=conf.db_host,
+            port=conf.db_port,
+            user=conf.db_user or conf.db_name,
+            password=conf.db_password,
+            cur_db_name=conf.db_name,
+        )
+        _ALLOC.db, _ALLOC.site = db, site
+    return db
+
+def _drop_alloc_db() -> None:
+    db = getattr(_ALLOC, "db", None)
+    _ALLOC.db = None
+    if db is not None:
+        try:
+            db.close()
+        except Exception:
+            pass
+
+def _bump(db, row_name: str, field: str, count: int = 1) -> int | None:
+    """
+    Single-statement allocation by primary key:
+    seq = LAST_INSERT_ID(GREATEST(seq, 1) + count). Returns the new stored
+    "next to issue", or None if the row is gone / no longer ACTIVO.
+    """
+    db.sql(
+        f"""
+        UPDATE {CHILD_TABLE}
+        SET `{field}` = LAST_INSERT_ID(GREATEST(COALESCE(`{field}`, 0), 1) + %s)
+        WHERE name=%s
+          AND UPPER(TRIM(estado))='ACTIVO'
+        """,
+        (int(count), row_name),
+    )
+    # ROW_COUNT() first: LAST_INSERT_ID() is stale when nothing matched
+    affected, new_next = db.sql("SELECT ROW_COUNT(), LAST_INSERT_ID()")[0]
+    return int(new_next) if affected else None
+
+def _log_fast(db, warehouse, emission_point_code, doc_type, action, old_val, new_val, note=""):
+    """
+    Log row via a plain INSERT with a deterministic name
+    SRI-LOG-{warehouse}-{ep}-{doc_type}-{action}-{old:09d}. The doctype's format
+    autoname would take the tabSeries row of (warehouse, EP, doc_type) FOR
+    UPDATE, i.e. a second hot lock per allocation; every log written from
+    code goes through here, so that autoname only names rows made by hand.
+    """
+    now = now_datetime()
+    user = frappe.session.user
+    doc_type = DOC_TYPE_ALIASES.get(doc_type, doc_type)
+    name = f"SRI-LOG-{warehouse}-{emission_point_code}-{doc_type}-{action}-{int(old_val):09d}"
+    values = {
+        "name": name, "creation": now, "modified": now, "owner": user, "modified_by": user,
+        "docstatus": 0, "idx": 0,
+        "warehouse": warehouse, "emission_point_code": emission_point_code, "doc_type": doc_type,
+        "action": action, "old_value": int(old_val), "new_value": int(new_val),
+        "note": note, "by_user": user, "when": now,
+    }
+    cols = ", ".join(f"`{c}`" for c in values)
+    marks = ", ".join(["%s"] * len(values))
+    sql = f"INSERT INTO `tabSRI Secuencial Log` ({cols}) VALUES ({marks})"
+    try:
+        db.sql(sql, tuple(values.values()))
+    except Exception as e:
+        if not frappe.db.is_duplicate_entry(e):
+            raise
+        values["name"] = f"{name}-{frappe.generate_hash(length=6)}"
+        db.sql(sql, tuple(values.values()))
+
+def _log_autonomous(warehouse, emission_point_code, doc_type, action, old_val, new_val, note=""):
+    """_log_fast on the allocator connection, committed at once (never fails the caller)."""
+    db = _alloc_db()
+    try:
+        _log_fast(db, warehouse, emission_point_code, doc_type, action, old_val, new_val, note)
+        db.commit()
+    except Exception:
+        db.rollback()
+        frappe.log_error(frappe.get_traceback(), f"SRI Secuencial Log ({action})")
+
+def _allocate(warehouse_name: str, emission_point_code: str, field: str, autonomous: bool, count: int = 1) -> tuple[str, int]:
+    """(row_name, new "next to issue") after reserving `count` numbers."""
+    for refresh in (False, True):
+        row_name = _resolve_active_row_name(warehouse_name, emission_point_code, refresh=refresh)
+        if not row_name:
+            break
+
+        if not autonomous:
+            new_next = _bump(frappe.db, row_name, field, count)
+        else:
+            for attempt in range(3):
+                db = _alloc_db()
+                try:
+                    new_next = _bump(db, row_name, field, count)
+                    db.commit()
+                    break
+                except OperationalError as e:
+                    code = e.args[0] if e.args else None
+                    if code in _CONN_LOST:
+                        _drop_alloc_db()
+                    elif code in (1205, 1213):
+                        db.rollback()
+                    else:
+                        raise
+                    if attempt == 2:
+                        raise
+
+        if new_next is not None:
+            return row_name, new_next
+        _forget_row_name(warehouse_name, emission_point_code)
+
+    frappe.throw(f"No active emission point {_zpad3(emission_point_code)} in Warehouse {warehouse_name}.")
+
+
+# =========================
+# Block reservation
+# =========================
+# (site, warehouse, EP, doc_type) -> [row_name, next, last] served from memory by this process
+_BLOCKS: dict[tuple, list] = {}
+# Guards the two dicts only (never held across a DB call)
+_BLOCKS_LOCK = threading.Lock()
+# One lock per key, held while that key refills: other keys are not held up
+_KEY_LOCKS: dict[tuple, threading.Lock] = {}
+
+
+def _block_size_setting() -> int:
+    try:
+        return int(frappe.db.get_single_value("FE Settings", "sequential_block_size") or 0)
+    except Exception:
+        return 0
+
+def _block_key(warehouse_name: str, ep: str, doc_type: str) -> tuple:
+    return (frappe.local.site, warehouse_name, ep, DOC_TYPE_ALIASES.get(doc_type, doc_type))
+
+def _reserve(warehouse_name: str, ep: str, doc_type: str, field: str, size: int) -> tuple[str, int, int]:
+    """Move the counter by `size` in one autonomous statement; logged as one RESERVE row."""
+    row_name, new_next = _allocate(warehouse_name, ep, field, autonomous=True, count=size)
+    first, last = new_next - size, new_next - 1
+    _log_autonomous(warehouse_name, ep, doc_type, "RESERVE", first, new_next, f"bloque {first}-{last}")
+    return row_name, first, last
+
+def _key_lock(key: tuple) -> threading.Lock:
+    with _BLOCKS_LOCK:
+        lock = _KEY_LOCKS.get(key)
+        if lock is None:
+            lock = _KEY_LOCKS[key] = threading.Lock()
+        return lock
+
+def _pop_from_block(key: tuple) -> int | None:
+    with _BLOCKS_LOCK:
+        blk = _BLOCKS.get(key)
+        if not blk or blk[1] > blk[2]:
+            return None
+        assigned = blk[1]
+        blk[1] += 1
+        return assigned
+
+def _take_from_block(warehouse_name: str, ep: str, doc_type: str, field: str, size: int) -> int:
+    key = _block_key(warehouse_name, ep, doc_type)
+    with _key_lock(key):
+        assigned = _pop_from_block(key)
+        if assigned is not None:
+            return assigned
+
+        # One DB round trip per `size` numbers; only callers of this key wait for it
+        row_name, first, last = _reserve(warehouse_name, ep, doc_type, field, size)
+        with _BLOCKS_LOCK:
+            _BLOCKS[key] = [row_name, first + 1, last]
+        return first
+
+def _give_back(warehouse_name: str, ep: str, doc_type: str, row_name: str, first: int, last: int) -> dict:
+    """
+    Unused tail [first, last] of a block: roll the counter back if nobody moved
+    it since (RETURN), else record the numbers as voided (VOID).
+    """
+    field = FIELD_BY_TYPE[doc_type]
+    db = _alloc_db()
+    db.sql(
+        f"UPDATE {CHILD_TABLE} SET `{field}`=%s WHERE name=%s AND `{field}`=%s",
+        (first, row_name, last + 1),
+    )
+    returned = bool(db.sql("SELECT ROW_COUNT()")[0][0])
+    db.commit()
+
+    if returned:
+        _log_autonomous(warehouse_name, ep, doc_type, "RETURN", last + 1, first, f"bloque {first}-{last} sin usar devuelto")
+    else:
+        _log_autonomous(warehouse_name, ep, doc_type, "VOID", first, last + 1, f"bloque {first}-{last} sin usar")
+    return {"warehouse": warehouse_name, "emission_point_code": ep, "doc_type": doc_type,
+            "from": first, "to": last, "action": "RETURN" if returned else "VOID"}
+
+def release_blocks() -> list[dict]:
+    """
+    Give back every unused block number this process holds for the current site.
+    Runs after every background job (hooks.after_job); call it at the end of
+    bulk imports run otherwise. Blocks still held by a web worker when it
+    stops are not given back: they show up as holes in the reconcile report
+    (numbering.reconcile, "Reservado en bloque sin comprobante").
+    """
+    site = frappe.local.site
+    with _BLOCKS_LOCK:
+        mine = {k: v for k, v in _BLOCKS.items() if k[0] == site}
+        for k in mine:
+            _BLOCKS.pop(k, None)
+
+    out = []
+    for (_site, wh, ep, doc_type), (row_name, nxt, last) in mine.items():
+        if nxt <= last:
+            out.append(_give_back(wh, ep, doc_type, row_name, nxt, last))
+    return out
+
+def release_blocks_after_job(*args, **kwargs) -> None:
+    """hooks.after_job: the job's unused block numbers go back before the worker moves on."""
+    if not _BLOCKS:
+        return
+    try:
+        release_blocks()
+    except Exception:
+        frappe.log_error(frappe.get_traceback(), "SRI release sequential blocks")
+
+
 # =========================
 # Public APIs
 # =========================
@@ -356,51 +630,136 @@ def next_sequential(warehouse_name: str, emission_point_code: str, doc_type: str
     - Stored field (seq_*) means "next to issue".
     - We return the CURRENT stored value as the assigned number,
       then increment the stored value by +1.
+
+    The counter moves with one UPDATE ... LAST_INSERT_ID() by primary key
+    (no SELECT ... FOR UPDATE); the AUTO log row is written after it.
+    With FE Settings.sequential_autonomous the bump commits on its own
+    connection: the row lock lasts one statement, and a number whose document
+    later rolls back stays burned (see the log for holes).
+
+    With FE Settings.sequential_block_size > 1, numbers come from a
+    per-process block of that size reserved in one statement (one RESERVE log
+    row per block); release_blocks() gives the unused tail back.
+
+    Both modes come from FE Settings only; server code that needs to pick them
+    per call (load tests) uses allocate_sequential().
+    """
+    return allocate_sequential(warehouse_name, emission_point_code, doc_type)
+
+def allocate_sequential(warehouse_name: str, emission_point_code: str, doc_type: str, autonomous=None, block_size=None) -> int:
+    """
+    next_sequential() with the FE Settings modes overridable. Not whitelisted:
+    autonomous / block_size decide whether numbers can be burned or held back.
     """
     field = FIELD_BY_TYPE.get(doc_type)
     if not field:
         frappe.throw(f"Unsupported doc_type: {doc_type}")
 
-    def inner():
-        row = _get_active_row_by_parent_code_locked(warehouse_name, emission_point_code)
-
-        # If somehow empty/zero, treat as 1 (first issue)
-        current_next = int(row.get(field) or 1)
-
-        # Assign this one
-        assigned = current_next
-
-        # And move the counter forward
-        new_next = current_next + 1
-        frappe.db.set_value(CHILD_DOCTYPE, row["name"], field, new_next, update_modified=False)
-
-        _log(
-            warehouse_name,
-            row.get("emission_point_code"),
-            doc_type,
-            "AUTO",
-            current_next,           # old "next to issue"
-            new_next,               # new "next to issue"
-            "issue & post-increment"
-        )
-        return assigned
+    size = int(block_size) if block_size is not None else _block_size_setting()
+    if size > 1:
+        return _take_from_block(warehouse_name, _zpad3(emission_point_code), doc_type, field, size)
 
-    return _with_retry(inner)
+    if autonomous is None:
+        autonomous = _autonomous_enabled()
+    autonomous = bool(int(autonomous or 0))
+    ep = _zpad3(emission_point_code)
+
+    def inner():
+        return _allocate(warehouse_name, ep, field, autonomous)[1]
+
+    new_next = inner() if autonomous else _with_retry(inner)
+    assigned = new_next - 1
+
+    # Autonomous: the bump is already committed, the log goes on the allocator
+    # connection. Default mode: the bump's row lock is held until the invoice
+    # transaction commits, and this INSERT runs inside it. That keeps the number
+    # and its log gap-free (both roll back together) at the price of serializing
+    # submits per emission point for the rest of the transaction; the insert is
+    # a single plain INSERT for that reason.
+    if autonomous:
+        _log_autonomous(warehouse_name, ep, doc_type, "AUTO", assigned, new_next, "issue & post-increment")
+    else:
+        _log_fast(frappe.db, warehouse_name, ep, doc_type, "AUTO", assigned, new_next, "issue & post-increment")
+    return assigned
 
 @frappe.whitelist()
 def peek_next(warehouse_name: str, emission_point_code: str, doc_type: str) -> int:
     """
     Read-only preview: returns the stored "next to issue" without writing.
-    Requires emission point ACTIVO.
+    Requires emission point ACTIVO. Plain read, no row lock.
     """
     field = FIELD_BY_TYPE.get(doc_type)
     if not field:
         frappe.throw(f"Unsupported doc_type: {doc_type}")
 
-    row = _get_active_row_by_parent_code_locked(warehouse_name, emission_point_code)
+    with _BLOCKS_LOCK:
+        blk = _BLOCKS.get(_block_key(warehouse_name, _zpad3(emission_point_code), doc_type))
+        if blk and blk[1] <= blk[2]:
+            return blk[1]
+
+    row_name = _resolve_active_row_name(warehouse_name, emission_point_code, refresh=True)
+    if not row_name:
+        frappe.throw(f"No active emission point {_zpad3(emission_point_code)} in Warehouse {warehouse_name}.")
+
+    # Autonomous bumps commit elsewhere: read them outside this transaction's snapshot
+    db = _alloc_db() if _autonomous_enabled() else frappe.db
+    value = db.sql(f"SELECT `{field}` FROM {CHILD_TABLE} WHERE name=%s", (row_name,))
+    if db is not frappe.db:
+        db.commit()
 
     # If unset/zero, consider the first issue will be 1
-    return int(row.get(field) or 1)
+    return int((value[0][0] if value else 0) or 1)
+
+@frappe.whitelist()
+def reserve_block(warehouse_name: str, emission_point_code: str, doc_type: str, size: int) -> dict:
+    """
+    Reserve `size` contiguous sequentials for an external bulk process (imports).
+    The caller owns the range: numbers it does not use must go through void_sequentials.
+    """
+    _require_privileged()
+    field = FIELD_BY_TYPE.get(doc_type)
+    if not field:
+        frappe.throw(f"Unsupported doc_type: {doc_type}")
+    size = int(size or 0)
+    if size < 1:
+        frappe.throw("size must be ≥ 1.")
+    ep = _zpad3(emission_point_code)
+    _row, first, last = _reserve(warehouse_name, ep, doc_type, field, size)
+    return {"from": first, "to": last}
+
+@frappe.whitelist()
+def void_sequentials(warehouse_name: str, emission_point_code: str, doc_type: str, from_number, to_number=None, note: str = "") -> dict:
+    """
+    Declare already-assigned numbers as voided (never issued to SRI), so the
+    continuity reconciliation accounts for them. Numbers used by a document
+    or not assigned yet are rejected.
+    """
+    from josfe.sri_invoicing.core.numbering.reconcile import used_numbers
+
+    _require_privileged()
+    field = FIELD_BY_TYPE.get(doc_type)
+    if not field:
+        frappe.throw(f"Unsupported doc_type: {doc_type}")
+    doc_type = DOC_TYPE_ALIASES.get(doc_type, doc_type)
+    ep = _zpad3(emission_point_code)
+    first = int(from_number)
+    last = int(to_number or from_number)
+    if first < 1 or last < first:
+        frappe.throw("Rango inválido.")
+
+    row_name = _resolve_active_row_name(warehouse_name, ep, refresh=True)
+    if not row_name:
+        frappe.throw(f"No active emission point {ep} in Warehouse {warehouse_name}.")
+    stored_next = int(frappe.db.get_value(CHILD_DOCTYPE, row_name, field) or 1)
+    if last >= stored_next:
+        frappe.throw(f"{doc_type}: {last} aún no ha sido asignado (siguiente: {stored_next}).")
+
+    used = sorted(used_numbers(warehouse_name, ep, doc_type, first, last))
+    if used:
+        frappe.throw(f"{doc_type}: números con comprobante emitido: {', '.join(map(str, used[:10]))}")
+
+    _log_fast(frappe.db, warehouse_name, ep, doc_type, "VOID", first, last + 1, note or "anulado")
+    return {"from": first, "to": last, "voided": last - first + 1}
 
 @frappe.whitelist()
 def level3_warehouse_link_query(doctype, txt, searchfield, start, page_len, filters):
@@ -1,5 +1,6 @@
 import frappe
 from frappe.utils import now_datetime
+from pymysql.err import InterfaceError, OperationalError
 
 def xml_queue_autoname(doc, method=None):
     """
@@ -27,26 +28,61 @@ def xml_queue_autoname(doc, method=None):
     year = now_datetime().year % 100
     prefix = f"XML-{ec}-{year:02d}-"
 
-    # 4) Allocate next sequential within prefix
-    frappe.db.sql("LOCK TABLES `tabSRI XML Queue` WRITE")
-    try:
-        row = frappe.db.sql(
-            """
-            SELECT name
-            FROM `tabSRI XML Queue`
-            WHERE name LIKE %s
-            ORDER BY name DESC
-            LIMIT 1
-            """,
-            (f"{prefix}%",),
-            as_dict=True,
-        )
-        last_seq = 0
-        if row:
-            try:
-                last_seq = int(row[0].name.split("-")[-1])
-            except Exception:
-                last_seq = 0
-        doc.name = f"{prefix}{last_seq + 1:05d}"
-    finally:
-        frappe.db.sql("UNLOCK TABLES")
+    # 4) Allocate next sequential within prefix (tabSeries row per EC+Year, no table lock)
+    doc.name = f"{prefix}{next_queue_number(prefix):05d}"
+
+
+# ------------------------------
+# Counter per (EC, year)
+# ------------------------------
+_SEEDED: set = set()
+
+
+def _seed_series(db, prefix: str) -> None:
+    """
+    First use of a prefix: start the tabSeries row at the highest existing
+    queue number (names created before the counter existed). INSERT IGNORE
+    keeps concurrent seeders from clobbering each other.
+    """
+    key = (frappe.local.site, prefix)
+    if key in _SEEDED:
+        return
+    db.sql(
+        """
+        INSERT IGNORE INTO `tabSeries` (name, current)
+        SELECT %s, COALESCE(MAX(CAST(SUBSTRING_INDEX(name, '-', -1) AS UNSIGNED)), 0)
+        FROM `tabSRI XML Queue`
+        WHERE name LIKE %s
+        """,
+        (prefix, f"{prefix}%"),
+    )
+    _SEEDED.add(key)
+
+
+def next_queue_number(prefix: str) -> int:
+    """
+    Atomic +1 on the tabSeries row of `prefix`, committed on the allocator
+    connection: the row lock lasts one statement, never the invoice submit.
+    A rolled-back submit leaves a gap in queue names (they are internal ids).
+    """
+    from josfe.sri_invoicing.core.numbering.state import _alloc_db, _drop_alloc_db
+
+    for attempt in range(2):
+        db = _alloc_db()
+        try:
+            _seed_series(db, prefix)
+            db.sql(
+                """
+                INSERT INTO `tabSeries` (name, current) VALUES (%s, LAST_INSERT_ID(1))
+                ON DUPLICATE KEY UPDATE current = LAST_INSERT_ID(current + 1)
+                """,
+                (prefix,),
+            )
+            current = int(db.sql("SELECT LAST_INSERT_ID()")[0][0])
+            db.commit()
+            return current
+        except (OperationalError, InterfaceError):
+            # Stale allocator connection (server restart, wait_timeout): reconnect once
+            _drop_alloc_db()
+            if attempt:
+                raise
@@ -0,0 +1,211 @@
+# -*- coding: utf-8 -*-
+# apps/josfe/josfe/sri_invoicing/core/pdf_emailing/batch.py
+"""
+Bulk RIDE rendering: every Autorizado row matching the filter is rendered in a
+process pool (wkhtmltopdf per document is the slow part). Each worker connects
+to the site once and keeps its own template / logo caches; RIDEs whose
+AUTORIZADO XML is unchanged are skipped unless force=1. The parent records
+each document's render time in SRI Queue Stage Log (stage PDF) in chunks of
+FE Settings.batch_size, with a progress event on 'sri_xml_queue_changed'.
+
+    bench --site <site> execute josfe.sri_invoicing.core.pdf_emailing.batch.run_bulk_render --kwargs "{'from_date': '2026-01-01'}"
+"""
+from __future__ import annotations
+
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Any, Dict, List, Optional
+
+import frappe
+
+from josfe.sri_invoicing.core.queue import timings
+from josfe.sri_invoicing.doctype.fe_settings.fe_settings import get_settings
+from josfe.sri_invoicing.doctype.sri_xml_queue.sri_xml_queue import SRIQueueState
+
+QUEUE_DTYPE = "SRI XML Queue"
+QUEUE_EVENT = "sri_xml_queue_changed"
+BULK_ROLES = ("System Manager", "Accounts Manager", "FE Admin")
+
+
+# ------------------------------
+# Selection
+# ------------------------------
+def _select_autorizados(
+    company: Optional[str] = None,
+    warehouse: Optional[str] = None,
+    from_date: Optional[str] = None,
+    to_date: Optional[str] = None,
+    limit: int = 0,
+) -> List[str]:
+    filters: Dict[str, Any] = {
+        "state": SRIQueueState.Autorizado.value,
+        "xml_file": ["is", "set"],
+        "reference_doctype": ["in", ["FC", "Sales Invoice"]],
+    }
+    if company:
+        filters["company"] = company
+    if warehouse:
+        filters["custom_jos_level3_warehouse"] = warehouse
+    if from_date and to_date:
+        filters["posting_date"] = ["between", [from_date, to_date]]
+    elif from_date:
+        filters["posting_date"] = [">=", from_date]
+    elif to_date:
+        filters["posting_date"] = ["<=", to_date]
+
+    return frappe.get_all(
+        QUEUE_DTYPE,
+        filters=filters,
+        # pdf_builder._invoice_name: the link is sales_invoice or reference_name (FC)
+        or_filters={"sales_invoice": ["is", "set"], "reference_name": ["is", "set"]},
+        pluck="name",
+        order_by="posting_date asc, name asc",
+        limit_page_length=int(limit or 0),
+    )
+
+
+# ------------------------------
+# Worker-process side (own site connection, own render caches)
+# ------------------------------
+def _init_worker(site: str, sites_path: str, user: str) -> None:
+    frappe.init(site=site, sites_path=sites_path)
+    frappe.connect()
+    frappe.set_user(user)
+
+
+def _render_one(name: str, force: bool) -> Dict[str, Any]:
+    from josfe.sri_invoicing.core.pdf_emailing.pdf_builder import render_ride
+
+    t0 = time.monotonic()
+    try:
+        qdoc = frappe.get_doc(QUEUE_DTYPE, name)
+        url, rendered = render_ride(qdoc, force=force)
+        frappe.db.commit()  # ride_xml_hash
+        return {"name": name, "ok": True, "url": url, "rendered": rendered, "ms": timings.ms_since(t0)}
+    except Exception as e:
+        frappe.db.rollback()
+        return {"name": name, "ok": False, "error": f"{type(e).__name__}: {e}", "ms": timings.ms_since(t0)}
+
+
+# ------------------------------
+# Parent side
+# ------------------------------
+def _flush(chunk: List[Dict[str, Any]], outcomes: List[Dict[str, Any]], total: int) -> None:
+    """Stage log records for the rendered RIDEs of a chunk + one commit."""
+    try:
+        for d in chunk:
+            if d.get("rendered"):
+                timings.record(d["name"], "PDF", work_ms=d["ms"])
+        frappe.db.commit()
+    except Exception:
+        frappe.db.rollback()
+        frappe.log_error(frappe.get_traceback(), "SRI bulk RIDE flush")
+    outcomes.extend(chunk)
+    frappe.publish_realtime(
+        QUEUE_EVENT,
+        {"bulk": True, "action": "ride", "done": len(outcomes), "total": total},
+        user=None,
+        doctype=QUEUE_DTYPE,
+    )
+
+
+def run_bulk_render(
+    company: Optional[str] = None,
+    warehouse: Optional[str] = None,
+    from_date: Optional[str] = None,
+    to_date: Optional[str] = None,
+    force: int = 0,
+    limit: int = 0,
+    max_workers: Optional[int] = None,
+) -> Dict[str, Any]:
+    """Background job: render the RIDE of every Autorizado row matching the filter."""
+    started = time.monotonic()
+    settings = get_settings()
+    workers = max(1, int(max_workers or os.cpu_count() or 1))
+    progress_every = max(1, int(settings.batch_size or 20))
+
+    names = _select_autorizados(company, warehouse, from_date, to_date, limit)
+    outcomes: List[Dict[str, Any]] = []
+    pending: List[Dict[str, Any]] = []
+
+    if names:
+        # spawn keeps the children clear of the job's DB/Redis sockets
+        ctx = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(
+            max_workers=min(workers, len(names)),
+            mp_context=ctx,
+            initializer=_init_worker,
+            initargs=(frappe.local.site, frappe.local.sites_path, frappe.session.user),
+        ) as pool:
+            futures = [pool.submit(_render_one, name, bool(int(force))) for name in names]
+            for fut in as_completed(futures):
+                pending.append(fut.result())
+                if len(pending) >= progress_every:
+                    _flush(pending, outcomes, len(names))
+                    pending = []
+    if pending:
+        _flush(pending, outcomes, len(names))
+
+    elapsed = time.monotonic() - started
+    render_ms = sorted(o["ms"] for o in outcomes if o.get("rendered"))
+    summary = {
+        "total": len(names),
+        "rendered": len(render_ms),
+        "skipped": sum(1 for o in outcomes if o.get("ok") and not o.get("rendered")),
+        "errors": sum(1 for o in outcomes if not o.get("ok")),
+        "elapsed_s": round(elapsed, 3),
+        "throughput_per_s": round(len(outcomes) / elapsed, 2) if elapsed else 0,
+        "render_ms_p50": render_ms[len(render_ms) // 2] if render_ms else 0,
+        "render_ms_max": render_ms[-1] if render_ms else 0,
+        "workers": workers,
+        "rows": outcomes,
+    }
+
+    frappe.logger("sri_flow").info(
+        f"[BULK RIDE] total={summary['total']} rendered={summary['rendered']} skipped={summary['skipped']} "
+        f"errors={summary['errors']} elapsed={summary['elapsed_s']}s workers={workers}"
+    )
+    frappe.publish_realtime(
+        QUEUE_EVENT,
+        {"bulk": True, "action": "ride", "done": len(outcomes), "total": len(names), "finished": True,
+         "rendered": summary["rendered"], "errors": summary["errors"]},
+        user=None,
+        doctype=QUEUE_DTYPE,
+    )
+    return summary
+
+
+# ------------------------------
+# Whitelisted API
+# ------------------------------
+@frappe.whitelist()
+def enqueue_bulk_render(
+    company: Optional[str] = None,
+    warehouse: Optional[str] = None,
+    from_date: Optional[str] = None,
+    to_date: Optional[str] = None,
+    force: int = 0,
+    limit: int = 0,
+    max_workers: Optional[int] = None,
+) -> Dict[str, Any]:
+    """Queue a background RIDE render; progress arrives on 'sri_xml_queue_changed'."""
+    frappe.only_for(BULK_ROLES)
+
+    matched = len(_select_autorizados(company, warehouse, from_date, to_date, limit))
+    job_name = f"sri_bulk_ride:{frappe.generate_hash(length=8)}"
+    frappe.enqueue(
+        "josfe.sri_invoicing.core.pdf_emailing.batch.run_bulk_render",
+        queue="long",
+        timeout=4 * 3600,
+        job_name=job_name,
+        company=company,
+        warehouse=warehouse,
+        from_date=from_date,
+        to_date=to_date,
+        force=int(force or 0),
+        limit=int(limit or 0),
+        max_workers=int(max_workers) if max_workers else None,
+    )
+    return {"queued": matched, "job_name": job_name}
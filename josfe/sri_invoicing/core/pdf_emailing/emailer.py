@@ -19,7 +19,7 @@ def send_invoice_email(qdoc, pdf_url: Optional[str] = None) -> None:
 
     - qdoc: SRI XML Queue document (DocType instance)
       Expected fields:
-        - sales_invoice OR (reference_doctype == 'Sales Invoice' and reference_name)
+        - sales_invoice OR (reference_doctype in ('FC', 'Sales Invoice') and reference_name)
         - xml_file: '/private/files/SRI/.../xxx.xml' (URL)
         - posting_date: used indirectly by pdf_builder (invoice.posting_date)
     - pdf_url: if provided, used directly; if None, PDF is (re)built.
@@ -52,13 +52,12 @@ def send_invoice_email(qdoc, pdf_url: Optional[str] = None) -> None:
     attachments = []
     urls = _collect_existing_urls([qdoc.get("xml_file"), pdf_url])
     for u in urls:
-        abs_path = _url_to_abs_private_path(u)
-        if abs_path and os.path.exists(abs_path):
-            with open(abs_path, "rb") as f:
-                attachments.append({
-                    "fname": os.path.basename(abs_path),
-                    "fcontent": f.read(),
-                })
+        content = xml_paths.read_bytes(u)  # archived periods included
+        if content is not None:
+            attachments.append({
+                "fname": os.path.basename(u),
+                "fcontent": content,
+            })
         else:
             frappe.log_error(f"Attachment missing on disk: {u}", "Email Attachment Error")
 
@@ -90,7 +89,7 @@ def _get_linked_sales_invoice(qdoc):
     # Common generic link pattern
     ref_dt = qdoc.get("reference_doctype")
     ref_nm = qdoc.get("reference_name")
-    if ref_dt == "Sales Invoice" and ref_nm:
+    if ref_dt in ("FC", "Sales Invoice") and ref_nm:  # "FC": queue shorthand for Sales Invoice
         return frappe.get_doc("Sales Invoice", ref_nm)
 
     # Last resort: try a field named 'invoice' or similar
@@ -159,32 +158,19 @@ def _find_primary_contact_name(customer_name: str) -> Optional[str]:
 def _collect_existing_urls(urls: List[Optional[str]]) -> List[str]:
     """
     From a list of (possibly None) URLs, keep only those that map to an existing file.
-    Accepts only '/private/files/...' URLs and verifies their presence on disk.
+    Accepts only '/private/files/...' URLs and verifies their presence on disk or in a period archive.
     """
     out: List[str] = []
     for u in urls:
         if not u:
             continue
-        abs_path = _url_to_abs_private_path(u)
-        if abs_path and os.path.exists(abs_path):
+        if u.startswith(xml_paths.PRIVATE_PREFIX) and xml_paths.exists(u):
             out.append(u)
         else:
             frappe.log_error(f"Attachment not found on disk: {u}", "Missing Attachment")
     return out
 
 
-def _url_to_abs_private_path(url: str) -> Optional[str]:
-    """
-    Convert '/private/files/....' URL into an absolute filesystem path.
-    Returns None if the URL is not under /private/files/.
-    """
-    prefix = "/private/files/"
-    if not url or not url.startswith(prefix):
-        return None
-    # Absolute: sites/<site>/private/files/...
-    return frappe.get_site_path("private", "files", url[len(prefix):])
-
-
 def _format_subject(inv) -> str:
     """Subject like: 'Factura Electrónica 002-002-000000123' (falls back to inv.name)."""
     # If you store the human-readable number in naming series fields, adjust here.
@@ -1,14 +1,18 @@
+import time
 import frappe
 from frappe.utils.background_jobs import enqueue
-from josfe.sri_invoicing.core.pdf_emailing.pdf_builder import build_invoice_pdf
+from josfe.sri_invoicing.core.queue import timings
+from josfe.sri_invoicing.core.pdf_emailing.pdf_builder import render_ride
 from josfe.sri_invoicing.core.pdf_emailing.emailer import send_invoice_email
 
 def on_queue_update(doc, event):
     """Triggered when SRI XML Queue is updated"""
     if (doc.state or "").lower() == "autorizado" and not doc.get("pdf_emailed"):
         try:
-            from josfe.sri_invoicing.core.pdf_emailing.pdf_builder import build_invoice_pdf
-            build_invoice_pdf(doc)  # generate PDF only
+            t0 = time.monotonic()
+            _url, rendered = render_ride(doc)  # generate PDF only; kept if the XML is unchanged
+            if rendered:
+                timings.record(doc, "PDF", work_ms=timings.ms_since(t0))
             # don’t call _process_email here in dev
         except Exception:
             frappe.log_error(frappe.get_traceback(), "Initial PDF build failed")
@@ -16,9 +20,14 @@ def on_queue_update(doc, event):
 def _process_email(queue_name):
     """Main logic to build PDF and send email"""
     doc = frappe.get_doc("SRI XML Queue", queue_name)
-    pdf_file = build_invoice_pdf(doc)
+    t0 = time.monotonic()
+    pdf_file, rendered = render_ride(doc)
+    if rendered:
+        timings.record(doc, "PDF", work_ms=timings.ms_since(t0))
+    t0 = time.monotonic()
     send_invoice_email(doc, pdf_file)
     doc.db_set("pdf_emailed", 1)
+    timings.record(doc, "Email", work_ms=timings.ms_since(t0))
     frappe.msgprint(f"✅ PDF generated and emailed for {doc.name}")
 
 def schedule_retry(doc):
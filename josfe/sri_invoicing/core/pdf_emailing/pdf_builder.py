@@ -3,12 +3,13 @@
 
 import os
 import base64
+import hashlib
+import threading
 import frappe
 import xml.etree.ElementTree as ET
 from io import BytesIO
-from frappe.utils import getdate
 from frappe.utils.pdf import get_pdf
-from josfe.sri_invoicing.xml import paths as xml_paths
+from josfe.sri_invoicing.xml import atomic, paths as xml_paths
 
 import qrcode
 import barcode
@@ -57,14 +58,14 @@ def _generate_barcode_base64(clave_acceso: str) -> str:
 
 # ---------------- XML parser ----------------
 
-def _parse_autorizado_xml(abs_xml_path: str) -> dict:
-    """Parse AUTORIZADO XML and extract all relevant fields into a dict."""
-    if not os.path.exists(abs_xml_path):
+def _parse_autorizado_xml(abs_xml_path: str, data: bytes | None = None) -> dict:
+    """Parse AUTORIZADO XML and extract all relevant fields into a dict.
+    data: file content already read (e.g. from a period archive); abs_xml_path is then ignored."""
+    if data is None and not os.path.exists(abs_xml_path):
         return {}
 
     try:
-        tree = ET.parse(abs_xml_path)
-        root = tree.getroot()
+        root = ET.fromstring(data) if data is not None else ET.parse(abs_xml_path).getroot()
     except Exception:
         frappe.log_error(frappe.get_traceback(), "Error parsing AUTORIZADO XML")
         return {}
@@ -189,72 +190,130 @@ def _parse_autorizado_xml(abs_xml_path: str) -> dict:
     return auth
 
 
+# ---------------- Render caches (per process) ----------------
+
+RIDE_TEMPLATE = "josfe/sri_invoicing/core/pdf_emailing/templates/factura.html"
+
+_CACHE_LOCK = threading.Lock()
+_LOGOS: dict = {}      # company -> (logo_url, mtime_ns, data URI)
+_TEMPLATES: dict = {}  # template path -> compiled jinja Template
+
+
+def _logo_abs_path(logo_url: str) -> str:
+    """Turn a File URL into an absolute path ('' for anything else)."""
+    if logo_url.startswith("/private/files/"):
+        return frappe.get_site_path("private", "files", logo_url.replace("/private/files/", ""))
+    if logo_url.startswith("/files/"):
+        return frappe.get_site_path("public", "files", logo_url.replace("/files/", ""))
+    return ""
+
+
+def _company_logo(company: str) -> str:
+    """Company logo as a data URI, re-read only when the logo or its file changes."""
+    logo_url = frappe.get_cached_value("Company", company, "company_logo")
+    if not logo_url:
+        return ""
+    abs_path = _logo_abs_path(logo_url)
+    try:
+        mtime = os.stat(abs_path).st_mtime_ns if abs_path else None
+    except OSError:
+        mtime = None
+    if mtime is None:
+        frappe.log_error(f"Logo not found at {abs_path}", "PDF Logo Missing")
+        return ""
+
+    with _CACHE_LOCK:
+        hit = _LOGOS.get(company)
+        if hit and hit[0] == logo_url and hit[1] == mtime:
+            return hit[2]
+    try:
+        uri = _file_to_base64(abs_path)
+    except Exception:
+        frappe.log_error(frappe.get_traceback(), "Error embedding company logo")
+        return ""
+    with _CACHE_LOCK:
+        _LOGOS[company] = (logo_url, mtime, uri)
+    return uri
+
+
+def _template(path: str = RIDE_TEMPLATE):
+    """Compiled template, recompiled only when its source file changes."""
+    with _CACHE_LOCK:
+        tmpl = _TEMPLATES.get(path)
+    if tmpl is None or not tmpl.is_up_to_date:
+        tmpl = frappe.get_jenv().get_template(path)
+        with _CACHE_LOCK:
+            _TEMPLATES[path] = tmpl
+    return tmpl
+
+
 # ---------------- PDF builder ----------------
 
-def build_invoice_pdf(qdoc) -> str:
-    """
-    Render Sales Invoice into PDF, enriched with values from AUTORIZADO XML.
-    Saves under /private/files/SRI/RIDE/mm-YYYY/<QueueName>.pdf
-    Returns the /private/files/... URL.
-    """
-    # Load linked Sales Invoice
-    inv = None
+def _invoice_name(qdoc) -> str | None:
     if qdoc.get("sales_invoice"):
-        inv = frappe.get_doc("Sales Invoice", qdoc.sales_invoice)
-    elif qdoc.get("reference_doctype") == "Sales Invoice":
-        inv = frappe.get_doc("Sales Invoice", qdoc.reference_name)
-    else:
+        return qdoc.sales_invoice
+    # "FC" is the queue's shorthand for Sales Invoice (queue.api / async_build rows)
+    if qdoc.get("reference_doctype") in ("FC", "Sales Invoice"):
+        return qdoc.get("reference_name") or None
+    return None
+
+
+def archived_ride(qdoc) -> tuple[str, bytes] | None:
+    """(filename, content) of a closed period's RIDE, read from its archive; None when not archived."""
+    inv_name = _invoice_name(qdoc)
+    posting_date = inv_name and frappe.db.get_value("Sales Invoice", inv_name, "posting_date")
+    if not posting_date:
+        return None
+    url = xml_paths.to_file_url(xml_paths.ride_rel_dir(posting_date), f"{inv_name}.pdf")
+    if not xml_paths.locate(url)[1]:
+        return None
+    data = xml_paths.read_bytes(url)
+    return (f"{inv_name}.pdf", data) if data is not None else None
+
+
+def _linked_invoice(qdoc):
+    inv_name = _invoice_name(qdoc)
+    if not inv_name:
         frappe.throw("SRI XML Queue row missing Sales Invoice link.")
+    return frappe.get_doc("Sales Invoice", inv_name)
 
-    # Locate AUTORIZADO XML
-    xml_url = qdoc.get("xml_file")
-    auth_fields = {}
-    if xml_url:
-        abs_xml_path = frappe.get_site_path("private", "files", xml_url.replace("/private/files/", ""))
-        auth_fields = _parse_autorizado_xml(abs_xml_path)
 
-    # --- Company Logo Handling ---
-    logo_base64 = ""
-    logo_url = frappe.db.get_value("Company", inv.company, "company_logo")
-
-    if logo_url:
-        try:
-            # Turn File URL into absolute path
-            if logo_url.startswith("/private/files/"):
-                abs_path = frappe.get_site_path("private", "files", logo_url.replace("/private/files/", ""))
-            elif logo_url.startswith("/files/"):
-                abs_path = frappe.get_site_path("public", "files", logo_url.replace("/files/", ""))
-            else:
-                abs_path = ""
-
-            # Embed as base64 if file exists
-            if abs_path and os.path.exists(abs_path):
-                with open(abs_path, "rb") as f:
-                    encoded = base64.b64encode(f.read()).decode("utf-8")
-                logo_base64 = f"data:image/png;base64,{encoded}"
-            else:
-                frappe.log_error(f"Logo not found at {abs_path}", "PDF Logo Missing")
-        except Exception:
-            frappe.log_error(frappe.get_traceback(), "Error embedding company logo")
+def render_ride(qdoc, force: bool = False) -> tuple[str, bool]:
+    """
+    (URL, rendered) of the RIDE under /private/files/SRI/RIDE/mm-YYYY/<Invoice>.pdf.
+    Skips wkhtmltopdf when the PDF is on disk and was rendered from the same
+    AUTORIZADO XML (sha256 kept in ride_xml_hash); force=True always renders.
+    """
+    inv = _linked_invoice(qdoc)
+    rel_dir = xml_paths.ride_rel_dir(inv.posting_date)
+    fname = f"{inv.name}.pdf"
+    abs_path = xml_paths.abs_path(rel_dir, fname)
+    url = xml_paths.to_file_url(rel_dir, fname)
 
-    auth_fields["logo_base64"] = logo_base64
+    # Locate AUTORIZADO XML
+    xml_url = qdoc.get("xml_file")
+    data = xml_paths.read_bytes(xml_url) if xml_url else None  # archived periods included
+    digest = hashlib.sha256(data).hexdigest() if data is not None else ""
+    if not force and digest and qdoc.get("ride_xml_hash") == digest and os.path.exists(abs_path):
+        return url, False
 
+    auth_fields = _parse_autorizado_xml("", data=data) if data is not None else {}
+    auth_fields["logo_base64"] = _company_logo(inv.company)
 
     # Render template
-    html = frappe.render_template(
-        "josfe/sri_invoicing/pdf_emailing/templates/factura.html",
-        {"doc": inv, "queue": qdoc, "auth": auth_fields},
-    )
-    pdf_bytes = get_pdf(html)
+    html = _template().render({"doc": inv, "queue": qdoc, "auth": auth_fields})
+    atomic.write_bytes(abs_path, get_pdf(html))
 
-    # Save PDF under RIDE/mm-YYYY
-    d = getdate(inv.posting_date)
-    rel_dir = f"RIDE/{d.month:02d}-{d.year}"
-    fname = f"{inv.name}.pdf"
-    abs_path = xml_paths.abs_path(rel_dir, fname)
-    os.makedirs(os.path.dirname(abs_path), exist_ok=True)
+    if digest and qdoc.get("name"):
+        frappe.db.set_value("SRI XML Queue", qdoc.name, "ride_xml_hash", digest, update_modified=False)
+        qdoc.ride_xml_hash = digest
+    return url, True
 
-    with open(abs_path, "wb") as f:
-        f.write(pdf_bytes)
 
-    return xml_paths.to_file_url(rel_dir, fname)
+def build_invoice_pdf(qdoc, force: bool = False) -> str:
+    """
+    Render Sales Invoice into PDF, enriched with values from AUTORIZADO XML.
+    Saves under /private/files/SRI/RIDE/mm-YYYY/<Invoice>.pdf (kept when the XML is unchanged).
+    Returns the /private/files/... URL.
+    """
+    return render_ride(qdoc, force)[0]
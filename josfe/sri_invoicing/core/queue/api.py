@@ -3,13 +3,16 @@
 
 from __future__ import annotations
 from typing import Optional
+import time
 import frappe
 from frappe import _
+from frappe.utils import now_datetime
 from josfe.sri_invoicing.xml.builders import build_factura_xml
 from josfe.sri_invoicing.xml import service as xml_service, paths as xml_paths
 
 from josfe.sri_invoicing.xml import builders
 from josfe.sri_invoicing.doctype.sri_xml_queue.sri_xml_queue import SRIQueueState
+from josfe.sri_invoicing.core.queue import timings
 
 
 
@@ -27,6 +30,44 @@ def build_xml_for_queue(qname: str) -> str:
     """Generate XML for a queue row and persist path in xml_file (Generado stage).
     Supports Sales Invoice (FC) and Nota Credito (NC).
     """
+    return _build_xml_for_queue(qname)
+
+
+def build_xml_for_queues(qnames: list[str]) -> dict:
+    """Batch variant: factura master data for all rows is prefetched in bulk queries first."""
+    from josfe.sri_invoicing.xml.context import load_factura_context
+
+    rows = frappe.get_all(
+        QUEUE_DTYPE,
+        filters={"name": ["in", list(qnames) or [""]]},
+        fields=["name", "reference_doctype", "reference_name"],
+    )
+    si_names = [r.reference_name for r in rows if r.reference_doctype in ("FC", "Sales Invoice") and r.reference_name]
+    try:
+        snapshots = load_factura_context(si_names)
+    except Exception:
+        # One missing invoice fails the whole prefetch: retry without it, and if that
+        # still fails build row by row. Rows left without a snapshot load their own
+        # context below, so only the bad ones land in Error instead of the batch
+        # being rolled back and reclaimed forever.
+        existing = set(frappe.get_all("Sales Invoice", filters={"name": ["in", si_names or [""]]}, pluck="name"))
+        try:
+            snapshots = load_factura_context([n for n in si_names if n in existing])
+        except Exception:
+            frappe.log_error(frappe.get_traceback(), "SRI XML batch prefetch")
+            snapshots = {}
+
+    out = {}
+    for r in rows:
+        try:
+            out[r.name] = _build_xml_for_queue(r.name, snapshot=snapshots.get(r.reference_name))
+        except Exception as e:
+            out[r.name] = {"error": str(e)}
+    return out
+
+
+def _build_xml_for_queue(qname: str, snapshot=None) -> str:
+    t0 = time.monotonic()
     q = frappe.get_doc(QUEUE_DTYPE, qname)
 
     try:
@@ -61,7 +102,10 @@ def build_xml_for_queue(qname: str) -> str:
         else:
             if not ref_name:
                 frappe.throw("Queue row missing document reference")
-            xml_string, meta = builder(ref_name)
+            if snapshot is not None and builder is builders.build_factura_xml:
+                xml_string, meta = builder(ref_name, snapshot=snapshot)
+            else:
+                xml_string, meta = builder(ref_name)
 
         # --- Filename and write to Generado folder ---
         estab = (meta.get("estab") or "000").zfill(3)
@@ -73,10 +117,13 @@ def build_xml_for_queue(qname: str) -> str:
             rel_dir=xml_paths.GEN,
             filename=filename,
             data=xml_string.encode("utf-8"),
+            comp=meta.get("comprobante"),
+            shard=xml_paths.shard_for(meta.get("clave_acceso")),
         )
 
         # Persist file path in queue
         q.db_set("xml_file", file_url)
+        timings.record(q, "Generado", work_ms=timings.ms_since(t0))
 
         # Notify
         frappe.publish_realtime(
@@ -91,6 +138,7 @@ def build_xml_for_queue(qname: str) -> str:
     except Exception as e:
         frappe.log_error(f"Error building XML for {qname}: {e}", "SRI XML Queue")
         frappe.db.set_value(QUEUE_DTYPE, q.name, "state", SRIQueueState.Error.value)
+        timings.record(q, "Error", work_ms=timings.ms_since(t0))
         raise
 
 
@@ -107,6 +155,7 @@ def enqueue_on_sales_invoice_cancel(doc, method):
     qname = frappe.db.exists(QUEUE_DTYPE, {"reference_doctype": "FC", "reference_name": doc.name})
     if qname:
         frappe.db.set_value(QUEUE_DTYPE, qname, "state", SRIQueueState.Cancelado.value)
+        timings.record(qname, "Cancelado")
         # 🔔 Notify tabs that state changed to Cancelado
         frappe.publish_realtime(
             "sri_xml_queue_changed",
@@ -141,6 +190,11 @@ def enqueue_for_sales_invoice(si_name: str) -> str:
 
     ec_code = si.name[0:3] if si.name and len(si.name) >= 3 else None
 
+    # ⚡ Async mode: only the queue row joins the submit transaction
+    from josfe.sri_invoicing.core.queue import async_build
+    if async_build.is_enabled():
+        return async_build.record_for_sales_invoice(si)
+
     q = frappe.get_doc({
         "doctype": QUEUE_DTYPE,
         "reference_doctype": "FC",       # shorthand for Sales Invoice
@@ -150,6 +204,7 @@ def enqueue_for_sales_invoice(si_name: str) -> str:
         "custom_jos_level3_warehouse": getattr(si, "custom_jos_level3_warehouse", None),
         "posting_date": si.posting_date,
         "state": SRIQueueState.Generado.value,
+        "submitted_at": now_datetime(),
     }).insert(ignore_permissions=True)
 
     frappe.db.commit()
@@ -164,6 +219,11 @@ def enqueue_for_sales_invoice(si_name: str) -> str:
 
     try:
         build_xml_for_queue(q.name)  # publishes when XML ready
+        frappe.db.set_value(QUEUE_DTYPE, q.name, "xml_built_at", now_datetime(), update_modified=False)
+
+        from josfe.sri_invoicing.core.queue import pipeline
+        if pipeline.is_enabled():
+            pipeline.kick("sign")
     except Exception as e:
         frappe.log_error(message=f"XML build failed for {q.name}: {e}", title="SRI XML Queue")
         frappe.db.set_value(QUEUE_DTYPE, q.name, "state", SRIQueueState.Error.value)
@@ -221,6 +281,7 @@ def enqueue_on_nota_credito_cancel(doc, method: Optional[str] = None):
     )
     if qname:
         frappe.db.set_value("SRI XML Queue", qname, "state", SRIQueueState.Cancelado.value)
+        timings.record(qname, "Cancelado")
         frappe.publish_realtime(
             "sri_xml_queue_changed",
             {"name": qname, "state": SRIQueueState.Cancelado.value},
@@ -0,0 +1,195 @@
+# -*- coding: utf-8 -*-
+# apps/josfe/josfe/sri_invoicing/core/queue/async_build.py
+"""
+Asynchronous XML build for Sales Invoice submits (FE Settings.async_xml_build).
+
+The on_submit hook only inserts the queue row (state Generado, no xml_file,
+submitted_at = now) inside the submit transaction. After commit, background
+jobs on the 'short' queue claim pending rows with FOR UPDATE SKIP LOCKED, so
+several workers drain in parallel without picking the same row. They build
+the XML in batches (master data prefetched once per batch) and stamp
+xml_built_at. A scheduler tick re-enqueues anything left behind.
+"""
+from __future__ import annotations
+
+import zlib
+from typing import Any, Dict, List, Optional
+
+import frappe
+from frappe.utils import add_to_date, now_datetime, time_diff_in_seconds
+
+from josfe.sri_invoicing.core.utils.stats import percentile
+from josfe.sri_invoicing.doctype.fe_settings.fe_settings import get_settings
+from josfe.sri_invoicing.doctype.sri_xml_queue.sri_xml_queue import SRIQueueState
+
+QUEUE_DTYPE = "SRI XML Queue"
+QUEUE_EVENT = "sri_xml_queue_changed"
+JOB_METHOD = "josfe.sri_invoicing.core.queue.async_build.build_pending"
+
+# Reference types the async path builds (notas de crédito stay synchronous)
+FACTURA_REFS = ("FC", "Sales Invoice")
+
+
+def is_enabled() -> bool:
+    return bool(get_settings().async_xml_build)
+
+
+# ------------------------------
+# Submit side (inside the Sales Invoice transaction)
+# ------------------------------
+def record_for_sales_invoice(si) -> str:
+    """Insert the Generado row only; no commit, no build, no file I/O."""
+    q = frappe.get_doc({
+        "doctype": QUEUE_DTYPE,
+        "reference_doctype": "FC",       # shorthand for Sales Invoice
+        "reference_name": si.name,
+        "company": si.company,
+        "customer": getattr(si, "customer", None),
+        "custom_jos_level3_warehouse": getattr(si, "custom_jos_level3_warehouse", None),
+        "posting_date": si.posting_date,
+        "state": SRIQueueState.Generado.value,
+        "submitted_at": now_datetime(),
+    }).insert(ignore_permissions=True)
+
+    _enqueue(q.name)
+    frappe.publish_realtime(
+        QUEUE_EVENT,
+        {"name": q.name, "state": q.state},
+        user=None,
+        doctype=QUEUE_DTYPE,
+        after_commit=True,
+    )
+    return q.name
+
+
+def _enqueue(qname: Optional[str] = None, slot: Optional[int] = None) -> None:
+    """One drain job per worker slot; a slot already queued/running absorbs the new row."""
+    workers = max(1, int(get_settings().async_build_workers or 1))
+    if slot is None:
+        slot = zlib.crc32((qname or "").encode("utf-8")) % workers
+    frappe.enqueue(
+        JOB_METHOD,
+        queue="short",
+        job_id=f"sri_xml_build:{frappe.local.site}:{slot}",
+        deduplicate=True,
+        enqueue_after_commit=True,
+    )
+
+
+# ------------------------------
+# Worker side
+# ------------------------------
+def _claim(limit: int) -> List[str]:
+    return [
+        r[0]
+        for r in frappe.db.sql(
+            f"""
+            SELECT name
+            FROM `tab{QUEUE_DTYPE}`
+            WHERE state=%s
+              AND IFNULL(xml_file, '')=''
+              AND reference_doctype IN %s
+            ORDER BY creation ASC
+            LIMIT %s
+            FOR UPDATE SKIP LOCKED
+            """,
+            (SRIQueueState.Generado.value, FACTURA_REFS, int(limit)),
+        )
+    ]
+
+
+def build_pending(max_batches: int = 0) -> Dict[str, Any]:
+    """
+    Drain pending rows: claim a batch, build, stamp, commit; repeat until empty
+    (or max_batches). Rows that fail are left in Error by the builder.
+    """
+    from josfe.sri_invoicing.core.queue.api import build_xml_for_queues
+
+    batch_size = max(1, int(get_settings().batch_size or 20))
+    built = failed = batches = 0
+
+    while not max_batches or batches < int(max_batches):
+        names = _claim(batch_size)
+        if not names:
+            frappe.db.rollback()
+            break
+        batches += 1
+
+        try:
+            results = build_xml_for_queues(names)
+            now = now_datetime()
+            for name in names:
+                if isinstance(results.get(name), str):
+                    frappe.db.set_value(QUEUE_DTYPE, name, "xml_built_at", now, update_modified=False)
+                    built += 1
+                else:
+                    failed += 1
+            frappe.db.commit()
+        except Exception:
+            frappe.db.rollback()
+            frappe.log_error(frappe.get_traceback(), "SRI async XML build")
+            break
+
+    if built or failed:
+        frappe.logger("sri_flow").info(f"[ASYNC BUILD] built={built} failed={failed} batches={batches}")
+
+    if built:
+        from josfe.sri_invoicing.core.queue import pipeline
+        if pipeline.is_enabled():
+            pipeline.kick("sign")
+            frappe.db.commit()
+    return {"built": built, "failed": failed, "batches": batches}
+
+
+def enqueue_pending() -> None:
+    """Scheduler tick: make sure every slot drains if rows were left behind."""
+    if not is_enabled():
+        return
+    pending = frappe.db.count(
+        QUEUE_DTYPE,
+        {"state": SRIQueueState.Generado.value, "xml_file": ["is", "not set"], "reference_doctype": ["in", FACTURA_REFS]},
+    )
+    if not pending:
+        return
+    workers = max(1, int(get_settings().async_build_workers or 1))
+    for slot in range(min(workers, pending)):
+        _enqueue(slot=slot)
+
+
+# ------------------------------
+# Metrics
+# ------------------------------
+@frappe.whitelist()
+def get_build_latency(hours: int = 24) -> Dict[str, Any]:
+    """Submit → Generado (XML written) latency for async rows, plus the current backlog."""
+    frappe.only_for(("System Manager", "Accounts Manager"))
+
+    since = add_to_date(now_datetime(), hours=-int(hours or 24))
+    rows = frappe.get_all(
+        QUEUE_DTYPE,
+        filters={"submitted_at": [">=", since], "xml_built_at": ["is", "set"]},
+        fields=["submitted_at", "xml_built_at"],
+    )
+    latencies = sorted(
+        max(0.0, time_diff_in_seconds(r.xml_built_at, r.submitted_at)) for r in rows
+    )
+
+    pending = frappe.get_all(
+        QUEUE_DTYPE,
+        filters={"state": SRIQueueState.Generado.value, "xml_file": ["is", "not set"], "submitted_at": ["is", "set"]},
+        fields=["min(submitted_at) as oldest", "count(name) as depth"],
+    )
+    oldest = pending[0].oldest if pending else None
+
+    return {
+        "hours": int(hours or 24),
+        "built": len(latencies),
+        "latency_s": {
+            "p50": round(percentile(latencies, 50), 3),
+            "p95": round(percentile(latencies, 95), 3),
+            "p99": round(percentile(latencies, 99), 3),
+            "max": round(latencies[-1], 3) if latencies else 0,
+        },
+        "pending": int(pending[0].depth or 0) if pending else 0,
+        "oldest_pending_age_s": round(time_diff_in_seconds(now_datetime(), oldest), 1) if oldest else 0,
+    }
@@ -0,0 +1,372 @@
+# -*- coding: utf-8 -*-
+# apps/josfe/josfe/sri_invoicing/core/queue/pipeline.py
+"""
+Automatic SRI pipeline (FE Settings.auto_pipeline):
+
+    Generado ─sign─▶ Firmado ─send─▶ Enviado ─(poller2)─▶ Autorizado ─email─▶ RIDE + email
+
+Every stage runs in background jobs, one job id per (stage, slot), so the
+number of slots is the stage's concurrency limit. Transitions go through
+SRIXMLQueue.transition_to, i.e. the same ALLOWED table and on_update
+processing as the list buttons.
+
+The email stage only takes rows whose Autorizado stage record (SRI Queue
+Stage Log) is newer than the moment the pipeline was switched on
+(FE Settings.pipeline_enabled_at), so enabling it on a site with history
+does not mail the whole backlog.
+
+Backpressure: signing and sending pause while too many rows wait on SRI
+(Enviado) and sending shrinks its batches while SRI answers slowly. Per-stage
+batch records (rows, failures, seconds per row) are kept in Redis for
+get_pipeline_metrics().
+"""
+from __future__ import annotations
+
+import json
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+import frappe
+from frappe.utils import add_to_date, cstr, now_datetime, time_diff_in_seconds
+
+from josfe.sri_invoicing.core.queue import timings
+from josfe.sri_invoicing.core.utils.stats import percentile
+from josfe.sri_invoicing.doctype.fe_settings.fe_settings import get_settings
+from josfe.sri_invoicing.doctype.sri_xml_queue.sri_xml_queue import ALLOWED, SRIQueueState
+from josfe.sri_invoicing.xml import paths
+
+QUEUE_DTYPE = "SRI XML Queue"
+QUEUE_EVENT = "sri_xml_queue_changed"
+JOB_METHOD = "josfe.sri_invoicing.core.queue.pipeline.run_stage"
+
+# A stage job yields after this long; the next tick picks up where it left off
+STAGE_TIME_BUDGET_S = 240
+EMAIL_MAX_ATTEMPTS = 3
+EMAIL_FALLBACK_HOURS = 24
+METRICS_KEEP = 500
+
+
+# ------------------------------
+# Stage definitions
+# ------------------------------
+class Stage:
+    __slots__ = ("name", "from_state", "to_state", "queue", "conds")
+
+    def __init__(self, name: str, from_state: SRIQueueState, to_state: Optional[SRIQueueState],
+                 queue: str, conds: List[str]):
+        if to_state is not None and to_state not in ALLOWED[from_state]:
+            raise ValueError(f"Pipeline stage {name}: {from_state.value} → {to_state.value} not in ALLOWED")
+        self.name = name
+        self.from_state = from_state
+        self.to_state = to_state
+        self.queue = queue
+        self.conds = conds
+
+
+# Authorized (SRI Queue Stage Log 'Autorizado' record) since %(since)s; `modified`
+# moves with any later edit of the row, so it cannot tell old authorizations apart
+_AUTHORIZED_SINCE = f"""EXISTS (
+    SELECT 1 FROM `tab{timings.LOG_DTYPE}` l
+    WHERE l.queue = `tab{QUEUE_DTYPE}`.name AND l.stage = 'Autorizado' AND l.`at` >= %(since)s
+)"""
+
+STAGES: Dict[str, Stage] = {
+    "sign": Stage("sign", SRIQueueState.Generado, SRIQueueState.Firmado, "short",
+                  ["IFNULL(xml_file, '')<>''"]),
+    "send": Stage("send", SRIQueueState.Firmado, SRIQueueState.Enviado, "long", []),
+    # Enviado → Autorizado/Devuelto is driven by poller2.poll_due; monitored only
+    "authorize": Stage("authorize", SRIQueueState.Enviado, SRIQueueState.Autorizado, "", []),
+    "email": Stage("email", SRIQueueState.Autorizado, None, "short",
+                   ["IFNULL(pdf_emailed, 0)=0",
+                    "reference_doctype IN ('FC', 'Sales Invoice')",
+                    "IFNULL(email_retry_count, 0)<%(max_attempts)s",
+                    _AUTHORIZED_SINCE]),
+}
+RUNNABLE = ("sign", "send", "email")
+
+
+def _email_since():
+    """
+    Oldest authorization the email stage may pick up: when the pipeline was
+    switched on (FE Settings.pipeline_enabled_at), else EMAIL_FALLBACK_HOURS
+    back. Older Autorizado rows were already handled, or not, by hand.
+    """
+    return get_settings().pipeline_enabled_at or add_to_date(now_datetime(), hours=-EMAIL_FALLBACK_HOURS)
+
+
+def _where(stage: Stage) -> tuple:
+    """(SQL condition, values) selecting the rows waiting in a stage."""
+    values: Dict[str, Any] = {"state": stage.from_state.value}
+    if stage.name == "email":
+        values.update(max_attempts=EMAIL_MAX_ATTEMPTS, since=_email_since())
+    return " AND ".join(["state=%(state)s", *stage.conds]), values
+
+
+def _slots(stage_name: str) -> int:
+    s = get_settings()
+    if stage_name == "sign":
+        return max(1, int(s.pipeline_sign_workers or 1))
+    if stage_name == "email":
+        return max(1, int(s.pipeline_email_workers or 1))
+    # send: one job; its SOAP pool (sri_max_in_flight) is the concurrency limit
+    return 1
+
+
+def is_enabled() -> bool:
+    return bool(get_settings().auto_pipeline)
+
+
+# ------------------------------
+# Metrics (Redis)
+# ------------------------------
+def _metrics_key(stage_name: str) -> str:
+    return f"sri_pipeline:{stage_name}:batches"
+
+
+def _record(stage_name: str, rows: int, failed: int, per_row: List[float]) -> None:
+    if not rows:
+        return
+    cache = frappe.cache()
+    cache.lpush(_metrics_key(stage_name), json.dumps({
+        "ts": time.time(), "rows": rows, "failed": failed, "per_row": [round(x, 4) for x in per_row],
+    }))
+    cache.ltrim(_metrics_key(stage_name), 0, METRICS_KEEP - 1)
+
+
+def _batches(stage_name: str, since_ts: float = 0) -> List[dict]:
+    out = []
+    for raw in frappe.cache().lrange(_metrics_key(stage_name), 0, METRICS_KEEP - 1) or []:
+        try:
+            rec = json.loads(raw)
+        except Exception:
+            continue
+        if rec.get("ts", 0) >= since_ts:
+            out.append(rec)
+    return out
+
+
+def _depth(stage: Stage) -> int:
+    where, values = _where(stage)
+    return int(frappe.db.sql(f"SELECT COUNT(*) FROM `tab{QUEUE_DTYPE}` WHERE {where}", values)[0][0])
+
+
+# ------------------------------
+# Backpressure
+# ------------------------------
+def _waiting_on_sri() -> int:
+    return _depth(STAGES["authorize"])
+
+
+def _sri_slow() -> bool:
+    """SRI is slow when the last send batches averaged more than pipeline_slow_sri_seconds per row."""
+    limit = float(get_settings().pipeline_slow_sri_seconds or 0)
+    if not limit:
+        return False
+    recent = sorted(x for b in _batches("send", time.time() - 300)[:5] for x in b.get("per_row", []))
+    return bool(recent) and percentile(recent, 50) > limit
+
+
+def _blocked(stage_name: str) -> Optional[str]:
+    """Reason to hold a stage back, or None."""
+    if stage_name in ("sign", "send"):
+        cap = int(get_settings().pipeline_max_pending_sri or 0)
+        if cap and _waiting_on_sri() >= cap:
+            return f"{cap}+ comprobantes esperando autorización del SRI"
+    return None
+
+
+# ------------------------------
+# Stage workers
+# ------------------------------
+def _claim(stage: Stage, limit: int) -> List[str]:
+    """Rows of a stage, locked for this job only (other slots skip them)."""
+    where, values = _where(stage)
+    values["limit"] = int(limit)
+    return [
+        r[0]
+        for r in frappe.db.sql(
+            f"""
+            SELECT name FROM `tab{QUEUE_DTYPE}`
+            WHERE {where}
+            ORDER BY modified ASC
+            LIMIT %(limit)s
+            FOR UPDATE SKIP LOCKED
+            """,
+            values,
+        )
+    ]
+
+
+def _sign_row(name: str) -> bool:
+    doc = frappe.get_doc(QUEUE_DTYPE, name)
+    doc.transition_to(SRIQueueState.Firmado.value)
+    # on_update logs signing failures instead of raising: check the file really moved
+    if not cstr(frappe.db.get_value(QUEUE_DTYPE, name, "xml_file")).startswith(paths.to_file_url(paths.SIGNED, "")):
+        frappe.db.set_value(QUEUE_DTYPE, name, {
+            "state": SRIQueueState.Error.value,
+            "last_error": "Firma automática fallida (ver Error Log)",
+        })
+        return False
+    return True
+
+
+def _email_row(name: str) -> bool:
+    from josfe.sri_invoicing.core.pdf_emailing.handlers import _process_email
+
+    try:
+        _process_email(name)
+        return True
+    except Exception:
+        frappe.db.set_value(
+            QUEUE_DTYPE, name, "email_retry_count",
+            int(frappe.db.get_value(QUEUE_DTYPE, name, "email_retry_count") or 0) + 1,
+            update_modified=False,
+        )
+        frappe.log_error(frappe.get_traceback(), f"SRI pipeline email {name}")
+        return False
+
+
+def _run_rows(stage: Stage, batch: int, fn: Callable[[str], bool]) -> tuple:
+    names = _claim(stage, batch)
+    per_row, failed = [], 0
+    for name in names:
+        t0 = time.monotonic()
+        try:
+            ok = fn(name)
+        except Exception:
+            ok = False
+            frappe.log_error(frappe.get_traceback(), f"SRI pipeline {stage.name} {name}")
+        per_row.append(time.monotonic() - t0)
+        failed += 0 if ok else 1
+    frappe.db.commit()
+    return len(names), failed, per_row
+
+
+def _run_send(batch: int) -> tuple:
+    from josfe.sri_invoicing.core.transmission.batch import run_bulk_send
+
+    if _sri_slow():
+        batch = max(1, batch // 4)
+    summary = run_bulk_send(limit=batch, parked=0)  # parked rows drain through the breaker
+    _fail_unsent(summary.get("rows", []))
+    per_row = [float(r.get("seconds") or 0) for r in summary.get("rows", []) if r.get("seconds") is not None]
+    return summary.get("total", 0), summary.get("errors", 0), per_row
+
+
+def _fail_unsent(outcomes: List[Dict[str, Any]]) -> None:
+    """
+    Rows the send left Firmado without parking them (unreadable XML, _apply
+    failure) go to Error; otherwise the next batch would select the same
+    oldest rows again and newer ones would never be sent.
+    """
+    failed = {o["name"]: cstr(o.get("error"))[:1000] for o in outcomes if not o.get("ok") and not o.get("state")}
+    for name, error in failed.items():
+        frappe.db.sql(
+            f"""
+            UPDATE `tab{QUEUE_DTYPE}` SET state=%s, last_error=%s
+            WHERE name=%s AND state=%s AND IFNULL(waiting_sri, 0)=0
+            """,
+            (SRIQueueState.Error.value, f"Envío automático fallido: {error}", name, SRIQueueState.Firmado.value),
+        )
+        if frappe.db.sql("SELECT ROW_COUNT()")[0][0]:
+            timings.record(name, SRIQueueState.Error.value)
+    if failed:
+        frappe.db.commit()
+
+
+def run_stage(stage_name: str) -> Dict[str, Any]:
+    """Background job: drain one stage in batches until empty, blocked or out of time."""
+    stage = STAGES[stage_name]
+    batch = max(1, int(get_settings().batch_size or 20))
+    started = time.monotonic()
+    totals = {"stage": stage_name, "rows": 0, "failed": 0, "batches": 0, "blocked": None}
+
+    while time.monotonic() - started < STAGE_TIME_BUDGET_S:
+        reason = _blocked(stage_name)
+        if reason:
+            totals["blocked"] = reason
+            break
+
+        if stage_name == "send":
+            rows, failed, per_row = _run_send(batch)
+        elif stage_name == "sign":
+            rows, failed, per_row = _run_rows(stage, batch, _sign_row)
+        else:
+            rows, failed, per_row = _run_rows(stage, 1, _email_row)
+
+        if not rows:
+            break
+        _record(stage_name, rows, failed, per_row)
+        totals["rows"] += rows
+        totals["failed"] += failed
+        totals["batches"] += 1
+
+        # Hand work to the next stage right away instead of waiting for the tick
+        if stage_name == "sign":
+            kick("send")
+
+    if totals["rows"]:
+        frappe.publish_realtime(QUEUE_EVENT, {"bulk": True, "action": f"pipeline:{stage_name}"},
+                                user=None, doctype=QUEUE_DTYPE)
+        frappe.logger("sri_flow").info(f"[PIPELINE] {totals}")
+    return totals
+
+
+def kick(stage_name: str) -> None:
+    """Enqueue the stage's slot jobs (deduplicated: a queued/running slot absorbs the call)."""
+    stage = STAGES[stage_name]
+    for slot in range(_slots(stage_name)):
+        frappe.enqueue(
+            JOB_METHOD,
+            queue=stage.queue,
+            timeout=STAGE_TIME_BUDGET_S * 2 + 600,
+            job_id=f"sri_pipeline:{frappe.local.site}:{stage_name}:{slot}",
+            deduplicate=True,
+            enqueue_after_commit=True,
+            stage_name=stage_name,
+        )
+
+
+def tick() -> None:
+    """Scheduler (every minute): start the slots of every stage with work and no backpressure."""
+    if not is_enabled():
+        return
+    for stage_name in RUNNABLE:
+        if _depth(STAGES[stage_name]) and not _blocked(stage_name):
+            kick(stage_name)
+
+
+# ------------------------------
+# Whitelisted API
+# ------------------------------
+@frappe.whitelist()
+def get_pipeline_metrics(minutes: int = 60) -> Dict[str, Any]:
+    """Per-stage queue depth, oldest row age, throughput and latency; plus the likely bottleneck."""
+    frappe.only_for(("System Manager", "Accounts Manager"))
+
+    since = time.time() - int(minutes or 60) * 60
+    now = now_datetime()
+    out: Dict[str, Any] = {"enabled": is_enabled(), "minutes": int(minutes or 60), "stages": {}}
+
+    for name, stage in STAGES.items():
+        where, values = _where(stage)
+        oldest_ts = frappe.db.sql(f"SELECT MIN(modified) FROM `tab{QUEUE_DTYPE}` WHERE {where}", values)[0][0]
+        batches = _batches(name, since) if name in RUNNABLE else []
+        per_row = sorted(x for b in batches for x in b.get("per_row", []))
+        rows = sum(int(b.get("rows") or 0) for b in batches)
+        out["stages"][name] = {
+            "from_state": stage.from_state.value,
+            "depth": _depth(stage),
+            "oldest_age_s": round(time_diff_in_seconds(now, oldest_ts), 1) if oldest_ts else 0,
+            "processed": rows,
+            "failed": sum(int(b.get("failed") or 0) for b in batches),
+            "per_min": round(rows / max(1.0, int(minutes or 60)), 2),
+            "latency_s": {"p50": round(percentile(per_row, 50), 3), "p95": round(percentile(per_row, 95), 3)},
+            "slots": _slots(name) if name in RUNNABLE else None,
+            "blocked": _blocked(name) if name in RUNNABLE else None,
+        }
+
+    waiting = {k: v for k, v in out["stages"].items() if v["depth"]}
+    out["bottleneck"] = max(waiting, key=lambda k: waiting[k]["oldest_age_s"]) if waiting else None
+    out["sri_slow"] = _sri_slow()
+    return out
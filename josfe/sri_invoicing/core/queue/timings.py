@@ -0,0 +1,177 @@
+# -*- coding: utf-8 -*-
+# apps/josfe/josfe/sri_invoicing/core/queue/timings.py
+"""
+Per-stage timestamps of SRI XML Queue rows (SRI Queue Stage Log).
+
+last_transition_at on the row is overwritten at every step; here each stage a
+row reaches gets one append-only record (raw INSERT, never updated):
+
+    Generado · Firmado · Enviado · Autorizado / Devuelto · PDF · Email
+    (+ Error / Cancelado and Generado again on retries)
+
+work_ms is our own processing time for the step (build, firma, RIDE, email),
+sri_ms the time spent waiting on the SRI web services in that step. The wait
+of a stage is measured from the previous record of the same row (the first
+one from submitted_at / creation of the row).
+
+get_stage_timings() returns p50/p95/p99 grouped by stage, ambiente,
+warehouse and/or hour.
+"""
+from __future__ import annotations
+
+import time
+from collections import defaultdict
+from typing import Any, Dict, List, Optional
+
+import frappe
+from frappe.utils import add_to_date, cint, now_datetime, time_diff_in_seconds
+
+from josfe.sri_invoicing.core.utils.stats import percentile
+
+LOG_DTYPE = "SRI Queue Stage Log"
+QUEUE_DTYPE = "SRI XML Queue"
+
+STAGES = ("Generado", "Firmado", "Enviado", "Autorizado", "Devuelto", "Error", "Cancelado", "PDF", "Email")
+GROUP_KEYS = ("stage", "ambiente", "warehouse", "hour")
+
+# Safety cap for one report run
+MAX_EVENTS = 500_000
+
+
+def ms_since(t0: float) -> int:
+    """Milliseconds elapsed since a time.monotonic() mark."""
+    return int(round((time.monotonic() - t0) * 1000))
+
+
+# ------------------------------
+# Recording
+# ------------------------------
+def _ambiente_for_company(company: Optional[str]) -> Optional[str]:
+    cache = frappe.local.__dict__.setdefault("sri_stage_ambiente", {})
+    if company not in cache:
+        cache[company] = frappe.db.get_value(
+            "Credenciales SRI", {"company": company, "jos_activo": 1}, "jos_ambiente"
+        ) if company else None
+    return cache[company]
+
+
+def _row_context(qdoc) -> tuple:
+    """(name, warehouse, ambiente) from a queue doc or a queue name."""
+    if isinstance(qdoc, str):
+        qdoc = frappe.db.get_value(
+            QUEUE_DTYPE, qdoc,
+            ["name", "company", "custom_jos_level3_warehouse", "sri_ambiente"],
+            as_dict=True,
+        ) or frappe._dict(name=qdoc)
+    ambiente = qdoc.get("sri_ambiente") or _ambiente_for_company(qdoc.get("company"))
+    return qdoc.get("name"), qdoc.get("custom_jos_level3_warehouse"), ambiente
+
+
+def record(qdoc, stage: str, work_ms: Optional[int] = None, sri_ms: Optional[int] = None,
+           ambiente: Optional[str] = None) -> None:
+    """Append one stage record in the caller's transaction. Never raises."""
+    try:
+        name, warehouse, row_ambiente = _row_context(qdoc)
+        if not name or stage not in STAGES:
+            return
+        now = now_datetime()
+        user = frappe.session.user if getattr(frappe.local, "session", None) else "Administrator"
+        frappe.db.sql(
+            f"""
+            INSERT INTO `tab{LOG_DTYPE}`
+                (name, creation, modified, owner, modified_by, docstatus, idx,
+                 queue, stage, `at`, work_ms, sri_ms, ambiente, warehouse)
+            VALUES (%s, %s, %s, %s, %s, 0, 0, %s, %s, %s, %s, %s, %s, %s)
+            """,
+            (
+                frappe.generate_hash(length=10), now, now, user, user,
+                name, stage, now, work_ms, sri_ms, ambiente or row_ambiente, warehouse,
+            ),
+        )
+    except Exception:
+        frappe.log_error(frappe.get_traceback(), "SRI stage timing")
+
+
+# ------------------------------
+# Report
+# ------------------------------
+def _summary(values: List[float], scale: float = 1.0, digits: int = 3) -> Dict[str, float]:
+    values = sorted(values)
+    return {
+        "p50": round(percentile(values, 50) * scale, digits),
+        "p95": round(percentile(values, 95) * scale, digits),
+        "p99": round(percentile(values, 99) * scale, digits),
+        "max": round((values[-1] if values else 0) * scale, digits),
+    }
+
+
+def _events(since) -> List[frappe._dict]:
+    """Every record of the rows that reached some stage since `since`, in row/time order."""
+    return frappe.db.sql(
+        f"""
+        SELECT l.queue, l.stage, l.`at`, l.work_ms, l.sri_ms, l.ambiente, l.warehouse,
+               IFNULL(q.submitted_at, q.creation) AS started_at
+        FROM `tab{LOG_DTYPE}` l
+        JOIN `tab{QUEUE_DTYPE}` q ON q.name = l.queue
+        WHERE l.queue IN (SELECT DISTINCT queue FROM `tab{LOG_DTYPE}` WHERE `at` >= %s)
+        ORDER BY l.queue, l.`at`
+        LIMIT %s
+        """,
+        (since, MAX_EVENTS),
+        as_dict=True,
+    )
+
+
+@frappe.whitelist()
+def get_stage_timings(hours: int = 24, group_by: str = "stage") -> Dict[str, Any]:
+    """
+    Wait / work / SRI time percentiles per stage over the last `hours`.
+    group_by: comma-separated subset of stage, ambiente, warehouse, hour.
+    """
+    frappe.only_for(("System Manager", "Accounts Manager"))
+
+    keys = [k.strip() for k in (group_by or "stage").split(",") if k.strip()]
+    bad = [k for k in keys if k not in GROUP_KEYS]
+    if bad:
+        frappe.throw(f"group_by no soportado: {', '.join(bad)} (use {', '.join(GROUP_KEYS)})")
+
+    hours = cint(hours) or 24
+    since = add_to_date(now_datetime(), hours=-hours)
+
+    groups: Dict[tuple, Dict[str, list]] = defaultdict(lambda: {"wait": [], "work": [], "sri": []})
+    prev_queue, prev_at = None, None
+    for e in _events(since):
+        if e.queue != prev_queue:
+            prev_queue, prev_at = e.queue, e.started_at
+        wait = max(0.0, time_diff_in_seconds(e.at, prev_at)) if prev_at else None
+        prev_at = e.at
+        if e.at < since:
+            continue
+
+        parts = {
+            "stage": e.stage,
+            "ambiente": e.ambiente or "",
+            "warehouse": e.warehouse or "",
+            "hour": e.at.strftime("%Y-%m-%d %H:00"),
+        }
+        g = groups[tuple(parts[k] for k in keys)]
+        if wait is not None:
+            g["wait"].append(wait)
+        if e.work_ms is not None:
+            g["work"].append(e.work_ms)
+        if e.sri_ms is not None:
+            g["sri"].append(e.sri_ms)
+
+    rows = []
+    for key in sorted(groups):
+        g = groups[key]
+        row = dict(zip(keys, key))
+        row.update({
+            "count": len(g["wait"]),
+            "wait_s": _summary(g["wait"]),
+            "work_ms": _summary(g["work"], digits=0),
+            "sri_ms": _summary(g["sri"], digits=0),
+        })
+        rows.append(row)
+
+    return {"hours": hours, "group_by": keys, "rows": rows}
@@ -0,0 +1,289 @@
+# -*- coding: utf-8 -*-
+# apps/josfe/josfe/sri_invoicing/core/signing/batch.py
+
+from __future__ import annotations
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Any, Dict, List, Optional
+
+import frappe
+from frappe.utils import cstr, now_datetime
+
+from josfe.sri_invoicing.core.queue import timings
+from josfe.sri_invoicing.doctype.fe_settings.fe_settings import get_settings
+from josfe.sri_invoicing.doctype.sri_xml_queue.sri_xml_queue import SRIQueueState
+from josfe.sri_invoicing.xml import atomic, journal, paths
+
+QUEUE_DTYPE = "SRI XML Queue"
+QUEUE_EVENT = "sri_xml_queue_changed"
+BULK_ROLES = ("System Manager", "Accounts Manager", "FE Admin")
+
+
+# ------------------------------
+# Selection
+# ------------------------------
+def _select_generados(
+    company: Optional[str] = None,
+    warehouse: Optional[str] = None,
+    from_date: Optional[str] = None,
+    to_date: Optional[str] = None,
+    limit: int = 0,
+) -> List[dict]:
+    filters: Dict[str, Any] = {"state": SRIQueueState.Generado.value, "xml_file": ["is", "set"]}
+    if company:
+        filters["company"] = company
+    if warehouse:
+        filters["custom_jos_level3_warehouse"] = warehouse
+    if from_date and to_date:
+        filters["posting_date"] = ["between", [from_date, to_date]]
+    elif from_date:
+        filters["posting_date"] = [">=", from_date]
+    elif to_date:
+        filters["posting_date"] = ["<=", to_date]
+
+    return frappe.get_all(
+        QUEUE_DTYPE,
+        filters=filters,
+        fields=["name", "company", "xml_file"],
+        order_by="posting_date asc, name asc",
+        limit_page_length=int(limit or 0),
+    )
+
+
+def _credentials_for(companies: set) -> Dict[str, tuple]:
+    """company -> (cred_name, key_pem, cert_pem) for companies with usable PEMs."""
+    out: Dict[str, tuple] = {}
+    for company in companies:
+        cred_name = frappe.db.get_value("Credenciales SRI", {"company": company, "jos_activo": 1}, "name")
+        if not cred_name:
+            continue
+        key_pem = frappe.get_site_path("private", "files", f"{cred_name}_private.pem")
+        cert_pem = frappe.get_site_path("private", "files", f"{cred_name}_cert.pem")
+        if os.path.exists(key_pem) and os.path.exists(cert_pem):
+            out[company] = (cred_name, os.path.abspath(key_pem), os.path.abspath(cert_pem))
+    return out
+
+
+# ------------------------------
+# Worker-process side (files + crypto only, no frappe context)
+# ------------------------------
+def _init_worker(creds: List[tuple]) -> None:
+    """Load every key/cert once per worker process."""
+    from josfe.sri_invoicing.core.signing import signer
+
+    for cred_name, key_pem, cert_pem in creds:
+        signer.load_material(cred_name, key_pem, cert_pem)
+
+
+def _sign_one(name: str, src: str, dest: str, cred: tuple) -> Dict[str, Any]:
+    """Sign GENERADOS/<file> into FIRMADOS/<file>; the source is left for the parent to drop."""
+    from josfe.sri_invoicing.core.signing import signer
+    from josfe.sri_invoicing.xml.xades_template import inject_signature_tree
+
+    t0 = time.monotonic()
+    try:
+        material = signer.load_material(*cred)
+        with open(src, "r", encoding="utf-8") as f:
+            root = inject_signature_tree(f.read(), material.cert_bits)
+        signed = signer.sign_tree(root, material.private_key)
+        atomic.write_bytes(dest, signed)
+        return {"name": name, "ok": True, "seconds": round(time.monotonic() - t0, 4)}
+    except Exception as e:
+        return {"name": name, "ok": False, "error": f"{type(e).__name__}: {e}"}
+
+
+# ------------------------------
+# Parent side (DB + files)
+# ------------------------------
+def _flush(done: List[Dict[str, Any]], tasks: Dict[str, dict], user: str) -> None:
+    """Finish the file moves and write one bulk UPDATE + one commit for a chunk of results."""
+    names = [d["name"] for d in done]
+    current = {
+        r.name: r for r in frappe.get_all(
+            QUEUE_DTYPE, filters={"name": ["in", names]}, fields=["name", "state", "xml_file"],
+        )
+    }
+
+    now = now_datetime()
+    updates: Dict[str, dict] = {}
+    for d in done:
+        name = d["name"]
+        row = current.get(name)
+        if not row or row.state != SRIQueueState.Generado.value:
+            d.update(ok=False, error="Estado cambió durante la firma")
+            # Nobody will point at the copy just signed, unless the row got there on its own
+            if d["ok"] and (not row or row.xml_file != tasks[name]["url"]):
+                atomic.remove(tasks[name]["dest"])
+            continue
+        if not d["ok"]:
+            updates[name] = {"last_error": cstr(d.get("error"))[:1000]}
+            continue
+
+        task = tasks[name]
+        # GENERADOS copy is dropped once the chunk commits (or FIRMADOS one on rollback)
+        journal.record_supersede(task["src_url"], task["url"])
+        updates[name] = {
+            "state": SRIQueueState.Firmado.value,
+            "xml_file": task["url"],
+            "last_error": "",
+            "last_transition_at": now,
+            "last_transition_by": user,
+        }
+
+    if updates:
+        # Plain UPDATEs: on_update would try to sign the row again
+        frappe.db.bulk_update(QUEUE_DTYPE, updates)
+        seconds = {d["name"]: d.get("seconds") or 0 for d in done}
+        for name, vals in updates.items():
+            if vals.get("state") == SRIQueueState.Firmado.value:
+                timings.record(name, "Firmado", work_ms=int(seconds[name] * 1000))
+                frappe.get_doc({
+                    "doctype": "Comment",
+                    "comment_type": "Comment",
+                    "reference_doctype": QUEUE_DTYPE,
+                    "reference_name": name,
+                    "content": "✔ XML firmado correctamente (firma masiva).",
+                }).insert(ignore_permissions=True)
+    frappe.db.commit()
+
+
+def _flush_chunk(chunk, tasks, user, outcomes, total) -> None:
+    try:
+        _flush(chunk, tasks, user)
+    except Exception as e:
+        frappe.db.rollback()
+        frappe.log_error(frappe.get_traceback(), "SRI bulk sign flush")
+        for d in chunk:
+            d.update(ok=False, error=cstr(e))
+    outcomes.extend(chunk)
+    frappe.publish_realtime(
+        QUEUE_EVENT,
+        {"bulk": True, "action": "sign", "done": len(outcomes), "total": total},
+        user=None,
+        doctype=QUEUE_DTYPE,
+    )
+
+
+def run_bulk_sign(
+    company: Optional[str] = None,
+    warehouse: Optional[str] = None,
+    from_date: Optional[str] = None,
+    to_date: Optional[str] = None,
+    limit: int = 0,
+    max_workers: Optional[int] = None,
+) -> Dict[str, Any]:
+    """
+    Background job: sign every Generado row matching the filter.
+    RSA + C14N run in a process pool sized to the host's cores (each worker keeps
+    its keys loaded); file moves and DB updates are applied here in chunks of
+    FE Settings.batch_size, with a progress event on 'sri_xml_queue_changed'.
+    """
+    started = time.monotonic()
+    settings = get_settings()
+    workers = max(1, int(max_workers or os.cpu_count() or 1))
+    progress_every = max(1, int(settings.batch_size or 20))
+    user = frappe.session.user
+
+    rows = _select_generados(company, warehouse, from_date, to_date, limit)
+    creds = _credentials_for({r.company for r in rows})
+    outcomes: List[Dict[str, Any]] = []
+
+    # 1) Resolve paths here (site paths need frappe)
+    tasks: Dict[str, dict] = {}
+    for r in rows:
+        if r.company not in creds:
+            outcomes.append({"name": r.name, "ok": False, "error": "Sin Credenciales SRI activas / PEM"})
+            continue
+        src = os.path.abspath(paths.resolve(r.xml_file))
+        filename = os.path.basename(src)
+        shard = paths.shard_of(r.xml_file)
+        tasks[r.name] = {
+            "src": src,
+            "src_url": r.xml_file,
+            "dest": os.path.abspath(paths.abs_path(paths.SIGNED, filename, shard)),
+            "url": paths.to_file_url(paths.SIGNED, filename, shard),
+            "cred": creds[r.company],
+        }
+
+    # 2) Fan out; spawn keeps the children clear of the job's DB/Redis sockets
+    pending: List[Dict[str, Any]] = []
+    if tasks:
+        ctx = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(
+            max_workers=min(workers, len(tasks)),
+            mp_context=ctx,
+            initializer=_init_worker,
+            initargs=(list(set(creds.values())),),
+        ) as pool:
+            futures = [
+                pool.submit(_sign_one, name, t["src"], t["dest"], t["cred"])
+                for name, t in tasks.items()
+            ]
+
+            # 3) Apply results in chunks as they arrive
+            for fut in as_completed(futures):
+                pending.append(fut.result())
+                if len(pending) >= progress_every:
+                    _flush_chunk(pending, tasks, user, outcomes, len(rows))
+                    pending = []
+
+    if pending:
+        _flush_chunk(pending, tasks, user, outcomes, len(rows))
+
+    elapsed = time.monotonic() - started
+    summary = {
+        "total": len(rows),
+        "ok": sum(1 for o in outcomes if o.get("ok")),
+        "errors": sum(1 for o in outcomes if not o.get("ok")),
+        "elapsed_s": round(elapsed, 3),
+        "throughput_per_s": round(len(outcomes) / elapsed, 2) if elapsed else 0,
+        "workers": workers,
+        "rows": outcomes,
+    }
+
+    frappe.logger("sri_flow").info(
+        f"[BULK SIGN] total={summary['total']} ok={summary['ok']} errors={summary['errors']} "
+        f"elapsed={summary['elapsed_s']}s rate={summary['throughput_per_s']}/s workers={workers}"
+    )
+    frappe.publish_realtime(
+        QUEUE_EVENT,
+        {"bulk": True, "action": "sign", "done": len(outcomes), "total": len(rows), "finished": True,
+         "ok": summary["ok"], "errors": summary["errors"]},
+        user=None,
+        doctype=QUEUE_DTYPE,
+    )
+    return summary
+
+
+# ------------------------------
+# Whitelisted API
+# ------------------------------
+@frappe.whitelist()
+def enqueue_bulk_sign(
+    company: Optional[str] = None,
+    warehouse: Optional[str] = None,
+    from_date: Optional[str] = None,
+    to_date: Optional[str] = None,
+    limit: int = 0,
+    max_workers: Optional[int] = None,
+) -> Dict[str, Any]:
+    """Queue a background 'sign all pending' job; progress arrives on 'sri_xml_queue_changed'."""
+    frappe.only_for(BULK_ROLES)
+
+    matched = len(_select_generados(company, warehouse, from_date, to_date, limit))
+    job_name = f"sri_bulk_sign:{frappe.generate_hash(length=8)}"
+    frappe.enqueue(
+        "josfe.sri_invoicing.core.signing.batch.run_bulk_sign",
+        queue="long",
+        timeout=4 * 3600,
+        job_name=job_name,
+        company=company,
+        warehouse=warehouse,
+        from_date=from_date,
+        to_date=to_date,
+        limit=int(limit or 0),
+        max_workers=int(max_workers) if max_workers else None,
+    )
+    return {"queued": matched, "job_name": job_name}
@@ -0,0 +1,217 @@
+# apps/josfe/josfe/sri_invoicing/core/signing/signer.py
+"""
+In-process XAdES-BES signer (lxml + cryptography).
+
+Fills the <ds:Signature> template produced by xml.xades_template exactly the
+way `xmlsec1 --sign` does (RSA-SHA1, SHA1 digests, inclusive C14N 1.0), so the
+signed bytes are identical to the xmlsec1 output for the same template.
+xml.signer.sign_with_xmlsec stays available as a fallback engine.
+"""
+from __future__ import annotations
+
+import base64
+import os
+import threading
+from dataclasses import dataclass
+
+from lxml import etree
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import padding
+
+from josfe.sri_invoicing.xml.xades_template import DS, DS_NS, cert_bits_from_pem
+
+# ------------------------------
+# Algorithms (the only ones our template emits)
+# ------------------------------
+ALG_C14N = "http://www.w3.org/TR/2001/REC-xml-c14n-20010315"
+ALG_ENVELOPED = "http://www.w3.org/2000/09/xmldsig#enveloped-signature"
+ALG_SHA1 = "http://www.w3.org/2000/09/xmldsig#sha1"
+ALG_RSA_SHA1 = "http://www.w3.org/2000/09/xmldsig#rsa-sha1"
+
+# xmlsec1 writes <ds:SignatureValue> base64 wrapped at 64 columns
+SIGNATURE_VALUE_LINE = 64
+
+# Encoding declared by xml.utils.format_xml_bytes (i.e. by every template file)
+TEMPLATE_ENCODING = "utf-8"
+
+NS = {"ds": DS_NS}
+
+
+class SigningError(Exception):
+    pass
+
+
+@dataclass(frozen=True)
+class SigningMaterial:
+    private_key: object
+    cert_bits: tuple  # (cert_b64_der, issuer_name, serial_number, sha1_digest_b64)
+    stamp: tuple      # (key mtime, cert mtime) used to detect re-exported PEMs
+
+
+# ------------------------------
+# Key/cert cache per Credenciales SRI
+# ------------------------------
+_MATERIAL: dict[str, SigningMaterial] = {}
+_MATERIAL_LOCK = threading.Lock()
+
+
+def _stamp(*paths: str) -> tuple:
+    return tuple(os.stat(p).st_mtime_ns for p in paths)
+
+
+def load_material(cred_name: str, key_pem_path: str, cert_pem_path: str) -> SigningMaterial:
+    """
+    Parsed private key + certificate bits for one Credenciales SRI.
+    Cached per process; reloaded when 'Validar Firma' rewrites the PEM files.
+    """
+    stamp = _stamp(key_pem_path, cert_pem_path)
+    cached = _MATERIAL.get(cred_name)
+    if cached and cached.stamp == stamp:
+        return cached
+
+    with _MATERIAL_LOCK:
+        cached = _MATERIAL.get(cred_name)
+        if cached and cached.stamp == stamp:
+            return cached
+        with open(key_pem_path, "rb") as f:
+            private_key = serialization.load_pem_private_key(f.read(), password=None)
+        with open(cert_pem_path, "rb") as f:
+            cert_bits = cert_bits_from_pem(f.read())
+        material = SigningMaterial(private_key=private_key, cert_bits=cert_bits, stamp=stamp)
+        _MATERIAL[cred_name] = material
+        return material
+
+
+def clear_material(cred_name: str | None = None) -> None:
+    with _MATERIAL_LOCK:
+        if cred_name:
+            _MATERIAL.pop(cred_name, None)
+        else:
+            _MATERIAL.clear()
+
+
+# ------------------------------
+# Reference resolution + digests
+# ------------------------------
+def _resolve(root: etree._Element, uri: str) -> etree._Element:
+    """
+    Same ID rules we hand to xmlsec1: `id` on the document root,
+    `Id` on SignedProperties / KeyInfo.
+    """
+    if not uri.startswith("#"):
+        raise SigningError(f"Unsupported Reference URI: {uri!r}")
+    ref_id = uri[1:]
+    if root.get("id") == ref_id:
+        return root
+    for el in root.iter(DS + "KeyInfo", "{*}SignedProperties"):
+        if el.get("Id") == ref_id:
+            return el
+    raise SigningError(f"Reference target not found: {uri}")
+
+
+def _c14n(node: etree._Element) -> bytes:
+    return etree.tostring(node, method="c14n", exclusive=False, with_comments=False)
+
+
+def _c14n_enveloped(node: etree._Element, signature: etree._Element) -> bytes:
+    """C14N of `node` with the enclosing <ds:Signature> cut out (its tail text kept)."""
+    parent = signature.getparent()
+    index = parent.index(signature)
+    tail = signature.tail
+    prev = signature.getprevious()
+
+    # lxml drops the tail together with the element; hand it to the neighbour
+    if tail:
+        if prev is not None:
+            prev_tail = prev.tail
+            prev.tail = (prev_tail or "") + tail
+        else:
+            prev_text = parent.text
+            parent.text = (prev_text or "") + tail
+    parent.remove(signature)
+    try:
+        return _c14n(node)
+    finally:
+        if tail:
+            if prev is not None:
+                prev.tail = prev_tail
+            else:
+                parent.text = prev_text
+        parent.insert(index, signature)
+        signature.tail = tail
+
+
+def _b64(data: bytes) -> str:
+    return base64.b64encode(data).decode("ascii")
+
+
+def _wrap(b64: str, width: int = SIGNATURE_VALUE_LINE) -> str:
+    return "\n".join(b64[i:i + width] for i in range(0, len(b64), width))
+
+
+def _digest(reference: etree._Element, root: etree._Element, signature: etree._Element) -> str:
+    method = reference.find("ds:DigestMethod", NS)
+    if method is None or method.get("Algorithm") != ALG_SHA1:
+        raise SigningError("Only SHA1 DigestMethod is supported")
+
+    target = _resolve(root, reference.get("URI") or "")
+    algs = [t.get("Algorithm") for t in reference.findall("ds:Transforms/ds:Transform", NS)]
+    for alg in algs:
+        if alg not in (ALG_ENVELOPED, ALG_C14N):
+            raise SigningError(f"Unsupported Transform: {alg}")
+
+    if ALG_ENVELOPED in algs:
+        data = _c14n_enveloped(target, signature)
+    else:
+        data = _c14n(target)
+
+    h = hashes.Hash(hashes.SHA1())
+    h.update(data)
+    return _b64(h.finalize())
+
+
+# ------------------------------
+# Public API
+# ------------------------------
+def _declaration(encoding: str | None) -> bytes:
+    # xmlsec1 --output goes through xmlDocDump: double quotes, declared encoding kept as-is
+    if encoding:
+        return f'<?xml version="1.0" encoding="{encoding}"?>\n'.encode("ascii")
+    return b'<?xml version="1.0"?>\n'
+
+
+def sign_tree(root: etree._Element, private_key, encoding: str | None = TEMPLATE_ENCODING) -> bytes:
+    """
+    Fill DigestValue/SignatureValue of the template inside `root` (in place)
+    and return the serialized document, byte-identical to xmlsec1 --output
+    for a file declaring `encoding`.
+    """
+    signature = root.find(".//ds:Signature", NS)
+    if signature is None:
+        raise SigningError("No <ds:Signature> template in document")
+    signed_info = signature.find("ds:SignedInfo", NS)
+    sig_value = signature.find("ds:SignatureValue", NS)
+    if signed_info is None or sig_value is None:
+        raise SigningError("Incomplete <ds:Signature> template")
+
+    c14n_alg = signed_info.find("ds:CanonicalizationMethod", NS)
+    sig_alg = signed_info.find("ds:SignatureMethod", NS)
+    if c14n_alg is None or c14n_alg.get("Algorithm") != ALG_C14N:
+        raise SigningError("Only inclusive C14N 1.0 is supported")
+    if sig_alg is None or sig_alg.get("Algorithm") != ALG_RSA_SHA1:
+        raise SigningError("Only RSA-SHA1 SignatureMethod is supported")
+
+    # References are digested in document order, like xmlsec1
+    for reference in signed_info.findall("ds:Reference", NS):
+        reference.find("ds:DigestValue", NS).text = _digest(reference, root, signature)
+
+    raw = private_key.sign(_c14n(signed_info), padding.PKCS1v15(), hashes.SHA1())
+    sig_value.text = _wrap(_b64(raw))
+
+    return _declaration(encoding) + etree.tostring(root, encoding="UTF-8") + b"\n"
+
+
+def sign_xml(xml_bytes: bytes, private_key) -> bytes:
+    """Bytes in, bytes out; parses exactly like the xmlsec1 CLI does."""
+    root = etree.fromstring(xml_bytes, etree.XMLParser())
+    return sign_tree(root, private_key, encoding=root.getroottree().docinfo.encoding)
@@ -0,0 +1,251 @@
+# -*- coding: utf-8 -*-
+# apps/josfe/josfe/sri_invoicing/transmission/batch.py
+
+from __future__ import annotations
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Any, Dict, List, Optional
+
+import frappe
+from frappe.utils import cstr
+
+from josfe.sri_invoicing.core.transmission import breaker, soap, tracing
+from josfe.sri_invoicing.doctype.fe_settings.fe_settings import get_settings
+from josfe.sri_invoicing.doctype.sri_xml_queue.sri_xml_queue import SRIQueueState
+from josfe.sri_invoicing.xml import comprobante, service as xml_service
+
+QUEUE_DTYPE = "SRI XML Queue"
+PROGRESS_EVENT = "sri_bulk_send_progress"
+BULK_ROLES = ("System Manager", "Accounts Manager", "FE Admin")
+
+
+# ------------------------------
+# Selection
+# ------------------------------
+def _select_firmados(
+    company: Optional[str] = None,
+    warehouse: Optional[str] = None,
+    from_date: Optional[str] = None,
+    to_date: Optional[str] = None,
+    limit: int = 0,
+    parked: Optional[int] = None,
+) -> List[dict]:
+    """parked: None = every Firmado row, 0 = skip rows waiting for SRI, 1 = only those."""
+    filters: Dict[str, Any] = {"state": SRIQueueState.Firmado.value}
+    if parked is not None:
+        filters["waiting_sri"] = 1 if int(parked) else 0
+    if company:
+        filters["company"] = company
+    if warehouse:
+        filters["custom_jos_level3_warehouse"] = warehouse
+    if from_date and to_date:
+        filters["posting_date"] = ["between", [from_date, to_date]]
+    elif from_date:
+        filters["posting_date"] = [">=", from_date]
+    elif to_date:
+        filters["posting_date"] = ["<=", to_date]
+
+    return frappe.get_all(
+        QUEUE_DTYPE,
+        filters=filters,
+        fields=["name", "xml_file"],
+        order_by="posting_date asc, name asc",
+        limit_page_length=int(limit or 0),
+    )
+
+
+# ------------------------------
+# Worker-thread side (network only, no frappe context)
+# ------------------------------
+def _send_one(rec: tuple, aut: tuple, xml_bytes: bytes, ambiente: str, clave: str) -> Dict[str, Any]:
+    """Recepción and, unless truly DEVUELTA, the first Autorización query."""
+    t0 = time.monotonic()
+    rc = soap.recepcion_call(rec[0], rec[1], xml_bytes, ambiente)
+    out: Dict[str, Any] = {"recepcion": rc, "clave": clave, "recepcion_s": time.monotonic() - t0}
+    if not breaker.failed(rc) and not (
+        rc.get("estado") in {"DEVUELTA", "RECHAZADO"} and not xml_service.is_id_43(rc.get("mensajes"))
+    ):
+        t1 = time.monotonic()
+        out["autorizacion"] = soap.autorizacion_call(aut[0], aut[1], clave)
+        out["autorizacion_s"] = time.monotonic() - t1
+    out["seconds"] = round(time.monotonic() - t0, 3)
+    return out
+
+
+# ------------------------------
+# Parent side (DB + files)
+# ------------------------------
+def _apply(name: str, prefetched: Dict[str, Any]) -> Dict[str, Any]:
+    """Run the usual state/file logic with the SRI responses obtained by the pool."""
+    qdoc = frappe.get_doc(QUEUE_DTYPE, name)
+    if cstr(qdoc.state) != SRIQueueState.Firmado.value:
+        return {"name": name, "ok": False, "state": qdoc.state, "error": "Estado cambió durante el envío"}
+
+    qdoc.db_set({"state": SRIQueueState.Enviado.value, "waiting_sri": 0})
+    qdoc.state = SRIQueueState.Enviado.value
+    frappe.flags.sri_devuelto_origin = None
+    xml_service._process_transmission(qdoc, SRIQueueState.Enviado.value, prefetched=prefetched)
+    frappe.db.commit()
+
+    return {
+        "name": name,
+        "ok": True,
+        "state": frappe.db.get_value(QUEUE_DTYPE, name, "state"),
+        "recepcion": (prefetched.get("recepcion") or {}).get("estado"),
+        "autorizacion": (prefetched.get("autorizacion") or {}).get("estado"),
+        "seconds": prefetched.get("seconds"),
+    }
+
+
+def run_bulk_send(
+    company: Optional[str] = None,
+    warehouse: Optional[str] = None,
+    from_date: Optional[str] = None,
+    to_date: Optional[str] = None,
+    limit: int = 0,
+    max_in_flight: Optional[int] = None,
+    parked: Optional[int] = None,
+) -> Dict[str, Any]:
+    """
+    Background job: send every Firmado row matching the filter to SRI.
+    SOAP calls run in one thread pool per ambiente, submitted in windows of
+    the breaker's current adaptive limit (capped by max_in_flight); results
+    are applied here, in the job's own thread, as they complete. Before each
+    window the Recepción breaker is asked again: once it rejects, the rows
+    still waiting are parked (half-open: the window is one probe row).
+    """
+    started = time.monotonic()
+    settings = get_settings()
+    per_ambiente = max(1, int(max_in_flight or settings.sri_max_in_flight or 8))
+    progress_every = max(1, int(settings.batch_size or 20))
+    user = frappe.session.user
+
+    rows = _select_firmados(company, warehouse, from_date, to_date, limit, parked=parked)
+    outcomes: List[Dict[str, Any]] = []
+
+    # 1) Load payloads (parent thread: needs site paths)
+    pending = []
+    for r in rows:
+        try:
+            comp = comprobante.load(xml_service._abs_from_url(r.xml_file))
+        except Exception as e:
+            outcomes.append({"name": r.name, "ok": False, "error": f"XML ilegible: {e}"})
+            continue
+        pending.append((r.name, comp.to_bytes(), comp.ambiente, comp.clave))
+
+    # 2) Per ambiente, windows of the breaker's current limit; admission is asked
+    #    again before every window, so rows left when it opens are parked, not sent
+    queues: Dict[str, List[tuple]] = {}
+    for p in pending:
+        queues.setdefault(p[2], []).append(p)
+    clients: Dict[str, tuple] = {}
+    pools: Dict[str, ThreadPoolExecutor] = {}
+
+    def _park(group: List[tuple]) -> None:
+        breaker.park([p[0] for p in group], "SRI no disponible (circuito abierto); envío en espera")
+        frappe.db.commit()
+        for p in group:
+            outcomes.append({"name": p[0], "ok": False, "state": "Esperando SRI", "error": "Circuito SRI abierto"})
+
+    try:
+        while queues:
+            futures = {}
+            for amb in sorted(queues):
+                group = queues[amb]
+                decision = breaker.admit("Recepción", amb)
+                if decision is breaker.REJECT:
+                    _park(queues.pop(amb))
+                    continue
+                size = 1 if decision == breaker.PROBE else min(per_ambiente, breaker.limit("Recepción", amb))
+                window, queues[amb] = group[:size], group[size:]
+                if not queues[amb]:
+                    queues.pop(amb)
+
+                if amb not in pools:
+                    clients[amb] = (soap.get_client("Recepción", amb), soap.get_client("Autorización", amb))
+                    pools[amb] = ThreadPoolExecutor(
+                        max_workers=per_ambiente, thread_name_prefix=f"sri-send-{amb[:4]}",
+                        initializer=tracing.bind_site, initargs=(frappe.local.site,),
+                    )
+                rec, aut = clients[amb]
+                for name, xml_bytes, _amb, clave in window:
+                    futures[pools[amb].submit(_send_one, rec, aut, xml_bytes, amb, clave)] = (name, amb)
+
+            # 3) Apply the window's outcomes as they arrive
+            for fut in as_completed(futures):
+                name, amb = futures[fut]
+                try:
+                    result = fut.result()
+                    breaker.record_result("Recepción", amb, result.get("recepcion"), result.get("recepcion_s"))
+                    if "autorizacion" in result:
+                        breaker.record_result("Autorización", amb, result["autorizacion"], result.get("autorizacion_s"))
+                    outcomes.append(_apply(name, result))
+                except Exception as e:
+                    frappe.db.rollback()
+                    frappe.log_error(frappe.get_traceback(), f"SRI bulk send {name}")
+                    outcomes.append({"name": name, "ok": False, "error": cstr(e)})
+
+                if len(outcomes) % progress_every == 0:
+                    frappe.publish_realtime(
+                        PROGRESS_EVENT, {"done": len(outcomes), "total": len(rows)}, user=user
+                    )
+    finally:
+        for pool in pools.values():
+            pool.shutdown(wait=True)
+
+    elapsed = time.monotonic() - started
+    by_state: Dict[str, int] = {}
+    for o in outcomes:
+        key = o.get("state") or "Error"
+        by_state[key] = by_state.get(key, 0) + 1
+
+    summary = {
+        "total": len(rows),
+        "ok": sum(1 for o in outcomes if o.get("ok")),
+        "errors": sum(1 for o in outcomes if not o.get("ok")),
+        "by_state": by_state,
+        "elapsed_s": round(elapsed, 3),
+        "throughput_per_s": round(len(outcomes) / elapsed, 2) if elapsed else 0,
+        "max_in_flight": per_ambiente,
+        "rows": outcomes,
+    }
+
+    frappe.logger("sri_flow").info(
+        f"[BULK SEND] total={summary['total']} ok={summary['ok']} errors={summary['errors']} "
+        f"elapsed={summary['elapsed_s']}s rate={summary['throughput_per_s']}/s states={by_state}"
+    )
+    frappe.publish_realtime(PROGRESS_EVENT, {**summary, "done": len(outcomes), "finished": True}, user=user)
+    frappe.publish_realtime("sri_xml_queue_changed", {"bulk": True}, user=None, doctype=QUEUE_DTYPE)
+    return summary
+
+
+# ------------------------------
+# Whitelisted API
+# ------------------------------
+@frappe.whitelist()
+def enqueue_bulk_send(
+    company: Optional[str] = None,
+    warehouse: Optional[str] = None,
+    from_date: Optional[str] = None,
+    to_date: Optional[str] = None,
+    limit: int = 0,
+    max_in_flight: Optional[int] = None,
+) -> Dict[str, Any]:
+    """Queue a background bulk send of Firmado rows; progress arrives on 'sri_bulk_send_progress'."""
+    frappe.only_for(BULK_ROLES)
+
+    matched = len(_select_firmados(company, warehouse, from_date, to_date, limit))
+    job_name = f"sri_bulk_send:{frappe.generate_hash(length=8)}"
+    frappe.enqueue(
+        "josfe.sri_invoicing.core.transmission.batch.run_bulk_send",
+        queue="long",
+        timeout=4 * 3600,
+        job_name=job_name,
+        company=company,
+        warehouse=warehouse,
+        from_date=from_date,
+        to_date=to_date,
+        limit=int(limit or 0),
+        max_in_flight=max_in_flight,
+    )
+    return {"queued": matched, "job_name": job_name}
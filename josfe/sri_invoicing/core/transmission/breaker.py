@@ -0,0 +1,300 @@
+# -*- coding: utf-8 -*-
+# apps/josfe/josfe/sri_invoicing/core/transmission/breaker.py
+"""
+Circuit breaker + adaptive concurrency for the SRI web services.
+
+One breaker per (service, ambiente), kept in Redis (shared by every worker
+and site of the bench, since they all talk to the same celcer/cel hosts):
+
+    closed ──N consecutive failures──▶ open ──cooldown──▶ half-open
+       ▲                                 ▲                    │
+       └──────── probe succeeds ─────────┴── probe fails ─────┘
+
+While open, callers fail fast instead of waiting on the endpoint timeout.
+After the cooldown a single caller gets the probe lease (SET NX); its
+outcome closes or re-opens the breaker.
+
+The record is a Redis hash changed only by atomic commands (HINCRBY for the
+counters, small Lua scripts for state and limit transitions), so concurrent
+workers never overwrite each other's outcomes.
+
+The same record carries an AIMD concurrency limit: it halves when a call is
+slower than FE Settings.sri_latency_target_seconds (or fails) and grows by
+one after a full window of fast successes, up to sri_max_in_flight. Bulk
+send and poll_due size their thread pools with it.
+
+Firmado rows that could not be sent are parked (waiting_sri=1) and drained
+by drain_tick() / on close through batch.run_bulk_send(parked=1).
+
+Only call this from threads with a frappe context (Redis goes through
+frappe.cache()); pool threads report back through their parent.
+"""
+from __future__ import annotations
+
+import time
+from typing import Any, Dict, Optional
+
+import frappe
+from frappe.utils import cint, cstr, flt, now_datetime
+
+from josfe.sri_invoicing.doctype.fe_settings.fe_settings import get_settings
+from .endpoints import _norm_ambiente, _norm_service
+
+QUEUE_DTYPE = "SRI XML Queue"
+SERVICES = ("Recepción", "Autorización")
+AMBIENTES = ("Pruebas", "Producción")
+DRAIN_METHOD = "josfe.sri_invoicing.core.transmission.batch.run_bulk_send"
+
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+# Admission results
+ADMIT = "closed"     # send normally
+PROBE = "probe"      # send exactly one call
+REJECT = None        # fail fast / park
+
+# estado values meaning the call never got an SRI answer
+FAILED_ESTADOS = {"ERROR", ""}
+
+
+def _key(service: str, ambiente: str) -> str:
+    return f"sri_breaker:{_norm_service(service)}:{_norm_ambiente(ambiente)}"
+
+
+def _defaults() -> Dict[str, Any]:
+    return {"state": CLOSED, "failures": 0, "opened_at": 0.0, "limit": 0, "window": 0}
+
+
+def _settings() -> tuple:
+    s = get_settings()
+    return (
+        max(1, int(s.sri_breaker_failures or 5)),
+        max(1, int(s.sri_breaker_cooldown_seconds or 60)),
+        float(s.sri_latency_target_seconds or 0),
+        max(1, int(s.sri_max_in_flight or 8)),
+    )
+
+
+def _hash_key(service: str, ambiente: str) -> str:
+    return frappe.cache().make_key(_key(service, ambiente) + ":state", shared=True)
+
+
+# One call outcome: limit (AIMD) + failure count + state, in one atomic step.
+# KEYS[1] hash; ARGV ok, slow, threshold, max_in_flight, now. Returns {was, state, failures, limit}.
+_RECORD_LUA = """
+local k = KEYS[1]
+local ok, slow = tonumber(ARGV[1]), tonumber(ARGV[2])
+local threshold, max_in_flight = tonumber(ARGV[3]), tonumber(ARGV[4])
+local was = redis.call('HGET', k, 'state') or 'closed'
+local cur = tonumber(redis.call('HGET', k, 'limit') or '0') or 0
+if cur < 1 then cur = max_in_flight end
+
+if ok == 0 or slow == 1 then
+  cur = math.max(1, math.floor(cur / 2))
+  redis.call('HSET', k, 'window', 0)
+elseif redis.call('HINCRBY', k, 'window', 1) >= cur then
+  cur = math.min(max_in_flight, cur + 1)
+  redis.call('HSET', k, 'window', 0)
+end
+redis.call('HSET', k, 'limit', cur)
+
+local state, failures = was, 0
+if ok == 1 then
+  state = 'closed'
+  redis.call('HSET', k, 'state', state, 'failures', 0, 'opened_at', 0)
+else
+  failures = redis.call('HINCRBY', k, 'failures', 1)
+  if was == 'half_open' or failures >= threshold then
+    state = 'open'
+    redis.call('HSET', k, 'state', state, 'opened_at', ARGV[5])
+  end
+end
+return {was, state, failures, cur}
+"""
+
+# open -> half_open, unless a concurrent outcome already moved the state
+_HALF_OPEN_LUA = """
+if redis.call('HGET', KEYS[1], 'state') == 'open' then
+  redis.call('HSET', KEYS[1], 'state', 'half_open')
+end
+return 1
+"""
+
+
+def _text(v) -> str:
+    return v.decode() if isinstance(v, bytes) else cstr(v)
+
+
+def _load(service: str, ambiente: str) -> Dict[str, Any]:
+    st = _defaults()
+    try:
+        # execute_command: raw HGETALL, the wrapper's hgetall would unpickle the values
+        raw = frappe.cache().execute_command("HGETALL", _hash_key(service, ambiente)) or {}
+    except Exception:
+        return st
+    for k, v in raw.items():
+        k = _text(k)
+        if k == "state":
+            st[k] = _text(v)
+        elif k == "opened_at":
+            st[k] = flt(_text(v))
+        elif k in st:
+            st[k] = cint(_text(v))
+    return st
+
+
+def _script(lua: str, service: str, ambiente: str, *args):
+    return frappe.cache().register_script(lua)(keys=[_hash_key(service, ambiente)], args=list(args))
+
+
+# ------------------------------
+# Admission
+# ------------------------------
+def admit(service: str, ambiente: str) -> Optional[str]:
+    """ADMIT, PROBE (caller holds the single half-open lease) or REJECT."""
+    st = _load(service, ambiente)
+    if st["state"] == CLOSED:
+        return ADMIT
+
+    _failures, cooldown, _target, _max = _settings()
+    if time.time() - float(st.get("opened_at") or 0) < cooldown:
+        return REJECT
+
+    # Cooldown over: one probe per cooldown period across the bench
+    try:
+        cache = frappe.cache()
+        lease = cache.make_key(_key(service, ambiente) + ":probe", shared=True)
+        if not cache.set(lease, frappe.local.site or "1", nx=True, ex=cooldown):
+            return REJECT
+    except Exception:
+        return REJECT
+    if st["state"] != HALF_OPEN:
+        try:
+            _script(_HALF_OPEN_LUA, service, ambiente)
+        except Exception:
+            pass
+    return PROBE
+
+
+def limit(service: str, ambiente: str) -> int:
+    """Current adaptive in-flight limit for a pool talking to (service, ambiente)."""
+    _failures, _cooldown, _target, max_in_flight = _settings()
+    current = int(_load(service, ambiente).get("limit") or 0)
+    return max(1, min(max_in_flight, current or max_in_flight))
+
+
+# ------------------------------
+# Outcomes
+# ------------------------------
+def failed(result: Optional[Dict[str, Any]]) -> bool:
+    """A SOAP result without any SRI answer (connection error / timeout / fault)."""
+    return (((result or {}).get("estado") or "").upper()) in FAILED_ESTADOS
+
+
+def record(service: str, ambiente: str, ok: bool, latency_s: Optional[float] = None) -> None:
+    """Feed one call outcome into the breaker and the limiter."""
+    threshold, _cooldown, target, max_in_flight = _settings()
+    slow = bool(target and latency_s is not None and latency_s > target)
+    try:
+        was, state, failures, cur = _script(
+            _RECORD_LUA, service, ambiente, int(bool(ok)), int(slow), threshold, max_in_flight, time.time()
+        )
+    except Exception:
+        return
+    was, state = _text(was), _text(state)
+
+    if was != state:
+        frappe.logger("sri_flow").warning(
+            f"[BREAKER] {_norm_service(service)}/{_norm_ambiente(ambiente)} {was} → {state} "
+            f"failures={failures} limit={cur}"
+        )
+        if state == CLOSED and _norm_service(service) == "Recepción":
+            _enqueue_drain()
+
+
+def record_result(service: str, ambiente: str, result: Optional[Dict[str, Any]],
+                  latency_s: Optional[float] = None) -> None:
+    record(service, ambiente, not failed(result), latency_s)
+
+
+def reset(service: str, ambiente: str) -> None:
+    try:
+        frappe.cache().execute_command("DEL", _hash_key(service, ambiente))
+    except Exception:
+        pass
+
+
+# ------------------------------
+# Parking
+# ------------------------------
+def park(names, reason: str = "") -> None:
+    """Mark Firmado rows as waiting for SRI; drain_tick sends them when the breaker allows."""
+    names = [n for n in (names or []) if n]
+    if not names:
+        return
+    frappe.db.sql(
+        f"""
+        UPDATE `tab{QUEUE_DTYPE}`
+        SET waiting_sri=1, parked_at=%s, last_error=%s
+        WHERE name IN %s
+        """,
+        (now_datetime(), reason or "Esperando disponibilidad del SRI", tuple(names)),
+    )
+
+
+def _parked_count() -> int:
+    return frappe.db.count(QUEUE_DTYPE, {"waiting_sri": 1, "state": "Firmado"})
+
+
+def _enqueue_drain() -> None:
+    try:
+        frappe.enqueue(
+            DRAIN_METHOD,
+            queue="long",
+            job_id=f"sri_breaker_drain:{frappe.local.site}",
+            deduplicate=True,
+            enqueue_after_commit=True,
+            parked=1,
+        )
+    except Exception:
+        frappe.log_error(frappe.get_traceback(), "SRI breaker drain enqueue")
+
+
+def drain_tick() -> None:
+    """Scheduler (every minute): send parked rows once Recepción is closed or probe-able."""
+    if not _parked_count():
+        return
+    for amb in AMBIENTES:
+        st = _load("Recepción", amb)
+        _failures, cooldown, _target, _max = _settings()
+        if st["state"] == CLOSED or time.time() - float(st.get("opened_at") or 0) >= cooldown:
+            _enqueue_drain()
+            return
+
+
+# ------------------------------
+# Whitelisted API
+# ------------------------------
+@frappe.whitelist()
+def get_breaker_status() -> Dict[str, Any]:
+    """Breaker state and adaptive limit per (service, ambiente), plus parked rows."""
+    frappe.only_for(("System Manager", "Accounts Manager"))
+    out = {}
+    for service in SERVICES:
+        for amb in AMBIENTES:
+            st = _load(service, amb)
+            out[f"{service}/{amb}"] = {
+                "state": st["state"],
+                "failures": st["failures"],
+                "open_for_s": round(time.time() - st["opened_at"], 1) if st.get("opened_at") else 0,
+                "limit": limit(service, amb),
+            }
+    return {"breakers": out, "parked": _parked_count()}
+
+
+@frappe.whitelist()
+def reset_breaker(service: str, ambiente: str) -> Dict[str, Any]:
+    """Force a breaker closed (after fixing connectivity by hand) and drain parked rows."""
+    frappe.only_for(("System Manager",))
+    reset(service, ambiente)
+    _enqueue_drain()
+    return get_breaker_status()
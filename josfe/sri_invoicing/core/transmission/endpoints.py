@@ -1,4 +1,6 @@
 # apps/josfe/josfe/sri_invoicing/transmission/endpoints.py
+import threading
+
 import frappe
 
 DEFAULTS = {
@@ -39,60 +41,135 @@ def _norm_ambiente(ambiente: str) -> str:
     key = ambiente.strip().lower()
     return _AMBIENTE_ALIASES.get(key, ambiente.title())
 
-def resolve_wsdl(service: str, ambiente: str) -> str:
-    """
-    Resolve WSDL URL from SRI Endpoint (active record, by service+ambiente).
-    Falls back to DEFAULTS if none configured.
-    """
-    service = _norm_service(service)
-    ambiente = _norm_ambiente(ambiente)
+# ------------------------------
+# Cached endpoint config
+# ------------------------------
+# Per (site, service, ambiente): process dict in front of a Redis hash in
+# front of the DB. SRI Endpoint on_update/on_trash calls invalidate_cache()
+# once the change is committed, which clears the hash and bumps
+# ENDPOINT_VERSION_KEY; every process drops its dict on the next lookup that
+# sees a new version. The hash also expires after CONFIG_CACHE_TTL so a missed
+# invalidation cannot pin an old endpoint.
+ENDPOINT_VERSION_KEY = "sri_endpoint_version"
+CONFIG_CACHE_KEY = "sri_endpoint_config"
+CONFIG_CACHE_TTL = 3600
+DEFAULT_VERIFY_SSL = True
+DEFAULT_TIMEOUT = 40
+
+_LOCAL: dict = {}
+_LOCAL_LOCK = threading.Lock()
+_local_version: dict = {"value": None}
+
+
+def endpoint_version():
+    """Cluster-wide version bumped whenever an SRI Endpoint changes."""
+    try:
+        return frappe.cache().get_value(ENDPOINT_VERSION_KEY)
+    except Exception:
+        return None
+
+
+def bump_version() -> None:
+    try:
+        frappe.cache().set_value(ENDPOINT_VERSION_KEY, frappe.generate_hash(length=10))
+    except Exception:
+        pass
 
+
+def invalidate_cache(broadcast: bool = True) -> None:
+    """Forget cached endpoint config here and (broadcast) in every other worker."""
+    with _LOCAL_LOCK:
+        _LOCAL.clear()
+    try:
+        frappe.cache().delete_value(CONFIG_CACHE_KEY)
+    except Exception:
+        pass
+    if broadcast:
+        bump_version()
+
+
+def _load_config(service: str, ambiente: str) -> dict:
     ep = frappe.get_all(
         "SRI Endpoint",
         filters={"service": service, "ambiente": ambiente, "active": 1},
-        fields=["name", "wsdl_url"],
+        fields=["name", "wsdl_url", "verify_ssl", "timeout_seconds", "test_xml"],
         order_by="modified desc",
         limit=1,
     )
-    if ep and ep[0].get("wsdl_url"):
-        return ep[0]["wsdl_url"]
+    row = ep[0] if ep else {}
+    return {
+        "name": row.get("name"),
+        "url": row.get("wsdl_url") or DEFAULTS.get((service, ambiente)),
+        "verify_ssl": bool(row.get("verify_ssl", 1)) if row else DEFAULT_VERIFY_SSL,
+        "timeout": int(row.get("timeout_seconds") or DEFAULT_TIMEOUT),
+        "test_xml": row.get("test_xml"),
+    }
 
-    return DEFAULTS.get((service, ambiente))
 
-def get_endpoint_flags(service: str, ambiente: str) -> tuple[bool, int]:
+def _cached_config(service: str, ambiente: str) -> dict:
+    cache = frappe.cache()
+    field = f"{service}|{ambiente}"
+    config = cache.hget(CONFIG_CACHE_KEY, field)
+    if config is None:
+        config = _load_config(service, ambiente)
+        cache.hset(CONFIG_CACHE_KEY, field, config)
+        cache.expire(cache.make_key(CONFIG_CACHE_KEY), CONFIG_CACHE_TTL)
+    return config
+
+
+def get_endpoint_config(service: str, ambiente: str) -> dict:
     """
-    Returns (verify_ssl, timeout_seconds) from SRI Endpoint if present, else (True, 40).
+    Active endpoint config for service+ambiente in one lookup:
+    {name, url, verify_ssl, timeout, test_xml}. url falls back to DEFAULTS,
+    verify_ssl/timeout to (True, 40) when no SRI Endpoint is configured.
     """
     service = _norm_service(service)
     ambiente = _norm_ambiente(ambiente)
+    site = getattr(frappe.local, "site", None)
+    key = (site, service, ambiente)
 
-    ep = frappe.get_all(
-        "SRI Endpoint",
-        filters={"service": service, "ambiente": ambiente, "active": 1},
-        fields=["verify_ssl", "timeout_seconds"],
-        limit=1,
-    )
-    verify_ssl, timeout = True, 40
-    if ep:
-        verify_ssl = bool(ep[0].get("verify_ssl", 1))
-        timeout = int(ep[0].get("timeout_seconds") or timeout)
-    return verify_ssl, timeout
+    version = endpoint_version()
+    with _LOCAL_LOCK:
+        if version != _local_version["value"]:
+            _LOCAL.clear()
+            _local_version["value"] = version
+        hit = _LOCAL.get(key)
+    if hit is not None:
+        return dict(hit)
+
+    try:
+        config = _cached_config(service, ambiente)
+    except Exception:
+        config = _load_config(service, ambiente)
+
+    with _LOCAL_LOCK:
+        if version == _local_version["value"]:
+            _LOCAL[key] = config
+    return dict(config)
 
-def get_test_xml_b64(service: str, ambiente: str) -> str | None:
+
+def resolve_wsdl(service: str, ambiente: str, company: str | None = None) -> str:
+    """
+    Resolve WSDL URL from SRI Endpoint (active record, by service+ambiente).
+    Falls back to DEFAULTS if none configured. (company: accepted from older
+    callers; endpoints are not per company.)
+    """
+    return get_endpoint_config(service, ambiente)["url"]
+
+def get_endpoint_flags(service: str, ambiente: str) -> tuple[bool, int]:
+    """
+    Returns (verify_ssl, timeout_seconds) from SRI Endpoint if present, else (True, 40).
+    """
+    config = get_endpoint_config(service, ambiente)
+    return config["verify_ssl"], config["timeout"]
+
+def get_test_xml_b64(service: str, ambiente: str, company: str | None = None) -> str | None:
     """
     Optional helper used by legacy testers to fetch a base64 test XML stored in the Endpoint.
     """
     import base64
-    service = _norm_service(service)
-    ambiente = _norm_ambiente(ambiente)
-
-    ep = frappe.get_all(
-        "SRI Endpoint",
-        filters={"service": service, "ambiente": ambiente, "active": 1},
-        fields=["name", "test_xml"],
-        limit=1,
-    )
-    if ep and ep[0].get("test_xml"):
-        content = frappe.utils.file_manager.get_file(ep[0]["test_xml"])[1]
+    test_xml = get_endpoint_config(service, ambiente)["test_xml"]
+    if test_xml:
+        content = frappe.utils.file_manager.get_file(test_xml)[1]
         return base64.b64encode(content).decode()
     return None
@@ -0,0 +1,379 @@
+# -*- coding: utf-8 -*-
+# apps/josfe/josfe/sri_invoicing/core/transmission/fake_sri/loadtest.py
+"""
+End-to-end load test of the SRI pipeline against the local fake SRI.
+
+run() clones one existing comprobante `rows` times (fresh claveAcceso and
+secuencial per copy), inserts the copies as SRI XML Queue rows in Firmado
+(or Generado, to include the firma) and drives the real stage code in
+threads of this process, each with its own site connection:
+
+    sign   pipeline.run_stage("sign")     (start_state="Generado" only)
+    send   pipeline.run_stage("send")     → batch.run_bulk_send → Recepción
+    poll   poller2.poll_due()             → Autorización
+
+Scheduled Autorización polls are pulled forward to "now" on every poll
+tick, so the BACKOFF schedule (30 s and up) does not dominate the numbers.
+Reports throughput, end-to-end and per-stage latency percentiles, final
+states, the breaker state and the fake's own counters.
+
+    # terminal 1
+    python apps/josfe/josfe/sri_invoicing/core/transmission/fake_sri/server.py --port 9999 --latency-ms 200
+    # terminal 2 (SRI Endpoint rows of the ambiente pointing at 127.0.0.1:9999)
+    bench --site <site> execute josfe.sri_invoicing.core.transmission.fake_sri.loadtest.run \
+        --kwargs "{'template': 'XML-001-26-00001', 'rows': 2000}"
+
+Test sites only: the stages drain every Firmado / Enviado row of the site,
+so run() refuses to start while other rows are in flight (force=1 skips
+the check). Synthetic rows are named SRI-LT-<run>-NNNNNN, emails are
+skipped (pdf_emailed=1) and everything is deleted afterwards unless keep=1.
+"""
+from __future__ import annotations
+
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional
+from urllib.parse import urlsplit
+
+import requests
+from lxml import etree
+
+import frappe
+from frappe.utils import now_datetime, time_diff_in_seconds
+
+from josfe.sri_invoicing.core.queue import pipeline, timings
+from josfe.sri_invoicing.core.transmission import breaker, endpoints, poller2
+from josfe.sri_invoicing.core.utils.stats import percentile
+from josfe.sri_invoicing.core.validations.access_key import _mod11_sri
+from josfe.sri_invoicing.doctype.sri_xml_queue.sri_xml_queue import SRIQueueState
+from josfe.sri_invoicing.xml import comprobante, paths
+from josfe.sri_invoicing.xml import service as xml_service
+
+QUEUE_DTYPE = "SRI XML Queue"
+NAME_PREFIX = "SRI-LT-"
+LOOPBACK = {"127.0.0.1", "localhost", "::1"}
+DS_NS = "http://www.w3.org/2000/09/xmldsig#"
+
+TERMINAL = (SRIQueueState.Autorizado.value, SRIQueueState.Devuelto.value, SRIQueueState.Error.value)
+IN_FLIGHT = (SRIQueueState.Firmado.value, SRIQueueState.Enviado.value)
+INSERT_CHUNK = 500
+
+
+def _latency_s(values: List[float]) -> Dict[str, float]:
+    values = sorted(values)
+    return {
+        "p50": round(percentile(values, 50), 3),
+        "p95": round(percentile(values, 95), 3),
+        "p99": round(percentile(values, 99), 3),
+        "max": round(values[-1] if values else 0, 3),
+    }
+
+
+# ------------------------------
+# Guards
+# ------------------------------
+def _check_endpoints(ambiente: str, fake_url: str) -> None:
+    """Both services of the ambiente must resolve to the fake (never celcer/cel)."""
+    fake_host = urlsplit(fake_url).hostname
+    wrong = []
+    for service in breaker.SERVICES:
+        url = endpoints.get_endpoint_config(service, ambiente)["url"]
+        host = urlsplit(url).hostname
+        if host not in LOOPBACK and host != fake_host:
+            wrong.append(f"{service}/{ambiente}: {url}")
+    if wrong:
+        frappe.throw(
+            "Los SRI Endpoint activos no apuntan al SRI local; configure wsdl_url hacia "
+            f"{fake_url} antes de la prueba de carga:<br>" + "<br>".join(wrong)
+        )
+
+
+def _foreign_in_flight() -> int:
+    return frappe.db.sql(
+        f"""
+        SELECT COUNT(*) FROM `tab{QUEUE_DTYPE}`
+        WHERE name NOT LIKE %s
+          AND (state IN %s OR (state=%s AND IFNULL(xml_file, '')<>''))
+        """,
+        (f"{NAME_PREFIX}%", IN_FLIGHT, SRIQueueState.Generado.value),
+    )[0][0]
+
+
+def _fake(fake_url: str, path: str, payload: Optional[dict] = None) -> Dict[str, Any]:
+    try:
+        url = fake_url.rstrip("/") + path
+        r = requests.post(url, json=payload or {}, timeout=5) if payload is not None else requests.get(url, timeout=5)
+        return r.json()
+    except Exception as e:
+        return {"error": f"{type(e).__name__}: {e}"}
+
+
+# ------------------------------
+# Synthetic rows
+# ------------------------------
+def _template(template: str, start_state: str) -> tuple:
+    """(queue row, comprobante bytes ready for start_state, clave)."""
+    tpl = frappe.get_doc(QUEUE_DTYPE, template)
+    comp = comprobante.load(xml_service._abs_from_url(tpl.xml_file))
+    if len(comp.clave) != 49:
+        frappe.throw(f"{template}: el archivo {tpl.xml_file} no es un comprobante con claveAcceso")
+    if start_state == SRIQueueState.Generado.value and comp.is_signed:
+        root = etree.fromstring(comp.to_bytes())
+        for sig in root.findall(f"{{{DS_NS}}}Signature"):
+            root.remove(sig)
+        data = etree.tostring(root, xml_declaration=True, encoding="utf-8")
+    else:
+        data = comp.to_bytes()
+    return tpl, data, comp.clave
+
+
+def _clave(base: str, codigo: str, n: int) -> str:
+    """Template clave with secuencial = n and the run's código numérico; new check digit."""
+    base48 = f"{base[:30]}{n:09d}{codigo}{base[47]}"
+    return base48 + str(_mod11_sri(int(ch) for ch in base48))
+
+
+def _seed_rows(run_id: str, tpl, data: bytes, clave: str, rows: int, start_state: str) -> List[str]:
+    """Write the XML copies and insert the queue rows (raw INSERT: no on_update processing)."""
+    paths.ensure_all_dirs()
+    rel_dir = paths.SIGNED if start_state == SRIQueueState.Firmado.value else paths.GEN
+    codigo = f"{int(run_id, 16) % 10**8:08d}"
+    secuencial = etree.fromstring(data).findtext("infoTributaria/secuencial") or ""
+    old_clave, old_seq = f">{clave}<".encode(), f"<secuencial>{secuencial}</secuencial>".encode()
+
+    names, values = [], []
+    now = now_datetime()
+    user = frappe.session.user
+    for i in range(1, int(rows) + 1):
+        name = f"{NAME_PREFIX}{run_id}-{i:06d}"
+        key = _clave(clave, codigo, i)
+        shard = paths.shard_for(key)
+        body = data.replace(old_clave, f">{key}<".encode(), 1)
+        if secuencial:
+            body = body.replace(old_seq, f"<secuencial>{i:09d}</secuencial>".encode(), 1)
+        dest = paths.abs_path(rel_dir, f"{name}.xml", shard)
+        os.makedirs(os.path.dirname(dest), exist_ok=True)
+        with open(dest, "wb") as f:
+            f.write(body)
+        names.append(name)
+        values.append((
+            name, now, now, user, user, start_state, paths.to_file_url(rel_dir, f"{name}.xml", shard),
+            tpl.company, tpl.custom_jos_level3_warehouse, tpl.posting_date, now, now,
+        ))
+
+    for start in range(0, len(values), INSERT_CHUNK):
+        chunk = values[start:start + INSERT_CHUNK]
+        frappe.db.sql(
+            f"""
+            INSERT INTO `tab{QUEUE_DTYPE}`
+                (name, creation, modified, owner, modified_by, docstatus, idx, state, xml_file,
+                 company, custom_jos_level3_warehouse, reference_doctype, posting_date,
+                 submitted_at, xml_built_at, pdf_emailed, waiting_sri)
+            VALUES {", ".join(["(%s, %s, %s, %s, %s, 0, 0, %s, %s, %s, %s, 'FC', %s, %s, %s, 1, 0)"] * len(chunk))}
+            """,
+            tuple(v for row in chunk for v in row),
+        )
+    frappe.db.commit()
+    return names
+
+
+def _cleanup(run_id: str) -> None:
+    like = f"{NAME_PREFIX}{run_id}-%"
+    frappe.db.sql(f"DELETE FROM `tab{timings.LOG_DTYPE}` WHERE queue LIKE %s", (like,))
+    frappe.db.sql("DELETE FROM `tabComment` WHERE reference_doctype=%s AND reference_name LIKE %s",
+                  (QUEUE_DTYPE, like))
+    frappe.db.sql(f"DELETE FROM `tab{QUEUE_DTYPE}` WHERE name LIKE %s", (like,))
+    frappe.db.commit()
+    prefix = f"{NAME_PREFIX}{run_id}-"
+    for rel in (paths.GEN, paths.SIGNED, paths.SIGNED_SENT_PENDING, paths.SIGNED_REJECTED, paths.AUTH, paths.NOT_AUTH):
+        for dirpath, _dirs, files in os.walk(paths.abs_path(rel, "")):
+            for fn in files:
+                if fn.startswith(prefix):
+                    path = os.path.join(dirpath, fn)
+                    comprobante.forget(path)
+                    os.remove(path)
+
+
+# ------------------------------
+# Stage threads
+# ------------------------------
+def _stage_loop(site: str, user: str, stop: threading.Event, tick_s: float,
+                fn: Callable[[], int], out: dict) -> None:
+    """Call fn until stop; sleep tick_s whenever a call found nothing to do."""
+    frappe.init(site=site)
+    frappe.connect()
+    frappe.set_user(user)
+    try:
+        while not stop.is_set():
+            t0 = time.perf_counter()
+            try:
+                done = int(fn() or 0)
+                frappe.db.commit()
+            except Exception as e:
+                frappe.db.rollback()
+                out["errors"].append(f"{type(e).__name__}: {e}")
+                done = 0
+            out["calls"] += 1
+            out["rows"] += done
+            out["busy_s"] += time.perf_counter() - t0
+            if not done:
+                stop.wait(tick_s)
+    finally:
+        frappe.destroy()
+
+
+def _poll_now(run_id: str) -> int:
+    """Pull this run's scheduled Autorización polls forward, then run one poll_due tick."""
+    frappe.db.sql(
+        f"""
+        UPDATE `tab{QUEUE_DTYPE}` SET next_poll_at=%s
+        WHERE name LIKE %s AND state=%s AND next_poll_at > %s
+        """,
+        (now_datetime(), f"{NAME_PREFIX}{run_id}-%", SRIQueueState.Enviado.value, now_datetime()),
+    )
+    frappe.db.commit()
+    return poller2.poll_due().get("polled", 0)
+
+
+def _remaining(run_id: str) -> int:
+    return frappe.db.sql(
+        f"SELECT COUNT(*) FROM `tab{QUEUE_DTYPE}` WHERE name LIKE %s AND state NOT IN %s",
+        (f"{NAME_PREFIX}{run_id}-%", TERMINAL),
+    )[0][0]
+
+
+# ------------------------------
+# Report
+# ------------------------------
+def _report(run_id: str) -> Dict[str, Any]:
+    like = f"{NAME_PREFIX}{run_id}-%"
+    states = dict(frappe.db.sql(
+        f"SELECT state, COUNT(*) FROM `tab{QUEUE_DTYPE}` WHERE name LIKE %s GROUP BY state", (like,)
+    ))
+    events = frappe.db.sql(
+        f"""
+        SELECT l.queue, l.stage, l.`at`, l.sri_ms, q.submitted_at
+        FROM `tab{timings.LOG_DTYPE}` l
+        JOIN `tab{QUEUE_DTYPE}` q ON q.name = l.queue
+        WHERE l.queue LIKE %s
+        ORDER BY l.queue, l.`at`
+        """,
+        (like,),
+        as_dict=True,
+    )
+
+    stage_wait: Dict[str, List[float]] = {}
+    sri_ms: Dict[str, List[float]] = {}
+    end_to_end: List[float] = []
+    prev_queue, prev_at = None, None
+    for e in events:
+        if e.queue != prev_queue:
+            prev_queue, prev_at = e.queue, e.submitted_at
+        stage_wait.setdefault(e.stage, []).append(max(0.0, time_diff_in_seconds(e.at, prev_at)))
+        if e.sri_ms is not None:
+            sri_ms.setdefault(e.stage, []).append(e.sri_ms / 1000.0)
+        if e.stage in ("Autorizado", "Devuelto"):
+            end_to_end.append(max(0.0, time_diff_in_seconds(e.at, e.submitted_at)))
+        prev_at = e.at
+
+    return {
+        "states": states,
+        "end_to_end_s": _latency_s(end_to_end),
+        "stage_wait_s": {k: _latency_s(v) for k, v in stage_wait.items()},
+        "sri_call_s": {k: _latency_s(v) for k, v in sri_ms.items()},
+    }
+
+
+def run(
+    template: str,
+    rows: int = 1000,
+    start_state: str = "Firmado",
+    fake_url: str = "http://127.0.0.1:9999",
+    scenario: Optional[Dict[str, Any]] = None,
+    sign_workers: int = 2,
+    tick_s: float = 1.0,
+    timeout_s: int = 1800,
+    keep: int = 0,
+    force: int = 0,
+) -> Dict[str, Any]:
+    """Push `rows` copies of `template` through sign/send/poll against the fake SRI."""
+    frappe.only_for(("System Manager",))
+
+    if start_state not in (SRIQueueState.Generado.value, SRIQueueState.Firmado.value):
+        frappe.throw("start_state debe ser Generado o Firmado")
+    tpl, data, clave = _template(template, start_state)
+    ambiente = "Producción" if clave[23] == "2" else "Pruebas"
+    _check_endpoints(ambiente, fake_url)
+    if not int(force) and _foreign_in_flight():
+        frappe.throw("Hay comprobantes reales en curso en este sitio; use un sitio de pruebas (o force=1).")
+
+    # Start from a clean fake and closed breakers
+    _fake(fake_url, "/_fake/reset", {})
+    if scenario:
+        _fake(fake_url, "/_fake/config", scenario)
+    for service in breaker.SERVICES:
+        breaker.reset(service, ambiente)
+
+    run_id = frappe.generate_hash(length=6)
+    t_seed = time.perf_counter()
+    _seed_rows(run_id, tpl, data, clave, int(rows), start_state)
+    seed_s = time.perf_counter() - t_seed
+
+    site, user = frappe.local.site, frappe.session.user
+    stop = threading.Event()
+    loops = {"send": lambda: pipeline.run_stage("send")["rows"], "poll": lambda: _poll_now(run_id)}
+    if start_state == SRIQueueState.Generado.value:
+        for slot in range(max(1, int(sign_workers))):
+            loops[f"sign{slot}"] = lambda: pipeline.run_stage("sign")["rows"]
+    outs = {k: {"calls": 0, "rows": 0, "busy_s": 0.0, "errors": []} for k in loops}
+    threads = [
+        threading.Thread(target=_stage_loop, args=(site, user, stop, float(tick_s), fn, outs[k]),
+                         name=f"sri-lt-{k}", daemon=True)
+        for k, fn in loops.items()
+    ]
+
+    t0 = time.perf_counter()
+    for t in threads:
+        t.start()
+    timed_out = False
+    while True:
+        time.sleep(float(tick_s))
+        frappe.db.rollback()  # fresh snapshot
+        if not _remaining(run_id):
+            break
+        if time.perf_counter() - t0 > int(timeout_s):
+            timed_out = True
+            break
+    elapsed = time.perf_counter() - t0
+    stop.set()
+    for t in threads:
+        t.join()
+
+    report = _report(run_id)
+    done = sum(n for s, n in report["states"].items() if s in TERMINAL)
+    summary = {
+        "run": run_id,
+        "template": template,
+        "rows": int(rows),
+        "start_state": start_state,
+        "ambiente": ambiente,
+        "seed_s": round(seed_s, 3),
+        "elapsed_s": round(elapsed, 3),
+        "timed_out": timed_out,
+        "completed": done,
+        "throughput_per_s": round(done / elapsed, 2) if elapsed else 0,
+        **report,
+        "stages": {
+            k: {"calls": o["calls"], "rows": o["rows"], "busy_s": round(o["busy_s"], 3),
+                "errors": len(o["errors"]), "sample_errors": o["errors"][:3]}
+            for k, o in outs.items()
+        },
+        "breaker": breaker.get_breaker_status(),
+        "fake": _fake(fake_url, "/_fake/stats"),
+    }
+
+    if not int(keep):
+        _cleanup(run_id)
+    frappe.logger("sri_flow").info(f"[SRI LOADTEST] {summary}")
+    return summary
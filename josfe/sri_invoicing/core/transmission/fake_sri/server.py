@@ -0,0 +1,442 @@
+# -*- coding: utf-8 -*-
+# apps/josfe/josfe/sri_invoicing/core/transmission/fake_sri/server.py
+"""
+Local stand-in for the SRI offline web services (development / load tests).
+
+Serves the RecepcionComprobantesOffline and AutorizacionComprobantesOffline
+WSDLs (wsdl/ folder, same paths as celcer/cel) and answers their SOAP calls
+with scripted outcomes:
+
+    Recepción:     RECIBIDA · DEVUELTA · DEVUELTA_43 (CLAVE ACCESO REGISTRADA)
+    Autorización:  PPR for N polls, then AUTORIZADO or NO AUTORIZADO
+
+A clave received twice gets DEVUELTA 43, like the real service. Latency,
+jitter, SOAP faults (HTTP 500) and hung calls are drawn per request.
+
+Standalone (stdlib only, no frappe):
+
+    python apps/josfe/josfe/sri_invoicing/core/transmission/fake_sri/server.py \
+        --port 9999 --latency-ms 150 --jitter-ms 100 --ppr-polls 1 --error-rate 0.01
+
+then point the active SRI Endpoint rows (wsdl_url) at
+
+    http://127.0.0.1:9999/comprobantes-electronicos-ws/RecepcionComprobantesOffline?wsdl
+    http://127.0.0.1:9999/comprobantes-electronicos-ws/AutorizacionComprobantesOffline?wsdl
+
+Control endpoints: GET /_fake/stats, POST /_fake/config (JSON merged into the
+running config), POST /_fake/reset (forget claves and counters).
+"""
+from __future__ import annotations
+
+import argparse
+import base64
+import copy
+import json
+import os
+import random
+import re
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, Optional
+from urllib.parse import parse_qs, urlsplit
+from xml.sax.saxutils import escape
+
+WSDL_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "wsdl")
+BASE_PLACEHOLDER = "__BASE__"
+
+SERVICES = {
+    "/comprobantes-electronicos-ws/RecepcionComprobantesOffline": ("recepcion", "RecepcionComprobantesOffline"),
+    "/comprobantes-electronicos-ws/AutorizacionComprobantesOffline": ("autorizacion", "AutorizacionComprobantesOffline"),
+}
+NS = {"recepcion": "http://ec.gob.sri.ws.recepcion", "autorizacion": "http://ec.gob.sri.ws.autorizacion"}
+
+RECEPCION_OUTCOMES = ("RECIBIDA", "DEVUELTA", "DEVUELTA_43")
+AUTORIZACION_OUTCOMES = ("AUTORIZADO", "NO AUTORIZADO")
+
+DEFAULT_CONFIG: Dict[str, Any] = {
+    "seed": None,
+    "latency_ms": 0,         # added to every SOAP call
+    "jitter_ms": 0,          # + uniform(0, jitter_ms)
+    "error_rate": 0.0,       # HTTP 500 soap:Fault
+    "timeout_rate": 0.0,     # sleep timeout_s before answering (client times out)
+    "timeout_s": 60,
+    "recepcion": {"RECIBIDA": 1.0, "DEVUELTA": 0.0, "DEVUELTA_43": 0.0},
+    "autorizacion": {"AUTORIZADO": 1.0, "NO AUTORIZADO": 0.0},
+    "ppr_polls": 0,          # Autorización answers with no autorizacion (PPR) this many times
+    # per-service knobs: {"recepcion": {"latency_ms": 300}, "autorizacion": {"error_rate": 0.2}}
+    "overrides": {"recepcion": {}, "autorizacion": {}},
+    # per clave: {"<clave>": {"recepcion": "DEVUELTA_43", "ppr_polls": 3, "autorizacion": "NO AUTORIZADO"}}
+    "script": {},
+}
+
+MENSAJES = {
+    "DEVUELTA": ("35", "ARCHIVO NO CUMPLE ESTRUCTURA XML", "Respuesta simulada (fake_sri)"),
+    "DEVUELTA_43": ("43", "CLAVE ACCESO REGISTRADA", "La clave de acceso ya fue recibida"),
+    "NO AUTORIZADO": ("39", "FIRMA INVALIDA", "Respuesta simulada (fake_sri)"),
+}
+
+_XML_RE = re.compile(rb"<(?:\w+:)?xml\b[^>]*>\s*([A-Za-z0-9+/=\s]*)\s*</(?:\w+:)?xml>")
+_CLAVE_REQ_RE = re.compile(rb"<(?:\w+:)?claveAccesoComprobante\b[^>]*>\s*([0-9]+)\s*<")
+_CLAVE_XML_RE = re.compile(r"<\s*claveAcceso\s*>\s*([0-9]{10,49})\s*<")
+
+ECUADOR_TZ = timezone(timedelta(hours=-5))
+
+
+def _merge(base: Dict[str, Any], update: Dict[str, Any]) -> Dict[str, Any]:
+    for k, v in (update or {}).items():
+        if isinstance(v, dict) and isinstance(base.get(k), dict) and k != "script":
+            _merge(base[k], v)
+        else:
+            base[k] = v
+    return base
+
+
+# ------------------------------
+# Scripted SRI state
+# ------------------------------
+class FakeSRI:
+    """Outcomes, per-clave state and counters; shared by the handler threads."""
+
+    def __init__(self, config: Optional[Dict[str, Any]] = None):
+        self.lock = threading.Lock()
+        self.config = _merge(copy.deepcopy(DEFAULT_CONFIG), config or {})
+        self.reset()
+
+    def reset(self) -> None:
+        with self.lock:
+            self.rng = random.Random(self.config.get("seed"))
+            self.claves: Dict[str, Dict[str, Any]] = {}
+            self.stats: Dict[str, Any] = {
+                svc: {"calls": 0, "estados": {}, "faults": 0, "hung": 0,
+                      "in_flight": 0, "max_in_flight": 0, "busy_ms": 0}
+                for svc in NS
+            }
+            self.stats["wsdl_fetches"] = 0
+            self.stats["started_at"] = time.time()
+
+    def configure(self, update: Dict[str, Any]) -> Dict[str, Any]:
+        with self.lock:
+            _merge(self.config, update or {})
+            if "seed" in (update or {}):
+                self.rng = random.Random(self.config.get("seed"))
+            return copy.deepcopy(self.config)
+
+    def knob(self, svc: str, key: str) -> Any:
+        return self.config["overrides"].get(svc, {}).get(key, self.config[key])
+
+    def _pick(self, weights: Dict[str, float], allowed: tuple) -> str:
+        items = [(k, float(w)) for k, w in weights.items() if k in allowed and float(w) > 0]
+        if not items:
+            return allowed[0]
+        x = self.rng.random() * sum(w for _k, w in items)
+        for k, w in items:
+            x -= w
+            if x < 0:
+                return k
+        return items[-1][0]
+
+    # --- per request -------------------------------------------------------
+    def chaos(self, svc: str) -> tuple:
+        """(delay_s, fault, hang) for one call."""
+        with self.lock:
+            delay = float(self.knob(svc, "latency_ms")) + self.rng.uniform(0, float(self.knob(svc, "jitter_ms")))
+            fault = self.rng.random() < float(self.knob(svc, "error_rate"))
+            hang = not fault and self.rng.random() < float(self.knob(svc, "timeout_rate"))
+        return delay / 1000.0 + (float(self.knob(svc, "timeout_s")) if hang else 0.0), fault, hang
+
+    def recepcion(self, xml_text: str) -> tuple:
+        """(outcome, clave) for one validarComprobante."""
+        m = _CLAVE_XML_RE.search(xml_text or "")
+        clave = m.group(1) if m else ""
+        with self.lock:
+            script = self.config["script"].get(clave, {})
+            if clave in self.claves:
+                outcome = "DEVUELTA_43"
+            else:
+                outcome = script.get("recepcion") or self._pick(self.config["recepcion"], RECEPCION_OUTCOMES)
+            if outcome != "DEVUELTA" and clave and clave not in self.claves:
+                self.claves[clave] = {
+                    "xml": xml_text,
+                    "polls": 0,
+                    "ppr": int(script.get("ppr_polls", self.config["ppr_polls"]) or 0),
+                    "final": script.get("autorizacion")
+                    or self._pick(self.config["autorizacion"], AUTORIZACION_OUTCOMES),
+                    "fecha": None,
+                }
+        return outcome, clave
+
+    def autorizacion(self, clave: str) -> Optional[Dict[str, Any]]:
+        """None while SRI would still answer without autorizacion (unknown clave / PPR)."""
+        with self.lock:
+            st = self.claves.get(clave)
+            if st is None:
+                return None
+            if st["polls"] < st["ppr"]:
+                st["polls"] += 1
+                return None
+            if st["fecha"] is None:
+                st["fecha"] = datetime.now(ECUADOR_TZ).isoformat(timespec="seconds")
+            return dict(st)
+
+    def count(self, svc: str, estado: str = "", fault: bool = False, hung: bool = False, busy_ms: int = 0) -> None:
+        with self.lock:
+            s = self.stats[svc]
+            s["calls"] += 1
+            s["busy_ms"] += busy_ms
+            if fault:
+                s["faults"] += 1
+            if hung:
+                s["hung"] += 1
+            if estado:
+                s["estados"][estado] = s["estados"].get(estado, 0) + 1
+
+    def enter(self, svc: str) -> None:
+        with self.lock:
+            s = self.stats[svc]
+            s["in_flight"] += 1
+            s["max_in_flight"] = max(s["max_in_flight"], s["in_flight"])
+
+    def leave(self, svc: str) -> None:
+        with self.lock:
+            self.stats[svc]["in_flight"] -= 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self.lock:
+            out = copy.deepcopy(self.stats)
+            out["uptime_s"] = round(time.time() - out.pop("started_at"), 1)
+            out["claves"] = len(self.claves)
+            return out
+
+
+# ------------------------------
+# SOAP bodies
+# ------------------------------
+def _envelope(body: str) -> bytes:
+    return (
+        '<?xml version="1.0" encoding="UTF-8"?>'
+        '<soap:Envelope xmlns:soap="http://schemas.xmlsoap.org/soap/envelope/">'
+        f"<soap:Body>{body}</soap:Body></soap:Envelope>"
+    ).encode("utf-8")
+
+
+def _mensaje(outcome: str) -> str:
+    ident, text, extra = MENSAJES[outcome]
+    return (
+        f"<ns2:mensaje><identificador>{ident}</identificador><mensaje>{text}</mensaje>"
+        f"<informacionAdicional>{escape(extra)}</informacionAdicional><tipo>ERROR</tipo></ns2:mensaje>"
+    )
+
+
+def recepcion_body(outcome: str, clave: str) -> bytes:
+    if outcome == "RECIBIDA":
+        inner = "<estado>RECIBIDA</estado><comprobantes/>"
+    else:
+        inner = (
+            "<estado>DEVUELTA</estado><comprobantes><ns2:comprobante>"
+            f"<claveAcceso>{escape(clave)}</claveAcceso><mensajes>{_mensaje(outcome)}</mensajes>"
+            "</ns2:comprobante></comprobantes>"
+        )
+    return _envelope(
+        f'<ns2:validarComprobanteResponse xmlns:ns2="{NS["recepcion"]}">'
+        f"<RespuestaRecepcionComprobante>{inner}</RespuestaRecepcionComprobante>"
+        "</ns2:validarComprobanteResponse>"
+    )
+
+
+def autorizacion_body(clave: str, st: Optional[Dict[str, Any]]) -> bytes:
+    if st is None:
+        inner = f"<claveAccesoConsultada>{escape(clave)}</claveAccesoConsultada><numeroComprobantes>0</numeroComprobantes><autorizaciones/>"
+    else:
+        ambiente = "PRODUCCIÓN" if clave[23:24] == "2" else "PRUEBAS"
+        autorizado = st["final"] == "AUTORIZADO"
+        inner = (
+            f"<claveAccesoConsultada>{escape(clave)}</claveAccesoConsultada>"
+            "<numeroComprobantes>1</numeroComprobantes><autorizaciones><ns2:autorizacion>"
+            f"<estado>{st['final']}</estado>"
+            f"<numeroAutorizacion>{escape(clave) if autorizado else ''}</numeroAutorizacion>"
+            f"<fechaAutorizacion>{st['fecha']}</fechaAutorizacion>"
+            f"<ambiente>{ambiente}</ambiente>"
+            f"<comprobante>{escape(st['xml'])}</comprobante>"
+            + ("<mensajes/>" if autorizado else f"<mensajes>{_mensaje('NO AUTORIZADO')}</mensajes>")
+            + "</ns2:autorizacion></autorizaciones>"
+        )
+    return _envelope(
+        f'<ns2:autorizacionComprobanteResponse xmlns:ns2="{NS["autorizacion"]}">'
+        f"<RespuestaAutorizacionComprobante>{inner}</RespuestaAutorizacionComprobante>"
+        "</ns2:autorizacionComprobanteResponse>"
+    )
+
+
+def fault_body(text: str) -> bytes:
+    return _envelope(
+        f"<soap:Fault><faultcode>soap:Server</faultcode><faultstring>{escape(text)}</faultstring></soap:Fault>"
+    )
+
+
+# ------------------------------
+# HTTP
+# ------------------------------
+def _read_wsdl(filename: str, base: str) -> bytes:
+    with open(os.path.join(WSDL_DIR, filename), "r", encoding="utf-8") as f:
+        return f.read().replace(BASE_PLACEHOLDER, base).encode("utf-8")
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive, like the real endpoints
+    server_version = "fake-sri/1.0"
+
+    @property
+    def fake(self) -> FakeSRI:
+        return self.server.fake
+
+    def log_message(self, fmt, *args):
+        if self.server.verbose:
+            super().log_message(fmt, *args)
+
+    def _send(self, status: int, body: bytes, ctype: str = "text/xml; charset=utf-8") -> None:
+        self.send_response(status)
+        self.send_header("Content-Type", ctype)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _json(self, data: Any, status: int = 200) -> None:
+        self._send(status, json.dumps(data, default=str).encode("utf-8"), "application/json")
+
+    def _body(self) -> bytes:
+        return self.rfile.read(int(self.headers.get("Content-Length") or 0))
+
+    def do_GET(self):
+        parts = urlsplit(self.path)
+        if parts.path == "/_fake/stats":
+            return self._json(self.fake.snapshot())
+        if parts.path == "/_fake/config":
+            return self._json(self.fake.config)
+        svc = SERVICES.get(parts.path)
+        if not svc:
+            return self._send(404, b"not found", "text/plain")
+        query = parse_qs(parts.query, keep_blank_values=True)
+        base = f"http://{self.headers.get('Host') or '%s:%s' % self.server.server_address[:2]}"
+        if "xsd" in query:
+            return self._send(200, _read_wsdl(f"{svc[1]}.xsd", base))
+        with self.fake.lock:
+            self.fake.stats["wsdl_fetches"] += 1
+        return self._send(200, _read_wsdl(f"{svc[1]}.wsdl", base))
+
+    def do_POST(self):
+        parts = urlsplit(self.path)
+        if parts.path == "/_fake/config":
+            try:
+                update = json.loads(self._body() or b"{}")
+            except ValueError:
+                return self._json({"error": "JSON inválido"}, 400)
+            return self._json(self.fake.configure(update))
+        if parts.path == "/_fake/reset":
+            self._body()
+            self.fake.reset()
+            return self._json({"ok": True})
+
+        svc = SERVICES.get(parts.path)
+        if not svc:
+            self._body()
+            return self._send(404, b"not found", "text/plain")
+        self._soap(svc[0], self._body())
+
+    def _soap(self, svc: str, payload: bytes) -> None:
+        t0 = time.monotonic()
+        fault = hang = False
+        body, status, estado = fault_body("Error interno (fake_sri)"), 500, ""
+        self.fake.enter(svc)
+        try:
+            delay, fault, hang = self.fake.chaos(svc)
+            if delay > 0:
+                time.sleep(delay)
+            if fault:
+                body, status, estado = fault_body("Error simulado (fake_sri)"), 500, ""
+            elif svc == "recepcion":
+                m = _XML_RE.search(payload)
+                try:
+                    xml_text = base64.b64decode(m.group(1)).decode("utf-8", errors="replace") if m else ""
+                except ValueError:
+                    xml_text = ""
+                outcome, clave = self.fake.recepcion(xml_text)
+                body, status = recepcion_body(outcome, clave), 200
+                estado = "DEVUELTA 43" if outcome == "DEVUELTA_43" else outcome
+            else:
+                m = _CLAVE_REQ_RE.search(payload)
+                clave = m.group(1).decode() if m else ""
+                st = self.fake.autorizacion(clave)
+                body, status = autorizacion_body(clave, st), 200
+                estado = st["final"] if st else "PPR"
+        finally:
+            self.fake.leave(svc)
+        self.fake.count(svc, estado, fault=fault, hung=hang, busy_ms=int((time.monotonic() - t0) * 1000))
+        try:
+            self._send(status, body)
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # the client gave up (timeout)
+
+
+class FakeSRIServer(ThreadingHTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address: tuple, fake: FakeSRI, verbose: bool = False):
+        super().__init__(address, Handler)
+        self.fake = fake
+        self.verbose = verbose
+
+
+def start(host: str = "127.0.0.1", port: int = 9999, config: Optional[Dict[str, Any]] = None,
+          verbose: bool = False) -> FakeSRIServer:
+    """Run the fake in a daemon thread of the current process; call .shutdown() when done."""
+    server = FakeSRIServer((host, int(port)), FakeSRI(config), verbose=verbose)
+    threading.Thread(target=server.serve_forever, name="fake-sri", daemon=True).start()
+    return server
+
+
+def main(argv=None) -> None:
+    p = argparse.ArgumentParser(description="Servidor SOAP local que imita los servicios offline del SRI")
+    p.add_argument("--host", default="127.0.0.1")
+    p.add_argument("--port", type=int, default=9999)
+    p.add_argument("--config", help="JSON con la configuración inicial (ver DEFAULT_CONFIG)")
+    p.add_argument("--seed", type=int)
+    p.add_argument("--latency-ms", type=float)
+    p.add_argument("--jitter-ms", type=float)
+    p.add_argument("--error-rate", type=float)
+    p.add_argument("--timeout-rate", type=float)
+    p.add_argument("--ppr-polls", type=int)
+    p.add_argument("--devuelta-rate", type=float, help="fracción DEVUELTA en Recepción")
+    p.add_argument("--devuelta43-rate", type=float, help="fracción DEVUELTA 43 en Recepción")
+    p.add_argument("--no-autorizado-rate", type=float, help="fracción NO AUTORIZADO en Autorización")
+    p.add_argument("--verbose", action="store_true")
+    args = p.parse_args(argv)
+
+    config: Dict[str, Any] = {}
+    if args.config:
+        with open(args.config, "r", encoding="utf-8") as f:
+            config = json.load(f)
+    for key in ("seed", "latency_ms", "jitter_ms", "error_rate", "timeout_rate", "ppr_polls"):
+        if getattr(args, key) is not None:
+            config[key] = getattr(args, key)
+    if args.devuelta_rate is not None or args.devuelta43_rate is not None:
+        dev, dev43 = args.devuelta_rate or 0.0, args.devuelta43_rate or 0.0
+        config["recepcion"] = {"RECIBIDA": max(0.0, 1 - dev - dev43), "DEVUELTA": dev, "DEVUELTA_43": dev43}
+    if args.no_autorizado_rate is not None:
+        config["autorizacion"] = {"AUTORIZADO": max(0.0, 1 - args.no_autorizado_rate),
+                                  "NO AUTORIZADO": args.no_autorizado_rate}
+
+    server = FakeSRIServer((args.host, args.port), FakeSRI(config), verbose=args.verbose)
+    print(f"fake SRI on http://{args.host}:{args.port}/comprobantes-electronicos-ws/…?wsdl")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,43 +1,54 @@
 # apps/josfe/josfe/sri_invoicing/transmission/poller2.py
 from __future__ import annotations
-import os, traceback, datetime as dt
+import time, traceback, datetime as dt
+from concurrent.futures import ThreadPoolExecutor
 import frappe
 from frappe.utils import now_datetime, add_to_date
 
-from josfe.sri_invoicing.core.transmission import soap
+from josfe.sri_invoicing.core.transmission import breaker, soap, tracing
 from josfe.sri_invoicing.xml.helpers import (
     _append_comment, _db_set_state, _format_msgs
 )
 from josfe.sri_invoicing.xml import paths
 from josfe.sri_invoicing.xml import service as xml_service
+from josfe.sri_invoicing.core.queue import timings
+
+QUEUE_DTYPE = "SRI XML Queue"
 
 # Backoff schedule in seconds (tweak as you like)
 BACKOFF = [30, 60, 180, 300, 600]  # 30s, 1m, 3m, 5m, 10m
 
-def _schedule_next(queue_name: str, clave: str, ambiente: str, attempt: int):
-    if attempt >= len(BACKOFF):
-        # Stop scheduling; operator can manually retry from UI
-        return
-    eta = add_to_date(now_datetime(), seconds=BACKOFF[attempt])
-    frappe.enqueue(
-        "josfe.sri_invoicing.core.transmission.poller2.poll_autorizacion_job",
-        queue_name=queue_name,
-        clave=clave,
-        ambiente=ambiente,
-        attempt=attempt+1,
-        queue="long",
-        job_name=f"sri_poll:{queue_name}:{attempt+1}",
-        enqueue_after_commit=True,
-        start_after=eta,  # v15 style
+# Scheduler tick: max rows per tick and how long a picked row stays claimed
+POLL_BATCH_LIMIT = 1000
+POLL_LEASE_SECONDS = 300
+
+def schedule_poll(queue_name: str, clave: str, ambiente: str, attempt: int):
+    """
+    Store the next Autorización poll on the row itself (poll_attempt/next_poll_at);
+    poll_due() picks it up. Past the end of BACKOFF the row is left unscheduled and
+    the operator can retry manually from the UI.
+    """
+    eta = add_to_date(now_datetime(), seconds=BACKOFF[attempt]) if attempt < len(BACKOFF) else None
+    frappe.db.set_value(
+        QUEUE_DTYPE,
+        queue_name,
+        {
+            "clave_acceso": clave,
+            "sri_ambiente": ambiente,
+            "poll_attempt": attempt + 1,
+            "next_poll_at": eta,
+        },
+        update_modified=False,
     )
 
 @frappe.whitelist()
 def poll_autorizacion_job(queue_name: str, clave: str, ambiente: str, attempt: int = 0):
     """
-    Background poller. attempt starts at 0.
+    Poll one row right now (manual use). attempt starts at 0.
+    Routine polling goes through poll_due().
     """
     try:
-        doc = frappe.get_doc("SRI XML Queue", queue_name)
+        doc = frappe.get_doc(QUEUE_DTYPE, queue_name)
     except Exception:
         frappe.log_error("poll_autorizacion_job: doc fetch failed", traceback.format_exc())
         return
@@ -47,13 +58,22 @@ def poll_autorizacion_job(queue_name: str, clave: str, ambiente: str, attempt: i
         return
 
     # Hit SRI
+    t0 = time.monotonic()
     try:
-        auto = soap.consultar_autorizacion(clave, ambiente)
+        auto = soap.consultar_autorizacion(clave, ambiente, attempt=int(attempt))
     except Exception:
         _append_comment(doc, "Error al invocar Autorización SRI (poll):\n```\n" + traceback.format_exc() + "\n```")
-        _schedule_next(queue_name, clave, ambiente, attempt)
+        schedule_poll(queue_name, clave, ambiente, int(attempt))
         return
 
+    _apply_autorizacion(doc, auto, clave, ambiente, int(attempt), sri_ms=timings.ms_since(t0))
+
+def _apply_autorizacion(doc, auto: dict, clave: str, ambiente: str, attempt: int,
+                        sri_ms: int | None = None) -> str:
+    """
+    Apply one Autorización response to a queue row: terminal outcomes write the
+    file and move the state; anything else reschedules. Returns the SRI estado.
+    """
     a_estado = (auto.get("estado") or "").upper()
     a_msgs = auto.get("mensajes") or []
     autorizado_xml_inner = auto.get("xml_autorizado")  # inner original XML
@@ -65,15 +85,18 @@ def poll_autorizacion_job(queue_name: str, clave: str, ambiente: str, attempt: i
         base_name = (doc.xml_file or "comprobante").split("/")[-1].split(".")[0]
         auth_filename = f"{base_name}.xml"  # ✅ unified: plain .xml in AUTORIZADOS
         payload = (xml_wrapper or autorizado_xml_inner or "").encode("utf-8")
+        shard = paths.shard_of(doc.xml_file)
 
         # Single source of truth: save under SRI/AUTORIZADOS
         file_url = xml_service._write_to_sri(
             rel_dir=paths.AUTH,
             filename=auth_filename,
             data=payload,
+            shard=shard,
         )
         try:
-            doc.db_set("xml_file", file_url)
+            # PENDIENTES copy is deleted when this transaction commits (xml.journal)
+            xml_service._repoint_xml_file(doc, file_url)
         except Exception:
             pass
 
@@ -83,15 +106,10 @@ def poll_autorizacion_job(queue_name: str, clave: str, ambiente: str, attempt: i
             _format_msgs("SRI (Autorización) AUTORIZADO", a_msgs) + f"\nArchivo: `{file_url}`"
         )
 
-        # State + cleanup of stale copies (Generados/Firmados/Pendientes)
+        _clear_schedule(doc.name)
         _db_set_state(doc, "Autorizado")
-        try:
-            # lazy import to avoid circular: service imports poller2, so poller2 must not import service at module import time
-            from josfe.sri_invoicing.xml import service as _svc
-            _svc._cleanup_after_authorized(auth_filename)
-        except Exception:
-            pass
-        return
+        timings.record(doc, "Autorizado", sri_ms=sri_ms, ambiente=ambiente)
+        return a_estado
 
     if a_estado in {"NO AUTORIZADO", "RECHAZADO", "DEVUELTA"}:
         frappe.flags.sri_devuelto_origin = "Autorización"
@@ -99,15 +117,17 @@ def poll_autorizacion_job(queue_name: str, clave: str, ambiente: str, attempt: i
 
         base_name = (doc.xml_file or "comprobante").split("/")[-1].split(".")[0]
         nat_filename = f"{base_name}.xml"  # ✅ unified: plain .xml in NO_AUTORIZADOS
+        shard = paths.shard_of(doc.xml_file)
 
         if xml_wrapper:
             nat_url = xml_service._write_to_sri(
                 rel_dir=paths.NOT_AUTH,
                 filename=nat_filename,
                 data=xml_wrapper.encode("utf-8"),
+                shard=shard,
             )
             try:
-                doc.db_set("xml_file", nat_url)
+                xml_service._repoint_xml_file(doc, nat_url)
             except Exception:
                 pass
         else:
@@ -118,39 +138,190 @@ def poll_autorizacion_job(queue_name: str, clave: str, ambiente: str, attempt: i
             except Exception:
                 pass
 
+        _clear_schedule(doc.name)
         _db_set_state(doc, "Devuelto")
+        timings.record(doc, "Devuelto", sri_ms=sri_ms, ambiente=ambiente)
+        return a_estado
+
+    # Still pending (PPR / EN PROCESO / empty). Only comment when we give up
+    # (schedule_poll leaves no next poll), otherwise every poll would add a timeline entry.
+    if attempt >= len(BACKOFF):
+        _append_comment(doc, _give_up_message(a_estado, a_msgs, attempt))
 
-        # ✅ Canonical cleanup: remove stale copies (Generados/Firmados/Pendientes)
+    # Ensure it stays physically under FIRMADOS/PENDIENTES while we wait
+    pending_prefix = paths.to_file_url(paths.SIGNED_SENT_PENDING, "")
+    if not (doc.xml_file or "").startswith(pending_prefix):
         try:
-            # lazy import avoids circular import with service ↔ poller2
-            from josfe.sri_invoicing.xml import service as _svc
-            _svc._cleanup_after_authorized(nat_filename)
+            moved = xml_service._move_xml_file(doc.xml_file, "Enviado")
+
+            if moved:
+                doc.db_set("xml_file", moved)
         except Exception:
-            # Fallback: at least remove the PENDIENTES copy
-            try:
-                # make sure `import os` is at the top of this file
-                pend_abs = paths.abs_path(paths.SIGNED_SENT_PENDING, nat_filename)
-                if os.path.exists(pend_abs):
-                    os.remove(pend_abs)
-            except Exception:
-                pass
+            pass
 
-        return
+    schedule_poll(doc.name, clave, ambiente, attempt)
+    return a_estado or "PPR"
 
-    # Still pending (PPR / EN PROCESO / empty)
-    _append_comment(
-        doc,
+def _give_up_message(a_estado: str, a_msgs: list, attempt: int) -> str:
+    return (
         _format_msgs(f"SRI (Autorización) {a_estado or 'PPR'}", a_msgs)
-        + f"\nReintento programado (intento {attempt+1}/{len(BACKOFF)})."
+        + f"\nSin respuesta tras {attempt + 1} consultas; reintente manualmente."
     )
 
-    # Ensure it stays physically under FIRMADOS/PENDIENTES while we wait
-    try:
-        moved = xml_service._move_xml_file(doc.xml_file, "Enviado")
+def _clear_schedule(queue_name: str) -> None:
+    frappe.db.set_value(QUEUE_DTYPE, queue_name, "next_poll_at", None, update_modified=False)
 
-        if moved:
-            doc.db_set("xml_file", moved)
-    except Exception:
-        pass
 
-    _schedule_next(queue_name, clave, ambiente, attempt)
+# ------------------------------
+# Scheduler tick (hooks.scheduler_events → cron every minute)
+# ------------------------------
+def _due_rows(limit: int) -> list[dict]:
+    return frappe.get_all(
+        QUEUE_DTYPE,
+        filters={"next_poll_at": ["<=", now_datetime()], "state": "Enviado"},
+        fields=["name", "clave_acceso", "sri_ambiente", "poll_attempt"],
+        order_by="next_poll_at asc",
+        limit_page_length=limit,
+    )
+
+def _claim(names: list[str]) -> None:
+    """Push next_poll_at forward so an overlapping tick does not pick the same rows."""
+    if not names:
+        return
+    frappe.db.sql(
+        """UPDATE `tabSRI XML Queue` SET next_poll_at = %s WHERE name IN %s""",
+        (add_to_date(now_datetime(), seconds=POLL_LEASE_SECONDS), tuple(names)),
+    )
+    frappe.db.commit()
+
+def _reschedule_pending(rows: list[dict], results: dict[str, dict] | None = None) -> None:
+    """
+    Bulk reschedule rows still in PPR: one UPDATE per backoff step. Rows past
+    the end of BACKOFF stop polling and get the give-up comment (one INSERT).
+    """
+    by_attempt: dict[int, list[str]] = {}
+    for r in rows:
+        by_attempt.setdefault(int(r.poll_attempt or 0), []).append(r.name)
+
+    given_up = []
+    for attempt, names in by_attempt.items():
+        eta = add_to_date(now_datetime(), seconds=BACKOFF[attempt]) if attempt < len(BACKOFF) else None
+        frappe.db.sql(
+            """UPDATE `tabSRI XML Queue`
+               SET poll_attempt = %s, next_poll_at = %s
+               WHERE name IN %s""",
+            (attempt + 1, eta, tuple(names)),
+        )
+        if eta is None:
+            given_up += [(name, attempt) for name in names]
+
+    if given_up:
+        _insert_give_up_comments(given_up, results or {})
+
+def _insert_give_up_comments(given_up: list[tuple], results: dict[str, dict]) -> None:
+    """Same timeline entry as _append_comment, for many rows at once."""
+    now, user = now_datetime(), frappe.session.user
+    values = []
+    for name, attempt in given_up:
+        auto = results.get(name) or {}
+        content = _give_up_message((auto.get("estado") or "").upper(), auto.get("mensajes") or [], attempt)
+        values.append((frappe.generate_hash(length=10), now, now, user, user,
+                       "Comment", QUEUE_DTYPE, name, user, content))
+    frappe.db.bulk_insert(
+        "Comment",
+        fields=["name", "creation", "modified", "owner", "modified_by",
+                "comment_type", "reference_doctype", "reference_name", "comment_email", "content"],
+        values=values,
+    )
+
+def poll_due(limit: int = POLL_BATCH_LIMIT) -> dict:
+    """
+    Single scheduler tick: query Autorización for every Enviado row whose
+    next_poll_at has passed, in parallel per ambiente, then apply the outcomes.
+    """
+    from josfe.sri_invoicing.doctype.fe_settings.fe_settings import get_settings
+
+    rows = _due_rows(int(limit))
+    if not rows:
+        return {"polled": 0}
+
+    runnable = [r for r in rows if r.clave_acceso]
+    orphans = [r.name for r in rows if not r.clave_acceso]
+    if orphans:
+        frappe.db.sql(
+            """UPDATE `tabSRI XML Queue` SET next_poll_at = NULL WHERE name IN %s""", (tuple(orphans),)
+        )
+        frappe.db.commit()
+    _claim([r.name for r in runnable])
+
+    settings = get_settings()
+    per_ambiente = max(1, int(settings.sri_max_in_flight or 8))
+    results: dict[str, dict] = {}
+    call_ms: dict[str, int] = {}
+    deferred: list[str] = []
+    for amb in sorted({r.sri_ambiente or "Pruebas" for r in runnable}):
+        group = [r for r in runnable if (r.sri_ambiente or "Pruebas") == amb]
+
+        # Breaker open: no calls, keep the attempt count; half-open: one probe row
+        decision = breaker.admit("Autorización", amb)
+        if decision is breaker.REJECT:
+            deferred += [r.name for r in group]
+            continue
+        if decision == breaker.PROBE:
+            deferred += [r.name for r in group[1:]]
+            group = group[:1]
+
+        client, hist = soap.get_client("Autorización", amb)
+
+        def _call(r, client=client, hist=hist):
+            t0 = time.monotonic()
+            res = soap.autorizacion_call(client, hist, r.clave_acceso, attempt=int(r.poll_attempt or 0))
+            return res, timings.ms_since(t0)
+
+        workers = min(per_ambiente, breaker.limit("Autorización", amb))
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="sri-poll",
+                                initializer=tracing.bind_site, initargs=(frappe.local.site,)) as pool:
+            for r, (res, ms) in zip(group, pool.map(_call, group)):
+                results[r.name] = res
+                call_ms[r.name] = ms
+                breaker.record_result("Autorización", amb, res, ms / 1000.0)
+
+    if deferred:
+        retry_at = add_to_date(now_datetime(), seconds=max(1, int(settings.sri_breaker_cooldown_seconds or 60)))
+        frappe.db.sql(
+            """UPDATE `tabSRI XML Queue` SET next_poll_at = %s WHERE name IN %s""",
+            (retry_at, tuple(deferred)),
+        )
+        frappe.db.commit()
+    skip = set(deferred)
+    runnable = [r for r in runnable if r.name not in skip]
+
+    # PPR/ERROR rows: one bulk reschedule; terminal rows: full per-row handling,
+    # one commit each so a failing row rolls back only its own state and files
+    pending, counts = [], {}
+    for r in runnable:
+        auto = results.get(r.name) or {}
+        a_estado = (auto.get("estado") or "").upper() or "PPR"
+        if a_estado in {"AUTORIZADO", "NO AUTORIZADO", "RECHAZADO", "DEVUELTA"} and (
+            a_estado != "AUTORIZADO" or auto.get("xml_wrapper") or auto.get("xml_autorizado")
+        ):
+            try:
+                doc = frappe.get_doc(QUEUE_DTYPE, r.name)
+                _apply_autorizacion(doc, auto, r.clave_acceso, r.sri_ambiente or "Pruebas",
+                                    int(r.poll_attempt or 0), sri_ms=call_ms.get(r.name))
+                frappe.db.commit()
+            except Exception:
+                frappe.db.rollback()
+                frappe.log_error(frappe.get_traceback(), f"SRI poll_due apply {r.name}")
+        else:
+            pending.append(r)
+        counts[a_estado] = counts.get(a_estado, 0) + 1
+
+    _reschedule_pending(pending, results)
+    frappe.db.commit()
+
+    if len(runnable) > len(pending):
+        frappe.publish_realtime("sri_xml_queue_changed", {"bulk": True}, user=None, doctype=QUEUE_DTYPE)
+
+    frappe.logger("sri_flow").info(f"[POLL] polled={len(runnable)} deferred={len(deferred)} outcomes={counts}")
+    return {"polled": len(runnable), "deferred": len(deferred), "outcomes": counts}
@@ -3,15 +3,169 @@
 
 from __future__ import annotations
 import base64
+import os
+import threading
+import time
 from typing import Dict, Any, Optional, Tuple, List
 import requests
 from zeep import Client, Settings, helpers
-from zeep.plugins import HistoryPlugin
+from zeep.cache import SqliteCache
+from zeep.plugins import Plugin
 from zeep.transports import Transport
 from lxml import etree
 import frappe
 
-from .endpoints import resolve_wsdl, get_endpoint_flags
+from .endpoints import ENDPOINT_VERSION_KEY  # noqa: F401  (older imports read it from here)
+from .endpoints import bump_version, endpoint_version, get_endpoint_config
+from . import breaker, tracing
+
+# ------------------------------
+# Client registry (per process)
+# ------------------------------
+# One zeep Client per (service, ambiente, wsdl_url, verify_ssl, timeout), reused
+# across calls: keeps the HTTP keep-alive pool and the parsed WSDL in memory.
+CLIENT_TTL_SECONDS = 6 * 3600          # rebuild clients at least every 6h
+WSDL_CACHE_TTL_SECONDS = 24 * 3600     # on-disk WSDL/XSD cache (survives restarts)
+HTTP_POOL_MAXSIZE = 16                 # keep-alive sockets per host
+
+_REGISTRY: Dict[tuple, Dict[str, Any]] = {}
+_REGISTRY_LOCK = threading.RLock()
+_STATS = {"hits": 0, "misses": 0, "expired": 0, "invalidations": 0}
+_seen_version: Dict[str, Any] = {"value": None}
+
+
+class _ThreadHistory(Plugin):
+    """
+    Same interface as zeep's HistoryPlugin (last_sent / last_received), but
+    stored per thread so one pooled client can serve concurrent calls.
+    """
+
+    def __init__(self, service: str = "", ambiente: str = ""):
+        self._local = threading.local()
+        self.service = service      # labels for tracing
+        self.ambiente = ambiente
+
+    def reset(self):
+        self._local.last_sent = None
+        self._local.last_received = None
+
+    @property
+    def last_sent(self):
+        return getattr(self._local, "last_sent", None)
+
+    @property
+    def last_received(self):
+        return getattr(self._local, "last_received", None)
+
+    def ingress(self, envelope, http_headers, operation):
+        self._local.last_received = {"envelope": envelope, "http_headers": http_headers, "operation": operation}
+        return envelope, http_headers
+
+    def egress(self, envelope, http_headers, operation, binding_options):
+        self._local.last_sent = {"envelope": envelope, "http_headers": http_headers, "operation": operation}
+        return envelope, http_headers
+
+
+def _wsdl_cache() -> Optional[SqliteCache]:
+    """Parsed-WSDL cache on local disk (sites/<site>/private/sri_cache/wsdl.sqlite)."""
+    try:
+        folder = frappe.get_site_path("private", "sri_cache")
+        os.makedirs(folder, exist_ok=True)
+        return SqliteCache(path=os.path.join(folder, "wsdl.sqlite"), timeout=WSDL_CACHE_TTL_SECONDS)
+    except Exception:
+        frappe.logger("sri_flow").warning("[SOAP] WSDL disk cache unavailable; using in-memory only")
+        return None
+
+
+def _drop_all_locked() -> None:
+    for entry in _REGISTRY.values():
+        try:
+            entry["session"].close()
+        except Exception:
+            pass
+    _REGISTRY.clear()
+
+
+def invalidate_clients(broadcast: bool = True) -> None:
+    """
+    Forget every pooled client in this process. With broadcast=True the Redis
+    version key is bumped so other workers drop theirs on their next call.
+    """
+    with _REGISTRY_LOCK:
+        _drop_all_locked()
+        _STATS["invalidations"] += 1
+    if broadcast:
+        bump_version()
+
+
+def _build_client(wsdl: str, verify_ssl: bool, timeout: int, service: str = "", ambiente: str = "") -> Dict[str, Any]:
+    session = requests.Session()
+    session.verify = verify_ssl
+    adapter = tracing.TracingAdapter(pool_connections=4, pool_maxsize=HTTP_POOL_MAXSIZE)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    session.hooks["response"].append(tracing.on_response)
+
+    transport = Transport(session=session, timeout=timeout, cache=_wsdl_cache())
+    settings = Settings(strict=False, xml_huge_tree=True)
+    history = _ThreadHistory(service, ambiente)
+    client = Client(wsdl=wsdl, transport=transport, settings=settings, plugins=[history])
+    return {"client": client, "history": history, "session": session, "created": time.monotonic()}
+
+
+def get_client(service: str, ambiente: str) -> Tuple[Client, _ThreadHistory]:
+    """Return a pooled (client, history) pair for service+ambiente, building it on a miss."""
+    config = get_endpoint_config(service, ambiente)
+    wsdl, verify_ssl, timeout = config["url"], config["verify_ssl"], config["timeout"]
+    if not wsdl:
+        raise RuntimeError(f"No WSDL configured for service={service}, ambiente={ambiente}")
+    key = (service, ambiente, wsdl, bool(verify_ssl), int(timeout))
+
+    version = endpoint_version()
+    with _REGISTRY_LOCK:
+        if version != _seen_version["value"]:
+            if _seen_version["value"] is not None:
+                _drop_all_locked()
+                _STATS["invalidations"] += 1
+            _seen_version["value"] = version
+
+        entry = _REGISTRY.get(key)
+        if entry and time.monotonic() - entry["created"] > CLIENT_TTL_SECONDS:
+            _STATS["expired"] += 1
+            try:
+                entry["session"].close()
+            except Exception:
+                pass
+            _REGISTRY.pop(key, None)
+            entry = None
+
+        if entry:
+            _STATS["hits"] += 1
+        else:
+            _STATS["misses"] += 1
+            entry = _build_client(wsdl, verify_ssl, timeout, service=service, ambiente=ambiente)
+            _REGISTRY[key] = entry
+            frappe.logger("sri_flow").info(f"[SOAP] client built service={service} ambiente={ambiente} wsdl={wsdl}")
+
+    entry["history"].reset()
+    return entry["client"], entry["history"]
+
+
+def client_stats() -> Dict[str, Any]:
+    with _REGISTRY_LOCK:
+        return {
+            **_STATS,
+            "clients": len(_REGISTRY),
+            "keys": [list(k) for k in _REGISTRY],
+        }
+
+
+@frappe.whitelist()
+def get_client_stats() -> Dict[str, Any]:
+    """Hit/miss counters of the SOAP client registry in the worker serving this request."""
+    frappe.only_for(("System Manager", "Accounts Manager"))
+    return client_stats()
+
 
 def _ambiente_from_xml(xml_bytes: bytes) -> str:
     """
@@ -37,34 +191,51 @@ def _ambiente_from_xml(xml_bytes: bytes) -> str:
         pass
     return "Pruebas"
 
-def _zeep_client(service: str, ambiente: str) -> Tuple[Client, HistoryPlugin]:
-    wsdl = resolve_wsdl(service, ambiente)
-    if not wsdl:
-        raise RuntimeError(f"No WSDL configured for service={service}, ambiente={ambiente}")
-
-    verify_ssl, timeout = get_endpoint_flags(service, ambiente)
-    session = requests.Session()
-    session.verify = verify_ssl
-    transport = Transport(session=session, timeout=timeout)
-    settings = Settings(strict=False, xml_huge_tree=True)
+def _breaker_open(service: str, ambiente: str) -> Dict[str, Any]:
+    """Fail-fast result while the (service, ambiente) breaker is open: no socket is opened."""
+    return {
+        "estado": "ERROR",
+        "mensajes": [f"SRI {service} ({ambiente}) no disponible: circuito abierto, se reintentará automáticamente."],
+        "raw_xml": "",
+        "ambiente": ambiente,
+        "breaker_open": True,
+    }
 
-    history = HistoryPlugin()
-    client = Client(wsdl=wsdl, transport=transport, settings=settings, plugins=[history])
-    return client, history
+def _zeep_client(service: str, ambiente: str) -> Tuple[Client, _ThreadHistory]:
+    """Kept for callers of the old API; clients now come from the pooled registry."""
+    return get_client(service, ambiente)
 
-def enviar_recepcion(xml_bytes: bytes, ambiente: Optional[str] = None) -> Dict[str, Any]:
+def enviar_recepcion(xml_bytes: bytes, ambiente: Optional[str] = None, attempt: int = 0) -> Dict[str, Any]:
     """
     Send XML to SRI Recepción. If ambiente not provided, it is inferred from the XML.
     Returns dict: {estado, mensajes, raw_xml, ambiente, xml_wrapper?}
     """
     amb = ambiente or _ambiente_from_xml(xml_bytes)
+    if breaker.admit("Recepción", amb) is breaker.REJECT:
+        return _breaker_open("Recepción", amb)
     client, hist = _zeep_client("Recepción", amb)
+    t0 = time.monotonic()
+    out = recepcion_call(client, hist, xml_bytes, amb, attempt=attempt)
+    breaker.record_result("Recepción", amb, out, time.monotonic() - t0)
+
+    # Mark DEVUELTO origin for Recepción (routes the file to Rechazados)
+    if out.get("estado") in ("DEVUELTA", "RECHAZADO"):
+        frappe.flags.sri_devuelto_origin = "Recepción"
+    return out
 
+def recepcion_call(client: Client, hist: _ThreadHistory, xml_bytes: bytes, amb: str, attempt: int = 0) -> Dict[str, Any]:
+    """
+    Network part of enviar_recepcion. Touches neither frappe.local nor the DB,
+    so it can run inside worker threads with a client obtained from get_client().
+    """
+    hist.reset()
+    trace = tracing.start("Recepción", amb, tracing.clave_from_xml(xml_bytes), attempt)
     xml_b64 = base64.b64encode(xml_bytes).decode()
     try:
         res = client.service.validarComprobante(xml_b64)
         data = helpers.serialize_object(res) or {}
     except Exception as e:
+        tracing.finish(trace, "ERROR", e)
         return {"estado": "ERROR", "mensajes": [f"Error de conexión/Zeep: {e!r}"], "raw_xml": "", "ambiente": amb}
 
     raw_xml = ""
@@ -92,20 +263,36 @@ def enviar_recepcion(xml_bytes: bytes, ambiente: Optional[str] = None) -> Dict[s
         # best-effort only
         pass
 
-    # Mark DEVUELTO origin for Recepción and build a compact wrapper for storage (optional)
+    # Compact wrapper for storage of DEVUELTA/RECHAZADO responses
     xml_wrapper = ""
     if estado in ("DEVUELTA", "RECHAZADO"):
-        frappe.flags.sri_devuelto_origin = "Recepción"
         xml_wrapper = _build_recepcion_wrapper(estado, mensajes, raw_xml, amb)
 
+    tracing.finish(trace, estado)
     return {"estado": estado, "mensajes": mensajes, "raw_xml": raw_xml, "ambiente": amb, "xml_wrapper": xml_wrapper}
 
-def consultar_autorizacion(clave_acceso: str, ambiente: str) -> Dict[str, Any]:
+def consultar_autorizacion(clave_acceso: str, ambiente: str, attempt: int = 0) -> Dict[str, Any]:
+    if breaker.admit("Autorización", ambiente) is breaker.REJECT:
+        return _breaker_open("Autorización", ambiente)
     client, hist = _zeep_client("Autorización", ambiente)
+    t0 = time.monotonic()
+    out = autorizacion_call(client, hist, clave_acceso, attempt=attempt)
+    breaker.record_result("Autorización", ambiente, out, time.monotonic() - t0)
+
+    # If NAT/DEVUELTA, tag origin=Autorización so the mover routes to NO_AUTORIZADOS
+    if out.get("estado") in {"NO AUTORIZADO", "RECHAZADO", "DEVUELTA"}:
+        frappe.flags.sri_devuelto_origin = "Autorización"
+    return out
+
+def autorizacion_call(client: Client, hist: _ThreadHistory, clave_acceso: str, attempt: int = 0) -> Dict[str, Any]:
+    """Network part of consultar_autorizacion; thread-safe like recepcion_call."""
+    hist.reset()
+    trace = tracing.start("Autorización", hist.ambiente, clave_acceso, attempt)
     try:
         res = client.service.autorizacionComprobante(clave_acceso)
         data = helpers.serialize_object(res) or {}
     except Exception as e:
+        tracing.finish(trace, "ERROR", e)
         return {"estado": "ERROR", "mensajes": [f"Error de conexión/Zeep: {e!r}"], "raw_xml": ""}
 
     raw_xml = ""
@@ -116,6 +303,7 @@ def consultar_autorizacion(clave_acceso: str, ambiente: str) -> Dict[str, Any]:
     if isinstance(auths, dict):
         auths = [auths]
     if not auths:
+        tracing.finish(trace, "PPR")
         return {"estado": "PPR", "raw_xml": raw_xml}  # processing
 
     a0 = auths[0]
@@ -125,10 +313,6 @@ def consultar_autorizacion(clave_acceso: str, ambiente: str) -> Dict[str, Any]:
     xml_inner = a0.get("comprobante")  # original XML as string
     xml_wrapper = _build_autorizacion_wrapper(a0)
 
-    # If NAT/DEVUELTA, tag origin=Autorización so the mover routes to NO_AUTORIZADOS
-    if estado in {"NO AUTORIZADO", "RECHAZADO", "DEVUELTA"}:
-        frappe.flags.sri_devuelto_origin = "Autorización"
-
     out = {
         "estado": estado,
         "numero": numero,
@@ -137,6 +321,7 @@ def consultar_autorizacion(clave_acceso: str, ambiente: str) -> Dict[str, Any]:
         "xml_wrapper": xml_wrapper,
         "raw_xml": raw_xml,
     }
+    tracing.finish(trace, estado)
 
     # keep mensajes
     try:
@@ -0,0 +1,297 @@
+# -*- coding: utf-8 -*-
+# apps/josfe/josfe/sri_invoicing/core/transmission/tracing.py
+"""
+Tracing of every SRI SOAP call (Recepción / Autorización).
+
+soap.recepcion_call / autorizacion_call open a trace per call; the HTTP side
+is filled in by the pooled session itself:
+
+- a `response` hook on the requests.Session records HTTP status, request and
+  response bytes, time to response headers and how many HTTP requests the
+  call made (zeep retries / WSDL fetches included);
+- the urllib3 connection classes of the adapter time connect() (TCP + TLS),
+  so a reused keep-alive socket shows connect_ms = 0.
+
+Each record carries the site (pool threads get it through bind_site()).
+Records are JSON lines in <bench>/logs/sri_soap_trace.jsonl, appended by
+every web / RQ worker process of the bench: each line is one O_APPEND write,
+rotation is done under an flock by whichever process sees the file full, and
+the others reopen the new file when they notice the inode changed
+(WatchedFileHandler). No DB is touched, so this also works inside the worker
+threads of the bulk sender and poll_due. get_soap_summary() reads the log
+back for availability / latency over the last N minutes.
+"""
+from __future__ import annotations
+
+import fcntl
+import json
+import logging
+import os
+import re
+import threading
+import time
+from collections import defaultdict
+from logging.handlers import WatchedFileHandler
+from typing import Any, Dict, List, Optional
+
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+import frappe
+from frappe.utils import get_bench_path
+
+from josfe.sri_invoicing.core.utils.stats import percentile
+
+TRACE_FILE = "sri_soap_trace.jsonl"
+TRACE_MAX_BYTES = 10 * 1024 * 1024
+TRACE_BACKUPS = 5
+ERROR_TEXT_MAX = 300
+
+# estado values that mean "SRI answered" (anything else counts against availability)
+ANSWERED = {"RECIBIDA", "DEVUELTA", "RECHAZADO", "AUTORIZADO", "NO AUTORIZADO", "PPR"}
+
+_CLAVE_RE = re.compile(rb"<\s*claveAcceso\s*>\s*([0-9]{10,49})\s*<")
+
+_local = threading.local()
+_logger_lock = threading.Lock()
+_logger: Optional[logging.Logger] = None
+
+
+# ------------------------------
+# HTTP instrumentation (installed by soap._build_client)
+# ------------------------------
+def _current() -> Optional[Dict[str, Any]]:
+    return getattr(_local, "trace", None)
+
+
+class _TimedConnectMixin:
+    def connect(self):
+        t0 = time.monotonic()
+        try:
+            return super().connect()
+        finally:
+            trace = _current()
+            if trace is not None:
+                trace["connect_ms"] += int(round((time.monotonic() - t0) * 1000))
+
+
+class _TimedHTTPConnection(_TimedConnectMixin, HTTPConnection):
+    pass
+
+
+class _TimedHTTPSConnection(_TimedConnectMixin, HTTPSConnection):
+    pass
+
+
+class _TimedHTTPPool(HTTPConnectionPool):
+    ConnectionCls = _TimedHTTPConnection
+
+
+class _TimedHTTPSPool(HTTPSConnectionPool):
+    ConnectionCls = _TimedHTTPSConnection
+
+
+class TracingAdapter(HTTPAdapter):
+    """HTTPAdapter whose pools time socket connects into the current trace."""
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {"http": _TimedHTTPPool, "https": _TimedHTTPSPool}
+
+
+def on_response(response, *args, **kwargs):
+    """requests `response` hook: accumulate HTTP facts into the current trace."""
+    trace = _current()
+    if trace is None:
+        return response
+    body = getattr(response.request, "body", None) or b""
+    trace["http_requests"] += 1
+    trace["http_status"] = response.status_code
+    trace["request_bytes"] += len(body) if isinstance(body, (bytes, str)) else 0
+    trace["response_bytes"] += len(response.content or b"")
+    if response.elapsed is not None:
+        trace["http_ms"] += int(round(response.elapsed.total_seconds() * 1000))
+    return response
+
+
+# ------------------------------
+# Per-call trace
+# ------------------------------
+def clave_from_xml(xml_bytes: bytes) -> str:
+    m = _CLAVE_RE.search(xml_bytes or b"")
+    return m.group(1).decode() if m else ""
+
+
+def bind_site(site: str) -> None:
+    """ThreadPoolExecutor initializer: pool threads have no frappe.local.site of their own."""
+    _local.site = site
+
+
+def _site() -> Optional[str]:
+    return getattr(frappe.local, "site", None) or getattr(_local, "site", None)
+
+
+def start(service: str, ambiente: str, clave: str = "", attempt: int = 0) -> Dict[str, Any]:
+    trace = {
+        "site": _site(),
+        "service": service,
+        "ambiente": ambiente,
+        "clave": clave,
+        "attempt": int(attempt or 0),
+        "connect_ms": 0,
+        "http_ms": 0,
+        "http_requests": 0,
+        "http_status": None,
+        "request_bytes": 0,
+        "response_bytes": 0,
+        "t0": time.monotonic(),
+    }
+    _local.trace = trace
+    return trace
+
+
+def finish(trace: Dict[str, Any], estado: str, error: Optional[BaseException] = None) -> None:
+    """Close the trace and append it to the log. Never raises."""
+    _local.trace = None
+    try:
+        rec = {k: v for k, v in trace.items() if k != "t0"}
+        rec.update({
+            "ts": round(time.time(), 3),
+            "total_ms": int(round((time.monotonic() - trace["t0"]) * 1000)),
+            "retries": max(0, rec["http_requests"] - 1) + rec["attempt"],
+            "estado": estado or "",
+        })
+        if error is not None:
+            rec["error"] = f"{type(error).__name__}: {error}"[:ERROR_TEXT_MAX]
+        _get_logger().info(json.dumps(rec, separators=(",", ":"), default=str))
+    except Exception:
+        pass
+
+
+def _trace_path() -> str:
+    return os.path.join(get_bench_path(), "logs", TRACE_FILE)
+
+
+class _SharedRotatingHandler(WatchedFileHandler):
+    """Size-based rotation that several processes can share (see module docstring)."""
+
+    def emit(self, record):
+        try:
+            if os.path.getsize(self.baseFilename) >= TRACE_MAX_BYTES:
+                self._rotate()
+        except OSError:
+            pass
+        super().emit(record)  # reopens when the file was rotated, here or elsewhere
+
+    def _rotate(self) -> None:
+        base = self.baseFilename
+        with open(f"{base}.lock", "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                if os.path.getsize(base) < TRACE_MAX_BYTES:
+                    return  # another process rotated first
+                for i in range(TRACE_BACKUPS - 1, 0, -1):
+                    if os.path.exists(f"{base}.{i}"):
+                        os.replace(f"{base}.{i}", f"{base}.{i + 1}")
+                os.replace(base, f"{base}.1")
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def _get_logger() -> logging.Logger:
+    global _logger
+    if _logger is None:
+        with _logger_lock:
+            if _logger is None:
+                path = _trace_path()
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                handler = _SharedRotatingHandler(path)
+                handler.setFormatter(logging.Formatter("%(message)s"))
+                logger = logging.getLogger("sri_soap_trace")
+                logger.setLevel(logging.INFO)
+                logger.propagate = False
+                logger.handlers = [handler]
+                _logger = logger
+    return _logger
+
+
+# ------------------------------
+# Summary
+# ------------------------------
+def _read_since(cutoff: float, site: Optional[str]) -> List[dict]:
+    """Trace records newer than cutoff (epoch seconds), newest file first."""
+    base = _trace_path()
+    files = [base] + [f"{base}.{i}" for i in range(1, TRACE_BACKUPS + 1)]
+    out: List[dict] = []
+    for path in files:
+        if not os.path.exists(path):
+            break
+        older_seen = False
+        with open(path, "r", encoding="utf-8", errors="ignore") as f:
+            for line in f:
+                try:
+                    rec = json.loads(line)
+                except ValueError:
+                    continue
+                if rec.get("ts", 0) < cutoff:
+                    older_seen = True
+                    continue
+                # Unattributed records cannot be told apart between sites
+                if not rec.get("site") or (site and rec["site"] != site):
+                    continue
+                out.append(rec)
+        if older_seen:
+            break
+    return out
+
+
+def _ms(values: List[float]) -> Dict[str, float]:
+    values = sorted(values)
+    return {
+        "p50": percentile(values, 50),
+        "p95": percentile(values, 95),
+        "p99": percentile(values, 99),
+        "max": values[-1] if values else 0,
+    }
+
+
+@frappe.whitelist()
+def get_soap_summary(minutes: int = 15) -> Dict[str, Any]:
+    """Availability and latency of SRI per (service, ambiente) over the last `minutes`."""
+    frappe.only_for(("System Manager", "Accounts Manager"))
+
+    minutes = max(1, int(minutes or 15))
+    recs = _read_since(time.time() - minutes * 60, frappe.local.site)
+
+    groups: Dict[tuple, List[dict]] = defaultdict(list)
+    for r in recs:
+        groups[(r.get("service") or "", r.get("ambiente") or "")].append(r)
+
+    rows = []
+    for (service, ambiente), items in sorted(groups.items()):
+        estados: Dict[str, int] = defaultdict(int)
+        for r in items:
+            estados[r.get("estado") or "?"] += 1
+        answered = sum(n for e, n in estados.items() if e in ANSWERED)
+        errors = [r["error"] for r in items if r.get("error")]
+        rows.append({
+            "service": service,
+            "ambiente": ambiente,
+            "calls": len(items),
+            "availability": round(answered / len(items), 4),
+            "estados": dict(estados),
+            "total_ms": _ms([r.get("total_ms") or 0 for r in items]),
+            "connect_ms": _ms([r.get("connect_ms") or 0 for r in items]),
+            "new_connections": sum(1 for r in items if r.get("connect_ms")),
+            "retries": sum(int(r.get("retries") or 0) for r in items),
+            "http_status": dict(sorted(
+                (str(s), sum(1 for r in items if r.get("http_status") == s))
+                for s in {r.get("http_status") for r in items}
+            )),
+            "avg_request_bytes": int(sum(r.get("request_bytes") or 0 for r in items) / len(items)),
+            "avg_response_bytes": int(sum(r.get("response_bytes") or 0 for r in items) / len(items)),
+            "last_error": errors[-1] if errors else None,
+        })
+
+    return {"minutes": minutes, "calls": len(recs), "services": rows}
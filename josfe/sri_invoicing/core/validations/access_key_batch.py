@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+# apps/josfe/josfe/sri_invoicing/core/validations/access_key_batch.py
+"""
+Column-wise claves de acceso (NumPy).
+
+Same layout and mod-11 rule as access_key.generate_access_key, applied to whole
+arrays at once, for bulk re-keying (ambiente switch, contingency re-emission)
+and for auditing stored comprobantes:
+
+    positions  0-7  fecha ddmmaaaa      30-38 secuencial
+               8-9  codDoc              39-46 código numérico
+              10-22 RUC                 47    tipo de emisión
+              23    ambiente            48    dígito verificador
+              24-26 estab / 27-29 ptoEmi
+
+Every field argument is a scalar (broadcast) or a sequence of the batch length.
+Fields are normalised exactly like the scalar helper (digits only, zero-padded,
+rightmost N kept), so both always produce the same key.
+"""
+from __future__ import annotations
+
+from typing import Dict, NamedTuple, Sequence, Union
+
+import numpy as np
+
+from josfe.sri_invoicing.core.validations.access_key import _only_digits, _zpad
+
+KEY_LEN = 49
+BASE_LEN = 48
+
+# (name, start, end) inside the 49-digit key
+FIELDS = (
+    ("fecha_emision", 0, 8),
+    ("cod_doc", 8, 10),
+    ("ruc", 10, 23),
+    ("ambiente", 23, 24),
+    ("estab", 24, 27),
+    ("pto_emi", 27, 30),
+    ("secuencial", 30, 39),
+    ("codigo_numerico", 39, 47),
+    ("tipo_emision", 47, 48),
+    ("dv", 48, 49),
+)
+
+# Weights 2..7 cycling from the rightmost digit, laid out left to right
+WEIGHTS = np.array([(2, 3, 4, 5, 6, 7)[(BASE_LEN - 1 - j) % 6] for j in range(BASE_LEN)], dtype=np.int64)
+
+Column = Union[str, int, Sequence, np.ndarray]
+
+
+class KeyCheck(NamedTuple):
+    well_formed: np.ndarray   # bool: exactly 49 ASCII digits
+    check_ok: np.ndarray      # bool: well formed and the last digit matches
+    expected_dv: np.ndarray   # int8: check digit of the first 48 digits (-1 when malformed)
+
+
+# ------------------------------
+# Helpers
+# ------------------------------
+def _as_str_array(values: Column) -> np.ndarray:
+    arr = np.asarray(values, dtype=object)
+    if arr.ndim == 0:
+        arr = arr.reshape(1)
+    return np.array(["" if v is None else str(v) for v in arr.ravel()], dtype=str)
+
+
+def _batch_len(columns: Dict[str, np.ndarray]) -> int:
+    lengths = {len(c) for c in columns.values() if len(c) != 1}
+    if len(lengths) > 1:
+        raise ValueError("Columns of different lengths: %s" % sorted(lengths))
+    return lengths.pop() if lengths else 1
+
+
+def _fixed_width(col: np.ndarray, width: int, n: int) -> np.ndarray:
+    """Digits-only, zero-padded, rightmost `width` chars; vectorised when already clean."""
+    col = np.broadcast_to(col, (n,)) if len(col) == 1 else col
+    if col.size and np.char.isdigit(col).all() and (np.char.str_len(col) <= width).all():
+        return np.char.zfill(col, width).astype(f"<U{width}")
+    return np.array([_zpad(_only_digits(v), width) for v in col], dtype=f"<U{width}")
+
+
+def _digits(strings: np.ndarray, width: int) -> tuple[np.ndarray, np.ndarray]:
+    """(n, width) uint8 digit matrix and a per-row 'only digits, exact width' mask."""
+    n = len(strings)
+    if n == 0:
+        return np.zeros((0, width), dtype=np.uint8), np.zeros(0, dtype=bool)
+    raw = np.char.encode(strings, "ascii", "replace").astype(f"S{width}")
+    mat = np.frombuffer(raw.tobytes(), dtype=np.uint8).reshape(n, width) - np.uint8(48)
+    ok = (np.char.str_len(strings) == width) & (mat <= 9).all(axis=1)
+    mat[~ok] = 0
+    return mat, ok
+
+
+def check_digits(bases: np.ndarray) -> np.ndarray:
+    """Mod-11 check digit of each row of an (n, 48) digit matrix."""
+    total = bases.astype(np.int64) @ WEIGHTS
+    dv = 11 - total % 11
+    return np.where(dv == 11, 0, np.where(dv == 10, 1, dv)).astype(np.int8)
+
+
+# ------------------------------
+# Public API
+# ------------------------------
+def generate_access_keys(*,
+    fecha_emision_ddmmyyyy: Column,
+    cod_doc: Column,
+    ruc: Column,
+    ambiente: Column,
+    estab: Column,
+    pto_emi: Column,
+    secuencial_9d: Column,
+    codigo_numerico_8d: Column,
+    tipo_emision: Column) -> np.ndarray:
+    """Array of 49-digit claves (dtype <U49), one per row of the input columns."""
+    raw = {
+        "fecha": _as_str_array(fecha_emision_ddmmyyyy),
+        "cod_doc": _as_str_array(cod_doc),
+        "ruc": _as_str_array(ruc),
+        "ambiente": _as_str_array(ambiente),
+        "estab": _as_str_array(estab),
+        "pto_emi": _as_str_array(pto_emi),
+        "secuencial": _as_str_array(secuencial_9d),
+        "codigo": _as_str_array(codigo_numerico_8d),
+        "tipo_emision": _as_str_array(tipo_emision),
+    }
+    n = _batch_len(raw)
+
+    fecha = raw["fecha"]
+    fecha = np.broadcast_to(fecha, (n,)) if len(fecha) == 1 else fecha
+    fecha = np.array([_only_digits(v) for v in fecha], dtype="<U8") \
+        if not np.char.isdigit(fecha).all() else fecha
+    bad = np.flatnonzero(np.char.str_len(fecha) != 8)
+    if bad.size:
+        raise ValueError("fecha_emision_ddmmyyyy must be 8 digits ddmmaaaa (rows %s)" % bad[:10].tolist())
+
+    base = fecha.astype("<U8")
+    for key, width in (("cod_doc", 2), ("ruc", 13), ("ambiente", 1), ("estab", 3), ("pto_emi", 3),
+                       ("secuencial", 9), ("codigo", 8), ("tipo_emision", 1)):
+        base = np.char.add(base, _fixed_width(raw[key], width, n))
+
+    digits, _ok = _digits(base, BASE_LEN)
+    dv = check_digits(digits)
+    return np.char.add(base, dv.astype("<U1"))
+
+
+def validate_access_keys(keys: Column) -> KeyCheck:
+    """Shape and check-digit validity of every key (surrounding whitespace is ignored)."""
+    keys = np.char.strip(_as_str_array(keys))
+    digits, well_formed = _digits(keys, KEY_LEN)
+    expected = check_digits(digits[:, :BASE_LEN])
+    check_ok = well_formed & (digits[:, BASE_LEN] == expected)
+    return KeyCheck(well_formed, check_ok, np.where(well_formed, expected, -1).astype(np.int8))
+
+
+def split_access_keys(keys: Column) -> Dict[str, np.ndarray]:
+    """Field columns of each key (FIELDS names); malformed keys give empty strings."""
+    keys = np.char.strip(_as_str_array(keys))
+    _digits_mat, well_formed = _digits(keys, KEY_LEN)
+    keys = np.where(well_formed, keys, "")
+    fixed = keys.astype(f"<U{KEY_LEN}")
+    as_bytes = np.char.encode(fixed, "ascii").astype(f"S{KEY_LEN}")
+    view = np.frombuffer(as_bytes.tobytes(), dtype="S1").reshape(len(keys), KEY_LEN) \
+        if len(keys) else np.zeros((0, KEY_LEN), dtype="S1")
+    out = {}
+    for name, start, end in FIELDS:
+        cols = view[:, start:end]
+        joined = cols.copy().view(f"S{end - start}").ravel() if len(keys) else np.zeros(0, dtype="S1")
+        out[name] = np.char.decode(joined, "ascii")
+    return out
@@ -0,0 +1,194 @@
+# -*- coding: utf-8 -*-
+# apps/josfe/josfe/sri_invoicing/core/validations/clave_audit.py
+"""
+Audit of the claves de acceso stored under SRI/AUTORIZADOS.
+
+Each file is read once and scanned with byte regexes (no XML parse): the
+wrapper's numeroAutorizacion, the comprobante's claveAcceso and the
+infoTributaria / fechaEmision fields the key is made of. The claves are then
+checked column-wise (access_key_batch) and matched against SRI XML Queue.
+
+Issue codes per file:
+- sin_clave            no claveAcceso in the file
+- malformada           claveAcceso is not 49 digits
+- digito_verificador   mod-11 check digit does not match
+- campos               key disagrees with the comprobante (listed in `fields`)
+- numero_autorizacion  wrapper numeroAutorizacion differs from the clave
+- cola                 queue row pointing at the file carries another clave
+- duplicada            same clave in more than one file
+- ilegible             the file could not be read
+"""
+from __future__ import annotations
+
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+import frappe
+
+from josfe.sri_invoicing.core.validations import access_key_batch
+from josfe.sri_invoicing.xml import paths
+
+READ_WORKERS = 8
+
+_TAG = {
+    name: re.compile(rb"<" + name.encode() + rb">\s*([^<]*?)\s*</" + name.encode() + rb">")
+    for name in ("numeroAutorizacion", "claveAcceso", "ruc", "codDoc", "estab", "ptoEmi",
+                 "secuencial", "tipoEmision", "fechaEmision")
+}
+_INFO_TRIB = re.compile(rb"<infoTributaria>(.*?)</infoTributaria>", re.S)
+_AMBIENTE = re.compile(rb"<ambiente>\s*([^<]*?)\s*</ambiente>")
+# Looked up in the whole file; the rest only inside infoTributaria
+_OUTSIDE_INFO = ("numeroAutorizacion", "fechaEmision")
+
+# key field -> (comprobante tag, width) compared after digits-only / zero-padding
+_COMPARED = (
+    ("fecha_emision", "fechaEmision", 8),
+    ("cod_doc", "codDoc", 2),
+    ("ruc", "ruc", 13),
+    ("ambiente", "ambiente", 1),
+    ("estab", "estab", 3),
+    ("pto_emi", "ptoEmi", 3),
+    ("secuencial", "secuencial", 9),
+    ("tipo_emision", "tipoEmision", 1),
+)
+
+
+def _first(pattern: re.Pattern, data: bytes) -> str:
+    m = pattern.search(data)
+    return m.group(1).decode("utf-8", "replace") if m else ""
+
+
+def _scan_file(abs_path: str) -> Dict[str, str]:
+    """Raw field values of one stored file ('' where absent; 'error' set when unreadable)."""
+    try:
+        with open(abs_path, "rb") as f:
+            data = f.read()
+    except OSError as e:
+        return {"error": str(e)}
+
+    # infoTributaria carries its own <ambiente> (the wrapper's one says PRUEBAS/PRODUCCION)
+    m = _INFO_TRIB.search(data)
+    info = m.group(1) if m else b""
+    out = {tag: _first(rx, data if tag in _OUTSIDE_INFO else info) for tag, rx in _TAG.items()}
+    out["ambiente"] = _first(_AMBIENTE, info)
+    return out
+
+
+def _digits_col(values: List[str], width: int) -> np.ndarray:
+    return np.array(
+        [("".join(ch for ch in v if ch.isdigit()).zfill(width)[-width:] if v else "") for v in values],
+        dtype=f"<U{width}",
+    )
+
+
+def _queue_claves() -> Dict[str, tuple]:
+    """'<shard>/<filename>' under AUTORIZADOS -> (queue row, clave_acceso) for rows whose xml_file lives there."""
+    rows = frappe.db.sql(
+        """
+        SELECT name, xml_file, clave_acceso
+        FROM `tabSRI XML Queue`
+        WHERE xml_file LIKE %s
+        """,
+        (f"%/{paths.AUTH}/%",),
+    )
+    out = {}
+    for name, xml_file, clave in rows:
+        _stage, shard, filename = paths.split_url(xml_file)
+        out[os.path.join(shard, filename)] = (name, (clave or "").strip())
+    return out
+
+
+def _xml_files(folder: str) -> List[str]:
+    """.xml files under `folder`, shard subfolders included, as sorted relative paths."""
+    out = []
+    for dirpath, _dirs, files in os.walk(folder):
+        rel = os.path.relpath(dirpath, folder)
+        out.extend(os.path.normpath(os.path.join(rel, f)) for f in files if f.lower().endswith(".xml"))
+    return sorted(out)
+
+
+def audit_autorizados(folder: Optional[str] = None, workers: int = READ_WORKERS) -> Dict[str, Any]:
+    """Scan every .xml under `folder` (default SRI/AUTORIZADOS, all shards) and return the flagged files."""
+    folder = folder or paths.abs_path(paths.AUTH, "")
+    names = _xml_files(folder) if os.path.isdir(folder) else []
+
+    with ThreadPoolExecutor(max_workers=max(1, int(workers)), thread_name_prefix="sri-clave-audit") as pool:
+        scanned = list(pool.map(_scan_file, (os.path.join(folder, n) for n in names)))
+
+    n = len(names)
+    claves = np.array([s.get("claveAcceso", "") for s in scanned], dtype="<U64") if n else np.zeros(0, "<U64")
+    check = access_key_batch.validate_access_keys(claves)
+    fields = access_key_batch.split_access_keys(claves)
+
+    issues: List[List[str]] = [[] for _ in range(n)]
+    mismatched: List[List[str]] = [[] for _ in range(n)]
+
+    unreadable = np.array([bool(s.get("error")) for s in scanned], dtype=bool)
+    missing = (claves == "") & ~unreadable
+    for i in np.flatnonzero(missing):
+        issues[i].append("sin_clave")
+    for i in np.flatnonzero(~missing & ~unreadable & ~check.well_formed):
+        issues[i].append("malformada")
+    for i in np.flatnonzero(check.well_formed & ~check.check_ok):
+        issues[i].append("digito_verificador")
+
+    for key_field, tag, width in _COMPARED:
+        doc_values = _digits_col([s.get(tag, "") for s in scanned], width)
+        bad = check.well_formed & (doc_values != "") & (fields[key_field] != doc_values)
+        for i in np.flatnonzero(bad):
+            mismatched[i].append(key_field)
+    for i in range(n):
+        if mismatched[i]:
+            issues[i].append("campos")
+
+    numeros = np.array([s.get("numeroAutorizacion", "") for s in scanned], dtype="<U64") if n else claves
+    for i in np.flatnonzero((claves != "") & (numeros != "") & (numeros != claves)):
+        issues[i].append("numero_autorizacion")
+
+    queue = _queue_claves()
+    queue_rows = [queue.get(name, (None, ""))[0] for name in names]
+    for i, name in enumerate(names):
+        q_clave = queue.get(name, (None, ""))[1]
+        if q_clave and claves[i] and q_clave != claves[i]:
+            issues[i].append("cola")
+
+    if n:
+        _uniq, inverse, counts = np.unique(claves, return_inverse=True, return_counts=True)
+        for i in np.flatnonzero((counts[inverse] > 1) & (claves != "")):
+            issues[i].append("duplicada")
+
+    for i in np.flatnonzero(unreadable):
+        issues[i].append("ilegible")
+
+    flagged, totals = [], {}
+    for i in range(n):
+        if not issues[i]:
+            continue
+        for code in issues[i]:
+            totals[code] = totals.get(code, 0) + 1
+        flagged.append({
+            "file": names[i],
+            "queue_row": queue_rows[i],
+            "clave": str(claves[i]),
+            "issues": issues[i],
+            "fields": mismatched[i],
+            "expected_dv": int(check.expected_dv[i]),
+        })
+
+    return {"folder": folder, "scanned": n, "flagged": len(flagged), "by_issue": totals, "files": flagged}
+
+
+@frappe.whitelist()
+def get_clave_audit(limit: int = 500) -> Dict[str, Any]:
+    """Audit SRI/AUTORIZADOS; the file list is capped at `limit` entries."""
+    frappe.only_for(("System Manager",))
+    report = audit_autorizados()
+    report["files"] = report["files"][: max(0, int(limit))]
+    frappe.logger("sri_flow").info(
+        f"[CLAVE AUDIT] scanned={report['scanned']} flagged={report['flagged']} by_issue={report['by_issue']}"
+    )
+    return report
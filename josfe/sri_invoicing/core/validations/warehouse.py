@@ -73,8 +73,12 @@ def validate_warehouse_sri(doc, method=None):
     for idx, row in enumerate(rows, start=1):
         # Normalize estado
         current_estado = (row.estado or "").strip()
-        if not current_estado:
-            row.estado = "Inactivo"
+        row.estado = current_estado or "Inactivo"
+
+        # Normalize EP code to 3 digits (the allocator matches it by equality)
+        code = (row.emission_point_code or "").strip()
+        if code.isdigit():
+            row.emission_point_code = code.zfill(3)
 
         initiated = int(row.initiated or 0)
 
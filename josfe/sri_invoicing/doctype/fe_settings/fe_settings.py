@@ -5,7 +5,11 @@ from frappe.model.document import Document
 
 class FESettings(Document):
     """Singleton DocType; business logic kept in helper(s) below."""
-    pass
+
+    def validate(self):
+        # Pipeline email stage only picks rows authorized after this moment
+        if int(self.auto_pipeline or 0) and (self.has_value_changed("auto_pipeline") or not self.pipeline_enabled_at):
+            self.pipeline_enabled_at = frappe.utils.now_datetime()
 
 def get_settings():
     """Cache-friendly accessor for FE Settings singleton with sane defaults."""
@@ -19,6 +23,23 @@ def get_settings():
         "retry_max_attempts": int(getattr(doc, "retry_max_attempts", 5) or 5),
         "retry_backoff_seconds": int(getattr(doc, "retry_backoff_seconds", 30) or 30),
         "batch_size": int(getattr(doc, "batch_size", 20) or 20),
+        "sri_max_in_flight": int(getattr(doc, "sri_max_in_flight", 8) or 8),
         "allow_test_stubs": int(getattr(doc, "allow_test_stubs", 0) or 0),
         "private_files_only": int(getattr(doc, "private_files_only", 1) or 1),
+        "signing_engine": getattr(doc, "signing_engine", "Nativo") or "Nativo",
+        "sequential_autonomous": int(getattr(doc, "sequential_autonomous", 0) or 0),
+        "sequential_block_size": int(getattr(doc, "sequential_block_size", 0) or 0),
+        "async_xml_build": int(getattr(doc, "async_xml_build", 0) or 0),
+        "async_build_workers": int(getattr(doc, "async_build_workers", 2) or 2),
+        "auto_pipeline": int(getattr(doc, "auto_pipeline", 0) or 0),
+        "pipeline_sign_workers": int(getattr(doc, "pipeline_sign_workers", 1) or 1),
+        "pipeline_email_workers": int(getattr(doc, "pipeline_email_workers", 1) or 1),
+        "pipeline_max_pending_sri": int(getattr(doc, "pipeline_max_pending_sri", 500) or 0),
+        "pipeline_slow_sri_seconds": int(getattr(doc, "pipeline_slow_sri_seconds", 10) or 0),
+        "pipeline_enabled_at": getattr(doc, "pipeline_enabled_at", None),
+        "sri_breaker_failures": int(getattr(doc, "sri_breaker_failures", 5) or 5),
+        "sri_breaker_cooldown_seconds": int(getattr(doc, "sri_breaker_cooldown_seconds", 60) or 60),
+        "sri_latency_target_seconds": int(getattr(doc, "sri_latency_target_seconds", 8) or 0),
+        "storage_layout": getattr(doc, "storage_layout", "Plano") or "Plano",
+        "archive_after_months": int(getattr(doc, "archive_after_months", 0) or 0),
     })
@@ -1,9 +1,22 @@
 # Copyright (c) 2025, JP and contributors
 # For license information, please see license.txt
 
-# import frappe
+import frappe
 from frappe.model.document import Document
 
 
 class SRIEndpoint(Document):
-	pass
+	def on_update(self):
+		# After commit: a worker reloading before then would cache the old row again
+		frappe.db.after_commit.add(_invalidate_soap_clients)
+
+	def on_trash(self):
+		frappe.db.after_commit.add(_invalidate_soap_clients)
+
+
+def _invalidate_soap_clients():
+	"""Cached endpoint config and the pooled zeep clients built from it; dropped in every worker."""
+	from josfe.sri_invoicing.core.transmission import endpoints, soap
+
+	endpoints.invalidate_cache(broadcast=False)
+	soap.invalidate_clients(broadcast=True)
@@ -0,0 +1,10 @@
+# Copyright (c) 2026, JP and contributors
+# For license information, please see license.txt
+
+# import frappe
+from frappe.model.document import Document
+
+
+class SRIFileIndex(Document):
+	# Written by xml.migrate_storage; read by xml.paths.resolve()
+	pass
@@ -0,0 +1,8 @@
+// Copyright (c) 2026, JP and contributors
+// For license information, please see license.txt
+
+// frappe.ui.form.on("SRI Queue Stage Log", {
+// 	refresh(frm) {
+
+// 	},
+// });
@@ -0,0 +1,10 @@
+# Copyright (c) 2026, JP and contributors
+# For license information, please see license.txt
+
+# import frappe
+from frappe.model.document import Document
+
+
+class SRIQueueStageLog(Document):
+	# Append-only: rows are written by core.queue.timings.record()
+	pass
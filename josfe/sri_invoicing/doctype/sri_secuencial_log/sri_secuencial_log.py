@@ -6,4 +6,7 @@ from frappe.model.document import Document
 
 
 class SRISecuencialLog(Document):
+	# Rows written by core.numbering.state are inserted with explicit names
+	# (SRI-LOG-{warehouse}-{emission_point_code}-{doc_type}-{action}-{old_value:09d});
+	# the format autoname only applies to rows created from the Desk.
 	pass
@@ -1,7 +1,6 @@
 # -*- coding: utf-8 -*-
 # apps/josfe/josfe/sri_invoicing/doctype/sri_xml_queue/sri_xml_queue.py
 
-import os
 import frappe
 from enum import Enum
 from typing import Dict, Set, Optional
@@ -74,6 +73,9 @@ class SRIXMLQueue(Document):
         self.last_transition_by = frappe.session.user
         self.last_transition_at = frappe.utils.now_datetime()
 
+    def on_trash(self):
+        frappe.db.delete("SRI Queue Stage Log", {"queue": self.name})
+
     # --- State machine API ---
     def transition_to(self, to_state: str, reason: Optional[str] = None):
         from_state = _coerce_state(self.state)
@@ -100,6 +102,11 @@ class SRIXMLQueue(Document):
         self.state = to_state_e.value
         self.save(ignore_permissions=True)
 
+        # Firmado / Enviado / Autorizado / Devuelto are timed by xml.service
+        if to_state_e in (SRIQueueState.Generado, SRIQueueState.Cancelado, SRIQueueState.Error):
+            from josfe.sri_invoicing.core.queue import timings
+            timings.record(self, to_state_e.value)
+
 # --- Whitelisted APIs ---
 
 @frappe.whitelist()
@@ -140,11 +147,10 @@ def get_xml_preview(name: str):
     if not doc.xml_file:
         return ""
     try:
-        base = frappe.get_site_path("private", "files")
-        rel = doc.xml_file.replace("/private/files/", "", 1)
-        path = os.path.join(base, rel)
-        with open(path, "r", encoding="utf-8") as f:
-            return f.read()
+        data = xml_paths.read_bytes(doc.xml_file)  # archived periods included
+        if data is None:
+            raise FileNotFoundError(doc.xml_file)
+        return data.decode("utf-8")
     except Exception:
         frappe.log_error(frappe.get_traceback(), "get_xml_preview error")
         return ""
@@ -192,11 +198,17 @@ def download_pdf(name: str) -> dict:
     This avoids hitting /private/files from the browser (auth issues).
     """
     import os, base64
-    from josfe.sri_invoicing.core.pdf_emailing.pdf_builder import build_invoice_pdf
+    from josfe.sri_invoicing.core.pdf_emailing.pdf_builder import archived_ride, build_invoice_pdf
 
     qdoc = frappe.get_doc("SRI XML Queue", name)
 
-    # Build (or rebuild) to guarantee the file exists; returns /private/files/... URL
+    # Closed periods: the archived RIDE is the copy of record, no rebuild
+    archived = archived_ride(qdoc)
+    if archived is not None:
+        filename, content = archived
+        return {"data": base64.b64encode(content).decode("utf-8"), "filename": filename}
+
+    # Rendered only when missing or its AUTORIZADO XML changed; returns /private/files/... URL
     pdf_url = build_invoice_pdf(qdoc)
 
     # Convert URL -> absolute path
@@ -8,8 +8,13 @@
 */
 
 frappe.listview_settings["SRI XML Queue"] = {
+  add_fields: ["waiting_sri"],
+
   get_indicator(doc) {
     const s = (doc.state || "").trim();
+    if (s === "Firmado" && cint(doc.waiting_sri)) {
+      return [__("Esperando SRI"), "yellow", "waiting_sri,=,1"];
+    }
     const colors = {
       "Generado": "orange",
       "Firmado": "blue",
@@ -0,0 +1,248 @@
+# -*- coding: utf-8 -*-
+# apps/josfe/josfe/sri_invoicing/tests/benchmarks/fixtures.py
+"""
+Synthetic, seeded fixtures for the XML hot-path benchmarks.
+
+- sales_invoice(): an in-memory Sales Invoice (InvoiceRecord + FacturaSnapshot,
+  no DB rows) with N lines cycling through IVA 15% / IVA 0% / IVA 5% /
+  ICE 10% + IVA 15%, and item_wise_tax_detail filled like ERPNext does.
+- nota_credito(): a "By Products" Nota Credito FE with N return lines plus a
+  minimal source Sales Invoice, written with db_insert (no validation) in the
+  caller's transaction. The benchmark rolls it back.
+- signing_material(): a throwaway RSA key and self-signed certificate (PEM).
+- autorizado_wrapper(): the <autorizacion> wrapper soap.py stores in AUTORIZADOS.
+
+The same seed gives the same documents, so timings from different commits compare
+like for like.
+"""
+from __future__ import annotations
+
+import datetime
+import json
+import os
+import random
+from decimal import ROUND_HALF_UP, Decimal
+from typing import Dict, List, Tuple
+
+import frappe
+
+from josfe.sri_invoicing.xml.context import FacturaSnapshot, InvoiceRecord
+
+SIZES = (1, 50, 500)
+DEFAULT_SEED = 20260101
+POSTING_DATE = datetime.date(2026, 1, 15)
+
+# (label, [(account_head, rate %)]) — lines take these in turn
+TAX_PROFILES: Tuple[Tuple[str, Tuple[Tuple[str, int], ...]], ...] = (
+    ("IVA 15%", (("IVA 15% - BENCH", 15),)),
+    ("IVA 0%", (("IVA 0% - BENCH", 0),)),
+    ("IVA 5%", (("IVA 5% - BENCH", 5),)),
+    ("ICE + IVA 15%", (("ICE 10% - BENCH", 10), ("IVA 15% - BENCH", 15))),
+)
+
+COMPANY = frappe._dict(
+    name="Bench Company",
+    company_name="Bench Company",
+    custom_jos_razon_social="EMPRESA DE PRUEBAS RENDIMIENTO S.A.",
+    custom_jos_nombre_comercial="BENCH",
+    tax_id="1790012345001",
+    default_currency="USD",
+)
+
+
+def _money(value: Decimal) -> Decimal:
+    return value.quantize(Decimal("0.01"), rounding=ROUND_HALF_UP)
+
+
+def _lines(n: int, seed: int) -> List[dict]:
+    rng = random.Random(f"{seed}:{n}")
+    out = []
+    for i in range(int(n)):
+        qty = Decimal(rng.randint(1, 12))
+        rate = Decimal(rng.randint(50, 25000)) / 100
+        out.append({
+            "idx": i + 1,
+            "item_code": f"BENCH-{i + 1:04d}",
+            "item_name": f"Producto de prueba {i + 1}",
+            "qty": qty,
+            "rate": rate,
+            "net_amount": _money(qty * rate),
+            "profile": TAX_PROFILES[i % len(TAX_PROFILES)],
+        })
+    return out
+
+
+# ------------------------------
+# Sales Invoice (in memory)
+# ------------------------------
+def sales_invoice(n: int, warehouse: str, emission_point_code: str,
+                  seed: int = DEFAULT_SEED) -> FacturaSnapshot:
+    """FacturaSnapshot for build_factura_xml(snapshot=...); only numbering (stubbed by the runner) would touch the DB."""
+    name = f"BENCH-SI-{n:04d}"
+    lines = _lines(n, seed)
+
+    items, per_account = [], {}
+    for ln in lines:
+        items.append(frappe._dict(
+            name=f"{name}-{ln['idx']:04d}",
+            idx=ln["idx"],
+            item_code=ln["item_code"],
+            item_name=ln["item_name"],
+            description=ln["item_name"],
+            stock_uom="Unidad",
+            qty=float(ln["qty"]),
+            rate=float(ln["rate"]),
+            amount=float(ln["net_amount"]),
+            net_amount=float(ln["net_amount"]),
+        ))
+        for account, pct in ln["profile"][1]:
+            amount = _money(ln["net_amount"] * pct / 100)
+            per_account.setdefault(account, (pct, {}))[1][ln["item_code"]] = [float(pct), float(amount)]
+
+    taxes, total_taxes = [], Decimal("0")
+    for idx, (account, (pct, detail)) in enumerate(sorted(per_account.items()), start=1):
+        tax_amount = sum((Decimal(str(v[1])) for v in detail.values()), Decimal("0"))
+        total_taxes += tax_amount
+        taxes.append(frappe._dict(
+            name=f"{name}-tax-{idx}",
+            idx=idx,
+            charge_type="On Net Total",
+            account_head=account,
+            description=account.split(" - ")[0],
+            rate=float(pct),
+            tax_amount=float(tax_amount),
+            item_wise_tax_detail=json.dumps(detail),
+        ))
+
+    net_total = sum((ln["net_amount"] for ln in lines), Decimal("0"))
+    si = InvoiceRecord(
+        name=name,
+        company=COMPANY.name,
+        customer="Consumidor Bench",
+        customer_name="CLIENTE DE PRUEBAS RENDIMIENTO",
+        tax_id="1712345678",
+        posting_date=POSTING_DATE,
+        custom_jos_level3_warehouse=warehouse,
+        custom_jos_sri_emission_point_code=emission_point_code,
+        custom_jos_forma_pago="20 - Otros con utilización del sistema financiero",
+        customer_address=None,
+        contact_person=None,
+        total=float(net_total),
+        net_total=float(net_total),
+        total_taxes_and_charges=float(total_taxes),
+        grand_total=float(net_total + total_taxes),
+        items=items,
+        taxes=taxes,
+    )
+    return FacturaSnapshot(
+        si=si,
+        company=COMPANY,
+        ambiente="1",
+        dir_matriz="Av. Amazonas N00-00 y Naciones Unidas, Quito",
+        dir_establecimiento="Av. 6 de Diciembre N00-00, Quito",
+        obligado_contabilidad="SI",
+        direccion_comprador="Calle de pruebas 123",
+        info_adicional=[
+            {"nombre": "Dirección", "valor": "Calle de pruebas 123"},
+            {"nombre": "Email", "valor": "bench@example.com"},
+        ],
+    )
+
+
+# ------------------------------
+# Nota de Crédito (DB rows, caller rolls back)
+# ------------------------------
+def nota_credito(n: int, company: str, warehouse: str, emission_point_code: str,
+                 seed: int = DEFAULT_SEED) -> str:
+    """Insert a By Products NC (named EC-PE-#########, so no number is allocated) and its source SI."""
+    ec = (frappe.db.get_value("Warehouse", warehouse, "custom_establishment_code") or "001").strip().zfill(3)
+    src = frappe.get_doc({
+        "doctype": "Sales Invoice",
+        "name": f"BENCH-SI-NC-{n:04d}",
+        "company": company,
+        "posting_date": POSTING_DATE,
+        "custom_jos_level3_warehouse": warehouse,
+        "docstatus": 1,
+    })
+    src.db_insert()
+
+    nc = frappe.get_doc({
+        "doctype": "Nota Credito FE",
+        "name": f"{ec}-{emission_point_code.zfill(3)}-{900000000 + n:09d}",
+        "customer": "Consumidor Bench",
+        "company": company,
+        "posting_date": POSTING_DATE,
+        "custom_jos_level3_warehouse": warehouse,
+        "custom_jos_sri_emission_point_code": emission_point_code,
+        "credit_note_type": "By Products",
+        "source_invoice": src.name,
+        "return_items": [
+            {
+                "item_code": ln["item_code"],
+                "item_name": ln["item_name"],
+                "uom": "Unidad",
+                "orig_qty": float(ln["qty"]),
+                "return_qty": float(ln["qty"]),
+                "rate": float(ln["rate"]),
+                "amount": float(ln["net_amount"]),
+            }
+            for ln in _lines(n, seed)
+        ],
+    })
+    nc.db_insert()
+    for child in nc.get_all_children():
+        child.db_insert()
+    return nc.name
+
+
+# ------------------------------
+# Signing material / AUTORIZADO wrapper
+# ------------------------------
+def signing_material(folder: str) -> Dict[str, object]:
+    """RSA 2048 key + self-signed cert written as PEM under `folder`."""
+    from cryptography import x509
+    from cryptography.hazmat.primitives import hashes, serialization
+    from cryptography.hazmat.primitives.asymmetric import rsa
+    from cryptography.x509.oid import NameOID
+
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    subject = x509.Name([
+        x509.NameAttribute(NameOID.COUNTRY_NAME, "EC"),
+        x509.NameAttribute(NameOID.ORGANIZATION_NAME, COMPANY.custom_jos_razon_social),
+        x509.NameAttribute(NameOID.COMMON_NAME, "BENCH FIRMA ELECTRONICA"),
+    ])
+    now = datetime.datetime.now(datetime.timezone.utc)
+    cert = (
+        x509.CertificateBuilder()
+        .subject_name(subject)
+        .issuer_name(subject)
+        .public_key(key.public_key())
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(now - datetime.timedelta(days=1))
+        .not_valid_after(now + datetime.timedelta(days=30))
+        .sign(key, hashes.SHA256())
+    )
+
+    key_path = os.path.join(folder, "bench_private.pem")
+    cert_path = os.path.join(folder, "bench_cert.pem")
+    with open(key_path, "wb") as f:
+        f.write(key.private_bytes(
+            serialization.Encoding.PEM, serialization.PrivateFormat.TraditionalOpenSSL,
+            serialization.NoEncryption(),
+        ))
+    with open(cert_path, "wb") as f:
+        f.write(cert.public_bytes(serialization.Encoding.PEM))
+    return {"private_key": key, "key_path": key_path, "cert_path": cert_path}
+
+
+def autorizado_wrapper(signed_xml: str, clave: str) -> str:
+    """Same wrapper soap.autorizacion_call stores for an AUTORIZADO answer."""
+    from josfe.sri_invoicing.core.transmission.soap import _build_autorizacion_wrapper
+
+    return _build_autorizacion_wrapper({
+        "estado": "AUTORIZADO",
+        "numeroAutorizacion": clave,
+        "fechaAutorizacion": datetime.datetime(2026, 1, 15, 10, 30, tzinfo=datetime.timezone(datetime.timedelta(hours=-5))),
+        "ambiente": "PRUEBAS",
+        "comprobante": signed_xml,
+    })
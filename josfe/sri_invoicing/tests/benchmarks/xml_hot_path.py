@@ -0,0 +1,337 @@
+# -*- coding: utf-8 -*-
+# apps/josfe/josfe/sri_invoicing/tests/benchmarks/xml_hot_path.py
+"""
+Benchmarks of the XML build / sign / store hot path.
+
+Cases, for facturas of 1, 50 and 500 lines (fixtures.SIZES):
+
+    build_factura_xml · build_nota_credito_xml · format_xml_bytes ·
+    inject_signature_template · sign_native (inject_signature_into + sign_tree) ·
+    sign_xmlsec1 (when the binary is installed) · _parse_autorizado_xml
+
+plus generate_access_key. Each case reports ops/sec and p50/p95 (ms), the
+DB queries of one call, and the peak / retained Python memory of one call
+(tracemalloc). Results are written as JSON with the git commit so runs can
+be compared:
+
+    bench --site <site> execute josfe.sri_invoicing.tests.benchmarks.xml_hot_path.run
+    bench --site <site> execute josfe.sri_invoicing.tests.benchmarks.xml_hot_path.compare \
+        --kwargs "{'baseline': 'logs/sri_benchmarks/xml-....json', 'current': 'logs/sri_benchmarks/xml-....json'}"
+
+Numbering is stubbed for the run (get_ce_pe_seq gets numbers from a local
+counter), so no real sequential is allocated or burned whatever the FE
+Settings allocation mode; build_factura_xml's query count therefore leaves
+the allocator out (see numbering.loadtest for that path). The NC fixtures
+are inserted in the benchmark transaction, which is rolled back at the end.
+"""
+from __future__ import annotations
+
+import gc
+import itertools
+import json
+import os
+import platform
+import shutil
+import subprocess
+import tempfile
+import time
+import tracemalloc
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, List, Optional
+
+from lxml import etree
+
+import frappe
+from frappe.utils import get_bench_path, now_datetime
+
+from josfe.sri_invoicing.core.utils.stats import percentile
+from josfe.sri_invoicing.tests.benchmarks import fixtures
+
+RESULTS_DIR = os.path.join("logs", "sri_benchmarks")
+SCHEMA_VERSION = 1
+
+
+# ------------------------------
+# Measurement
+# ------------------------------
+def _count_queries(fn: Callable[[], Any]) -> int:
+    """Statements sent through frappe.db.sql during one call (get_all / get_value / qb included)."""
+    db = frappe.db
+    original = db.sql
+    count = [0]
+
+    def counting(*args, **kwargs):
+        count[0] += 1
+        return original(*args, **kwargs)
+
+    db.sql = counting
+    try:
+        fn()
+    finally:
+        db.sql = original
+    return count[0]
+
+
+def _memory(fn: Callable[[], Any]) -> Dict[str, float]:
+    """Peak traced memory of one call and what it left allocated (tracemalloc)."""
+    gc.collect()
+    tracemalloc.start()
+    try:
+        before = tracemalloc.take_snapshot()
+        tracemalloc.reset_peak()
+        fn()
+        _current, peak = tracemalloc.get_traced_memory()
+        after = tracemalloc.take_snapshot()
+    finally:
+        tracemalloc.stop()
+    diff = after.compare_to(before, "filename")
+    return {
+        "peak_kib": round(peak / 1024, 1),
+        "retained_kib": round(sum(s.size_diff for s in diff) / 1024, 1),
+        "retained_blocks": sum(s.count_diff for s in diff),
+    }
+
+
+def measure(fn: Callable[[], Any], min_time_s: float = 1.0, min_iterations: int = 5,
+            max_iterations: int = 100_000) -> Dict[str, Any]:
+    """Warm up once, then time fn until both min_time_s and min_iterations are reached."""
+    fn()
+    queries = _count_queries(fn)
+    memory = _memory(fn)
+
+    gc.collect()
+    times: List[float] = []
+    deadline = time.perf_counter() + float(min_time_s)
+    while len(times) < int(min_iterations) or time.perf_counter() < deadline:
+        t0 = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - t0)
+        if len(times) >= int(max_iterations):
+            break
+
+    total = sum(times)
+    times.sort()
+    return {
+        "iterations": len(times),
+        "ops_per_s": round(len(times) / total, 2) if total else 0,
+        "mean_ms": round(total / len(times) * 1000, 4),
+        "p50_ms": round(percentile(times, 50) * 1000, 4),
+        "p95_ms": round(percentile(times, 95) * 1000, 4),
+        "queries": queries,
+        **memory,
+    }
+
+
+# ------------------------------
+# Environment
+# ------------------------------
+def _git_commit() -> Optional[str]:
+    try:
+        app_dir = frappe.get_app_path("josfe", "..")
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=app_dir, stderr=subprocess.DEVNULL, timeout=5,
+        ).decode().strip() or None
+    except Exception:
+        return None
+
+
+def _default_emission_point() -> tuple:
+    """First (warehouse, emission point) with an establishment code and an Activo row (numbering is stubbed)."""
+    row = frappe.db.sql(
+        """
+        SELECT p.parent, p.emission_point_code
+        FROM `tabSRI Puntos Emision` p
+        JOIN `tabWarehouse` w ON w.name = p.parent
+        WHERE p.parenttype = 'Warehouse' AND p.estado = 'Activo'
+          AND IFNULL(w.custom_establishment_code, '') <> ''
+        ORDER BY w.name, p.emission_point_code
+        LIMIT 1
+        """
+    )
+    if not row:
+        frappe.throw("No hay un Punto de Emisión activo en ningún establecimiento para el benchmark.")
+    return row[0][0], row[0][1]
+
+
+@contextmanager
+def _stub_numbering():
+    """Serve get_ce_pe_seq from a counter instead of numbering.state.next_sequential."""
+    from josfe.sri_invoicing.xml import utils as xml_utils
+
+    counter = itertools.count(1)
+    original = xml_utils.next_sequential
+    xml_utils.next_sequential = lambda *args, **kwargs: next(counter)
+    try:
+        yield
+    finally:
+        xml_utils.next_sequential = original
+
+
+# ------------------------------
+# Cases
+# ------------------------------
+def _cases(sizes, warehouse: str, emission_point_code: str, company: str, seed: int,
+           tmp: str) -> List[tuple]:
+    """[(case, size, fn)] with every fixture prepared up front."""
+    from josfe.sri_invoicing.core.pdf_emailing.pdf_builder import _parse_autorizado_xml
+    from josfe.sri_invoicing.core.signing import signer
+    from josfe.sri_invoicing.core.validations.access_key import generate_access_key
+    from josfe.sri_invoicing.xml.builders import build_factura_xml, build_nota_credito_xml
+    from josfe.sri_invoicing.xml.utils import format_xml_bytes
+    from josfe.sri_invoicing.xml.xades_template import (
+        cert_bits_from_pem, inject_signature_into, inject_signature_template,
+    )
+
+    material = fixtures.signing_material(tmp)
+    with open(material["cert_path"], "rb") as f:
+        cert_bits = cert_bits_from_pem(f.read())
+    xmlsec1 = shutil.which("xmlsec1")
+
+    cases: List[tuple] = [(
+        "generate_access_key", None,
+        lambda: generate_access_key(
+            fecha_emision_ddmmyyyy="15012026", cod_doc="01", ruc=fixtures.COMPANY.tax_id,
+            ambiente="1", estab="001", pto_emi="001", secuencial_9d="000000123",
+            codigo_numerico_8d="12345678", tipo_emision="1",
+        ),
+    )]
+
+    for n in sizes:
+        snapshot = fixtures.sales_invoice(n, warehouse, emission_point_code, seed=seed)
+        xml_text, meta = build_factura_xml(snapshot.si.name, snapshot=snapshot)
+        xml_bytes = xml_text.encode("utf-8")
+        nc_name = fixtures.nota_credito(n, company, warehouse, emission_point_code, seed=seed)
+
+        template_text = inject_signature_template(xml_text, material["cert_path"])
+        template_root = inject_signature_into(etree.fromstring(xml_bytes), cert_bits)
+        signed = signer.sign_tree(template_root, material["private_key"])
+
+        auth_path = os.path.join(tmp, f"autorizado-{n}.xml")
+        with open(auth_path, "w", encoding="utf-8") as f:
+            f.write(fixtures.autorizado_wrapper(signed.decode("utf-8"), meta["clave_acceso"]))
+
+        cases += [
+            ("build_factura_xml", n, lambda s=snapshot: build_factura_xml(s.si.name, snapshot=s)),
+            ("build_nota_credito_xml", n, lambda name=nc_name: build_nota_credito_xml(name)),
+            ("format_xml_bytes", n, lambda b=xml_bytes: format_xml_bytes(b)),
+            ("inject_signature_template", n,
+             lambda t=xml_text: inject_signature_template(t, material["cert_path"])),
+            ("sign_native", n,
+             lambda b=xml_bytes: signer.sign_tree(
+                 inject_signature_into(etree.fromstring(b), cert_bits), material["private_key"])),
+            ("_parse_autorizado_xml", n, lambda p=auth_path: _parse_autorizado_xml(p)),
+        ]
+        if xmlsec1:
+            from josfe.sri_invoicing.xml.signer import sign_with_xmlsec
+
+            cases.append(("sign_xmlsec1", n, lambda b=template_text.encode("utf-8"): sign_with_xmlsec(
+                b, material["key_path"], material["cert_path"])))
+    return cases
+
+
+def run(
+    sizes: Optional[str] = None,
+    warehouse: Optional[str] = None,
+    emission_point_code: Optional[str] = None,
+    seed: int = fixtures.DEFAULT_SEED,
+    min_time_s: float = 1.0,
+    min_iterations: int = 5,
+    only: Optional[str] = None,
+    output: Optional[str] = None,
+) -> Dict[str, Any]:
+    """
+    Run every case and write the JSON results.
+    sizes: comma-separated line counts (default 1,50,500); only: comma-separated case names.
+    """
+    frappe.only_for(("System Manager",))
+
+    sizes = [int(x) for x in str(sizes).split(",")] if sizes else list(fixtures.SIZES)
+    wanted = {x.strip() for x in (only or "").split(",") if x.strip()}
+    if not (warehouse and emission_point_code):
+        warehouse, emission_point_code = _default_emission_point()
+    company = frappe.db.get_value("Warehouse", warehouse, "company")
+
+    results: List[Dict[str, Any]] = []
+    tmp = tempfile.mkdtemp(prefix="sri_bench_")
+    try:
+        with _stub_numbering():
+            for case, size, fn in _cases(sizes, warehouse, emission_point_code, company, int(seed), tmp):
+                if wanted and case not in wanted:
+                    continue
+                row = {"case": case, "lines": size, **measure(fn, float(min_time_s), int(min_iterations))}
+                results.append(row)
+                frappe.logger("sri_flow").info(f"[XML BENCH] {row}")
+    finally:
+        frappe.db.rollback()  # NC fixtures
+        shutil.rmtree(tmp, ignore_errors=True)
+
+    report = {
+        "schema": SCHEMA_VERSION,
+        "suite": "xml_hot_path",
+        "commit": _git_commit(),
+        "created": str(now_datetime()),
+        "site": frappe.local.site,
+        "python": platform.python_version(),
+        "lxml": ".".join(map(str, etree.LXML_VERSION)),
+        "machine": platform.machine(),
+        "seed": int(seed),
+        "warehouse": warehouse,
+        "emission_point_code": emission_point_code,
+        "numbering": "stub",
+        "results": results,
+    }
+
+    if not output:
+        stamp = now_datetime().strftime("%Y%m%d-%H%M%S")
+        output = os.path.join(get_bench_path(), RESULTS_DIR, f"xml-{stamp}-{report['commit'] or 'nogit'}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=1)
+    report["output"] = output
+    return report
+
+
+# ------------------------------
+# Comparison
+# ------------------------------
+def _load(path: str) -> Dict[str, Any]:
+    if not os.path.isabs(path):
+        path = os.path.join(get_bench_path(), path)
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def compare(baseline: str, current: str, threshold: float = 0.10) -> Dict[str, Any]:
+    """
+    Per-case change between two result files. A case regresses when ops/sec drops
+    by more than `threshold` or it makes more queries than before.
+    """
+    base, cur = _load(baseline), _load(current)
+    base_rows = {(r["case"], r["lines"]): r for r in base.get("results", [])}
+
+    rows, regressions = [], []
+    for r in cur.get("results", []):
+        b = base_rows.get((r["case"], r["lines"]))
+        if not b:
+            continue
+        speed = (r["ops_per_s"] / b["ops_per_s"] - 1) if b["ops_per_s"] else 0.0
+        row = {
+            "case": r["case"],
+            "lines": r["lines"],
+            "ops_per_s": [b["ops_per_s"], r["ops_per_s"]],
+            "speed_change": round(speed, 4),
+            "p95_ms": [b["p95_ms"], r["p95_ms"]],
+            "queries": [b["queries"], r["queries"]],
+            "peak_kib": [b["peak_kib"], r["peak_kib"]],
+        }
+        rows.append(row)
+        if speed < -float(threshold) or r["queries"] > b["queries"]:
+            regressions.append(row)
+
+    return {
+        "baseline": base.get("commit"),
+        "current": cur.get("commit"),
+        "threshold": float(threshold),
+        "cases": rows,
+        "regressions": regressions,
+    }
@@ -0,0 +1,59 @@
+import os
+from unittest.mock import patch
+
+import frappe
+from frappe.tests.utils import FrappeTestCase
+
+from josfe.sri_invoicing.core.pdf_emailing import handlers
+from josfe.sri_invoicing.xml import atomic, paths as xml_paths
+
+
+class TestPipelineEmail(FrappeTestCase):
+    def test_fc_row_is_rendered_and_emailed(self):
+        # Queue rows created by queue.api / async_build use reference_doctype "FC"
+        si = frappe.get_all(
+            "Sales Invoice",
+            filters={"docstatus": 1, "is_return": 0},
+            fields=["name", "company", "customer", "posting_date"],
+            limit=1,
+        )
+        if not si:
+            self.skipTest("No submitted Sales Invoice on this site")
+        si = si[0]
+
+        q = frappe.get_doc({
+            "doctype": "SRI XML Queue",
+            "name": f"XML-TEST-{frappe.generate_hash(length=8)}",
+            "reference_doctype": "FC",
+            "reference_name": si.name,
+            "company": si.company,
+            "customer": si.customer,
+            "posting_date": si.posting_date,
+            "state": "Autorizado",
+        })
+        q.db_insert()
+
+        pdf_abs = xml_paths.abs_path(xml_paths.ride_rel_dir(si.posting_date), f"{si.name}.pdf")
+        original = None
+        if os.path.exists(pdf_abs):
+            with open(pdf_abs, "rb") as f:
+                original = f.read()
+        try:
+            with patch("josfe.sri_invoicing.core.pdf_emailing.pdf_builder.get_pdf", return_value=b"%PDF-1.4\n"), \
+                 patch("josfe.sri_invoicing.core.pdf_emailing.emailer._resolve_customer_primary_email",
+                       return_value="cliente@example.com"), \
+                 patch("frappe.sendmail") as sendmail:
+                handlers._process_email(q.name)
+
+            self.assertEqual(sendmail.call_count, 1)
+            kwargs = sendmail.call_args.kwargs
+            self.assertEqual(kwargs["recipients"], ["cliente@example.com"])
+            self.assertIn(f"{si.name}.pdf", [a["fname"] for a in kwargs["attachments"]])
+            self.assertEqual(frappe.db.get_value("SRI XML Queue", q.name, "pdf_emailed"), 1)
+        finally:
+            frappe.db.rollback()
+            # Put back the invoice's real RIDE, if it had one
+            if original is not None:
+                atomic.write_bytes(pdf_abs, original)
+            elif os.path.exists(pdf_abs):
+                os.remove(pdf_abs)
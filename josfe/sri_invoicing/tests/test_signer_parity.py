@@ -0,0 +1,66 @@
+import base64
+import shutil
+import tempfile
+
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.asymmetric import padding
+from frappe.tests.utils import FrappeTestCase
+from lxml import etree
+
+from josfe.sri_invoicing.core.signing import signer
+from josfe.sri_invoicing.tests.benchmarks import fixtures
+from josfe.sri_invoicing.xml.xades_template import inject_signature_template
+
+FACTURA = """<factura id="comprobante" version="1.1.0">
+<infoTributaria>
+<ambiente>1</ambiente>
+<tipoEmision>1</tipoEmision>
+<razonSocial>Compañía Añil S.A.</razonSocial>
+<ruc>1790000000001</ruc>
+<claveAcceso>1501202601179000000000110010010000001231234567811</claveAcceso>
+<codDoc>01</codDoc>
+<estab>001</estab>
+<ptoEmi>001</ptoEmi>
+<secuencial>000000123</secuencial>
+<dirMatriz>Av. Amazonas &amp; Colón</dirMatriz>
+</infoTributaria>
+<infoFactura>
+<fechaEmision>15/01/2026</fechaEmision>
+<importeTotal>11.50</importeTotal>
+</infoFactura>
+</factura>"""
+
+
+class TestSignerParity(FrappeTestCase):
+    """Native signer vs `xmlsec1 --sign` on the same template, with a throwaway key."""
+
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.material = fixtures.signing_material(self._tmp.name)
+        self.template = inject_signature_template(FACTURA, self.material["cert_path"]).encode("utf-8")
+
+    def tearDown(self):
+        self._tmp.cleanup()
+
+    def test_native_signature_verifies(self):
+        signed = signer.sign_xml(self.template, self.material["private_key"])
+
+        root = etree.fromstring(signed)
+        signed_info = root.find(".//ds:Signature/ds:SignedInfo", signer.NS)
+        value = root.find(".//ds:Signature/ds:SignatureValue", signer.NS).text
+        # Raises InvalidSignature on mismatch
+        self.material["private_key"].public_key().verify(
+            base64.b64decode(value),
+            etree.tostring(signed_info, method="c14n", exclusive=False, with_comments=False),
+            padding.PKCS1v15(),
+            hashes.SHA1(),
+        )
+
+    def test_native_matches_xmlsec1(self):
+        if not shutil.which("xmlsec1"):
+            self.skipTest("xmlsec1 not installed")
+        from josfe.sri_invoicing.xml.signer import sign_with_xmlsec
+
+        native = signer.sign_xml(self.template, self.material["private_key"])
+        xmlsec = sign_with_xmlsec(self.template, self.material["key_path"], self.material["cert_path"])
+        self.assertEqual(native, xmlsec)
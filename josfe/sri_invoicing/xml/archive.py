@@ -0,0 +1,272 @@
+# -*- coding: utf-8 -*-
+# apps/josfe/josfe/sri_invoicing/xml/archive.py
+"""
+Long-term archive of closed periods (SRI retention: 7 years).
+
+archive_period(year, month) packs, per establishment, the AUTORIZADOS XML of the
+month's Autorizado queue rows and their RIDE PDFs into
+
+    SRI/ARCHIVO/<YYYY>/<MM>/<EEE>.zip      members AUTORIZADOS/<file>.xml, RIDE/<file>.pdf
+
+Deflate level 9; the zip central directory lets any single member be read
+without unpacking the rest, which is how get_xml_preview, download_pdf and the
+emailer read archived documents (paths.read_bytes). Each original URL gets an
+SRI File Index row pointing at '<zip url>#<member>'; queue rows keep their
+xml_file unchanged.
+
+Order per archive: write <EEE>.zip.tmp (existing members carried over), read
+every new member back and compare it with its source, rename over <EEE>.zip,
+commit the index rows, and only then delete the originals. An interrupted run
+leaves the originals in place; running it again repacks them.
+
+    bench --site <site> execute josfe.sri_invoicing.xml.archive.archive_period --kwargs "{'year': 2025, 'month': 1}"
+    bench --site <site> execute josfe.sri_invoicing.xml.archive.archive_period --kwargs "{'year': 2025, 'month': 1, 'dry_run': 0}"
+
+archive_closed_periods() (monthly scheduler) archives every month older than
+FE Settings.archive_after_months (0 = off). get_archive_report() gives the
+space saved.
+"""
+from __future__ import annotations
+
+import calendar
+import datetime
+import os
+import re
+import zipfile
+from typing import Any, Dict, List, Optional, Tuple
+
+import frappe
+from frappe.utils import add_months, getdate, now_datetime, nowdate
+
+from josfe.sri_invoicing.xml import comprobante, paths
+
+QUEUE_DTYPE = "SRI XML Queue"
+COMPRESS_LEVEL = 9
+ARCHIVE_METHOD = "josfe.sri_invoicing.xml.archive.archive_closed_periods_job"
+
+_ESTAB_IN_NAME = re.compile(r"^(\d{3})-\d{3}-\d{9}")
+
+
+# ------------------------------
+# Selection
+# ------------------------------
+def _period_bounds(year: int, month: int) -> Tuple[datetime.date, datetime.date]:
+    return datetime.date(year, month, 1), datetime.date(year, month, calendar.monthrange(year, month)[1])
+
+
+def _establishment(clave: str, file_url: str) -> str:
+    clave = (clave or "").strip()
+    if len(clave) == 49 and clave.isdigit():
+        return clave[24:27]
+    m = _ESTAB_IN_NAME.match(os.path.basename(file_url or ""))
+    return m.group(1) if m else "000"
+
+
+def _period_entries(year: int, month: int) -> Dict[str, List[dict]]:
+    """establishment -> [{member, url, src}] of files of the month still on disk."""
+    first, last = _period_bounds(year, month)
+    rows = frappe.db.sql(
+        f"""
+        SELECT name, xml_file, clave_acceso, posting_date,
+               COALESCE(NULLIF(sales_invoice, ''),
+                        IF(reference_doctype IN ('FC', 'Sales Invoice'), reference_name, NULL)) AS invoice
+        FROM `tab{QUEUE_DTYPE}`
+        WHERE state = 'Autorizado' AND posting_date BETWEEN %s AND %s
+          AND IFNULL(xml_file, '') <> ''
+        """,
+        (first, last),
+        as_dict=True,
+    )
+
+    out: Dict[str, List[dict]] = {}
+    for r in rows:
+        estab = _establishment(r.clave_acceso, r.xml_file)
+        candidates = [(f"{paths.AUTH}/{os.path.basename(r.xml_file)}", r.xml_file)]
+        if r.invoice:
+            ride_url = paths.to_file_url(paths.ride_rel_dir(r.posting_date), f"{r.invoice}.pdf")
+            candidates.append((f"{paths.RIDE}/{r.invoice}.pdf", ride_url))
+        for member, url in candidates:
+            src = os.path.join(frappe.get_site_path("private", "files"), paths.strip_private_prefix(url))
+            if os.path.isfile(src):
+                out.setdefault(estab, []).append({"member": member, "url": url, "src": src, "queue": r.name})
+    return out
+
+
+def archive_url(year: int, month: int, estab: str) -> str:
+    return paths.to_file_url(f"{paths.ARCHIVE}/{year:04d}/{month:02d}", f"{estab}.zip")
+
+
+# ------------------------------
+# Packing
+# ------------------------------
+def _pack(zip_abs: str, entries: List[dict]) -> None:
+    """Write zip_abs with its current members plus `entries`, verified, via a temp file."""
+    tmp = zip_abs + ".tmp"
+    os.makedirs(os.path.dirname(zip_abs), exist_ok=True)
+    new_members = {e["member"] for e in entries}
+
+    with zipfile.ZipFile(tmp, "w", zipfile.ZIP_DEFLATED, compresslevel=COMPRESS_LEVEL) as out:
+        if os.path.exists(zip_abs):
+            with zipfile.ZipFile(zip_abs) as old:
+                for info in old.infolist():
+                    if info.filename not in new_members:
+                        out.writestr(info, old.read(info.filename))
+        for e in entries:
+            out.write(e["src"], e["member"])
+
+    # Read back (CRC-checked) and compare with the sources before anything is removed
+    with zipfile.ZipFile(tmp) as check:
+        for e in entries:
+            with open(e["src"], "rb") as f:
+                if check.read(e["member"]) != f.read():
+                    os.remove(tmp)
+                    raise frappe.ValidationError(f"Verificación del archivo fallida: {e['member']}")
+    os.replace(tmp, zip_abs)
+
+
+def _index(url: str, entries: List[dict]) -> None:
+    now = now_datetime()
+    user = frappe.session.user
+    for e in entries:
+        frappe.db.sql(
+            f"""
+            INSERT INTO `tab{paths.INDEX_DTYPE}`
+                (name, creation, modified, owner, modified_by, docstatus, idx,
+                 legacy_url, file_url, queue, moved_at)
+            VALUES (%s, %s, %s, %s, %s, 0, 0, %s, %s, %s, %s)
+            ON DUPLICATE KEY UPDATE file_url=VALUES(file_url), queue=VALUES(queue),
+                modified=VALUES(modified), moved_at=VALUES(moved_at)
+            """,
+            (frappe.generate_hash(length=10), now, now, user, user,
+             e["url"], f"{url}{paths.MEMBER_SEP}{e['member']}", e["queue"], now),
+        )
+
+
+def archive_period(year: int, month: int, establishment: Optional[str] = None,
+                   dry_run: int = 1) -> Dict[str, Any]:
+    """Pack one month (optionally one establishment); dry_run=1 (default) only reports."""
+    frappe.only_for(("System Manager",))
+    year, month = int(year), int(month)
+    if _period_bounds(year, month)[1] >= getdate(nowdate()):
+        frappe.throw(f"El periodo {month:02d}-{year} aún no está cerrado.")
+
+    groups = _period_entries(year, month)
+    if establishment:
+        groups = {k: v for k, v in groups.items() if k == str(establishment).zfill(3)}
+
+    result = {"year": year, "month": month, "dry_run": int(dry_run), "archives": []}
+    for estab, entries in sorted(groups.items()):
+        url = archive_url(year, month, estab)
+        original = sum(os.path.getsize(e["src"]) for e in entries)
+        item = {"archive": url, "files": len(entries), "original_bytes": original}
+        if not int(dry_run):
+            zip_abs = os.path.join(frappe.get_site_path("private", "files"), paths.strip_private_prefix(url))
+            _pack(zip_abs, entries)
+            _index(url, entries)
+            frappe.db.commit()
+            for e in entries:
+                comprobante.forget(e["src"])
+                try:
+                    os.remove(e["src"])
+                except OSError:
+                    pass
+            item["archive_bytes"] = os.path.getsize(zip_abs)
+        result["archives"].append(item)
+
+    frappe.logger("sri_flow").info(
+        f"[ARCHIVE] {month:02d}-{year} dry_run={int(dry_run)} "
+        f"archives={len(result['archives'])} files={sum(a['files'] for a in result['archives'])}"
+    )
+    return result
+
+
+# ------------------------------
+# Scheduler
+# ------------------------------
+def _pending_periods(before: datetime.date) -> List[Tuple[int, int]]:
+    """(year, month) before `before` with Autorizado rows not yet in an archive."""
+    rows = frappe.db.sql(
+        f"""
+        SELECT DISTINCT YEAR(q.posting_date), MONTH(q.posting_date)
+        FROM `tab{QUEUE_DTYPE}` q
+        LEFT JOIN `tab{paths.INDEX_DTYPE}` i
+               ON i.legacy_url = q.xml_file AND i.file_url LIKE %s
+        WHERE q.state = 'Autorizado' AND q.posting_date < %s
+          AND IFNULL(q.xml_file, '') <> '' AND i.name IS NULL
+        ORDER BY 1, 2
+        """,
+        (f"%{paths.MEMBER_SEP}%", before),
+    )
+    return [(int(y), int(m)) for y, m in rows]
+
+
+def archive_closed_periods() -> None:
+    """Monthly hook: archive in the background when FE Settings.archive_after_months is set."""
+    from josfe.sri_invoicing.doctype.fe_settings.fe_settings import get_settings
+
+    if not get_settings().archive_after_months:
+        return
+    frappe.enqueue(
+        ARCHIVE_METHOD,
+        queue="long",
+        timeout=6 * 3600,
+        job_id=f"sri_archive:{frappe.local.site}",
+        deduplicate=True,
+    )
+
+
+def archive_closed_periods_job() -> List[Dict[str, Any]]:
+    from josfe.sri_invoicing.doctype.fe_settings.fe_settings import get_settings
+
+    months = int(get_settings().archive_after_months or 0)
+    if months <= 0:
+        return []
+    cutoff = getdate(add_months(getdate(nowdate()).replace(day=1), -months))
+    results = []
+    for year, month in _pending_periods(cutoff):
+        try:
+            results.append(archive_period(year, month, dry_run=0))
+        except Exception:
+            frappe.db.rollback()
+            frappe.log_error(frappe.get_traceback(), f"SRI archive {month:02d}-{year}")
+    return results
+
+
+# ------------------------------
+# Report
+# ------------------------------
+@frappe.whitelist()
+def get_archive_report() -> Dict[str, Any]:
+    """Per-archive sizes from the zip central directories, and the space saved."""
+    frappe.only_for(("System Manager", "Accounts Manager"))
+    root = paths.abs_path(paths.ARCHIVE, "")
+    archives, original, stored = [], 0, 0
+    for dirpath, _dirs, files in os.walk(root):
+        for fn in sorted(files):
+            if not fn.endswith(".zip"):
+                continue
+            path = os.path.join(dirpath, fn)
+            try:
+                with zipfile.ZipFile(path) as zf:
+                    infos = zf.infolist()
+            except (OSError, zipfile.BadZipFile):
+                continue
+            size = os.path.getsize(path)
+            raw = sum(i.file_size for i in infos)
+            archives.append({
+                "archive": os.path.relpath(path, root),
+                "members": len(infos),
+                "original_bytes": raw,
+                "archive_bytes": size,
+                "ratio": round(size / raw, 4) if raw else 0,
+            })
+            original += raw
+            stored += size
+
+    return {
+        "archives": sorted(archives, key=lambda a: a["archive"]),
+        "original_bytes": original,
+        "archive_bytes": stored,
+        "saved_bytes": original - stored,
+        "ratio": round(stored / original, 4) if original else 0,
+    }
@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+# apps/josfe/josfe/sri_invoicing/xml/atomic.py
+"""
+Crash-safe file primitives for the SRI/ tree (no frappe import: the bulk
+signer's worker processes use them too).
+
+write_bytes() writes a sibling temp file, fsyncs it, renames it over the
+destination and fsyncs the folder, so a reader (or a restart after a crash)
+sees either the old file or the complete new one, never a truncated XML.
+"""
+from __future__ import annotations
+
+import os
+import tempfile
+
+
+def fsync_dir(path: str) -> None:
+    """Persist the directory entry changes (create/rename/unlink) of `path`."""
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass  # not supported on every filesystem
+    finally:
+        os.close(fd)
+
+
+def write_bytes(path: str, data: bytes) -> str:
+    """Replace `path` with `data` in one step (temp file + fsync + rename)."""
+    folder = os.path.dirname(path)
+    os.makedirs(folder, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(prefix=f".{os.path.basename(path)}.", suffix=".tmp", dir=folder)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data or b"")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+    except BaseException:
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
+        raise
+    fsync_dir(folder)
+    return path
+
+
+def replace(src: str, dest: str) -> str:
+    """os.replace with both folders synced (same filesystem: the SRI/ tree)."""
+    os.makedirs(os.path.dirname(dest), exist_ok=True)
+    os.replace(src, dest)
+    fsync_dir(os.path.dirname(dest))
+    if os.path.dirname(src) != os.path.dirname(dest):
+        fsync_dir(os.path.dirname(src))
+    return dest
+
+
+def remove(path: str) -> bool:
+    """Unlink `path` if present; True when a file was removed."""
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        return False
+    fsync_dir(os.path.dirname(path))
+    return True
@@ -10,14 +10,15 @@ from josfe.sri_invoicing.xml.utils import (
     _text, D, money, qty6, ddmmyyyy,
     get_company_address, get_warehouse_address, get_ce_pe_seq, get_ce_pe_seq_nc,
     get_obligado_contabilidad, buyer_id_type,
-    get_forma_pago, map_tax_item, map_tax_invoice, get_info_adicional,
+    get_forma_pago, map_tax_item, map_tax_invoice, TaxIndex,
     hash8_from_string,
 )
 
 from josfe.sri_invoicing.core.validations.access_key import generate_access_key
 from josfe.sri_invoicing.core.utils import common
-from josfe.sri_invoicing.xml.utils import _text, format_xml_bytes
 from josfe.sri_invoicing.xml import utils as xml_utils
+from josfe.sri_invoicing.xml.comprobante import Comprobante
+from josfe.sri_invoicing.xml.context import FacturaSnapshot, load_factura_context
 
 # -------------------------
 # Pretty-print XML helper
@@ -27,8 +28,9 @@ def to_pretty_xml(elem: Element) -> str:
     Return XML string with pretty-printing and preserved UTF-8 characters.
     Uses the shared utils formatter for consistency.
     """
-    raw = tostring(elem, encoding="utf-8")      # bytes from ElementTree
-    return format_xml_bytes(raw).decode("utf-8")
+    # Indent in place: same bytes as format_xml_bytes(tostring(elem)), without the reparse
+    etree.indent(elem, space="  ")
+    return tostring(elem, xml_declaration=True, encoding="utf-8", pretty_print=True).decode("utf-8")
 
 
 def _resolve_ambiente(si) -> str:
@@ -60,10 +62,14 @@ def _resolve_ambiente(si) -> str:
     return "2"
 
 
-def build_factura_xml(si_name: str) -> tuple[str, dict]:
-    """Build deterministic SRI Factura XML for the given Sales Invoice."""
-    si = frappe.get_doc("Sales Invoice", si_name)
-    company = frappe.get_doc("Company", si.company)
+def build_factura_xml(si_name: str, snapshot: FacturaSnapshot | None = None) -> tuple[str, dict]:
+    """
+    Build deterministic SRI Factura XML for the given Sales Invoice.
+    snapshot: prefetched master data (see xml.context); loaded on the spot when omitted.
+    """
+    ctx = snapshot or load_factura_context([si_name])[si_name]
+    si = ctx.si
+    company = ctx.company
 
     # Root (match sample spec)
     factura = Element("factura", {"id": "comprobante", "version": "1.0.0"})
@@ -72,7 +78,7 @@ def build_factura_xml(si_name: str) -> tuple[str, dict]:
     # infoTributaria
     # -------------------------
     infoTrib = SubElement(factura, "infoTributaria")
-    ambiente = _resolve_ambiente(si)
+    ambiente = ctx.ambiente
     tipo_emision = "1"
 
     _text(infoTrib, "ambiente", ambiente)
@@ -103,7 +109,7 @@ def build_factura_xml(si_name: str) -> tuple[str, dict]:
     _text(
         infoTrib,
         "dirMatriz",
-        company.custom_jos_direccion_matriz or get_company_address(company.name, prefer_title="Matriz"),
+        ctx.dir_matriz,
     )
 
     # -------------------------
@@ -120,19 +126,15 @@ def build_factura_xml(si_name: str) -> tuple[str, dict]:
     # -------------------------
     infoFac = SubElement(factura, "infoFactura")
     _text(infoFac, "fechaEmision", si.posting_date.strftime("%d/%m/%Y"))
-    _text(infoFac, "dirEstablecimiento", get_warehouse_address(getattr(si, "custom_jos_level3_warehouse", None)))
-    _text(infoFac, "obligadoContabilidad", get_obligado_contabilidad(company.name))
+    _text(infoFac, "dirEstablecimiento", ctx.dir_establecimiento)
+    _text(infoFac, "obligadoContabilidad", ctx.obligado_contabilidad)
 
     buyer_id = si.tax_id
     _text(infoFac, "tipoIdentificacionComprador", buyer_id_type(buyer_id))
     _text(infoFac, "razonSocialComprador", si.customer_name)
     _text(infoFac, "identificacionComprador", buyer_id)
 
-    _text(
-        infoFac,
-        "direccionComprador",
-        frappe.db.get_value("Address", {"name": si.customer_address}, "address_line1"),
-    )
+    _text(infoFac, "direccionComprador", ctx.direccion_comprador)
 
     # Totals
     total_sin_imp = money(D(getattr(si, "net_total", getattr(si, "total", 0))))
@@ -141,8 +143,9 @@ def build_factura_xml(si_name: str) -> tuple[str, dict]:
     _text(infoFac, "totalDescuento", total_desc)
 
     # totalConImpuestos (invoice-level)
+    tax_index = TaxIndex(si)  # item_wise_tax_detail parsed once for the whole invoice
     totalConImp = SubElement(infoFac, "totalConImpuestos")
-    for tmap in map_tax_invoice(si):
+    for tmap in map_tax_invoice(si, tax_index):
         ti = SubElement(totalConImp, "totalImpuesto")
         _text(ti, "codigo", tmap["codigo"])
         _text(ti, "codigoPorcentaje", tmap["codigoPorcentaje"])
@@ -165,6 +168,7 @@ def build_factura_xml(si_name: str) -> tuple[str, dict]:
     # detalles
     # -------------------------
     detalles = SubElement(factura, "detalles")
+    item_taxes = []
     for it in si.items:
         d = SubElement(detalles, "detalle")
         _text(d, "codigoPrincipal", it.item_code)
@@ -184,7 +188,9 @@ def build_factura_xml(si_name: str) -> tuple[str, dict]:
 
         imp = SubElement(d, "impuestos")
         # Render all applicable taxes for this item (IVA/ICE/IRBPNR, mixed rates)
-        for tmap in map_tax_item(si, it):
+        tmaps = map_tax_item(si, it, tax_index)
+        item_taxes.append(tmaps)
+        for tmap in tmaps:
             i = SubElement(imp, "impuesto")
             _text(i, "codigo", tmap["codigo"])
             _text(i, "codigoPorcentaje", tmap["codigoPorcentaje"])
@@ -196,7 +202,7 @@ def build_factura_xml(si_name: str) -> tuple[str, dict]:
     # -------------------------
     # infoAdicional
     # -------------------------
-    adicionales = get_info_adicional(si)
+    adicionales = ctx.info_adicional
     if adicionales:
         infoAd = SubElement(factura, "infoAdicional")
         for campo in adicionales:
@@ -204,7 +210,7 @@ def build_factura_xml(si_name: str) -> tuple[str, dict]:
             ca.text = str(campo["valor"])[:300]
 
     # --- Validation: ensure taxes reconcile ---
-    xml_val = sum(D(imp["valor"]) for it in si.items for imp in map_tax_item(si, it))
+    xml_val = sum(D(imp["valor"]) for tmaps in item_taxes for imp in tmaps)
     if abs(xml_val - D(si.total_taxes_and_charges or 0)) > D("0.01"):
         frappe.throw(f"El XML no cuadra impuestos (ERP={si.total_taxes_and_charges}, XML={xml_val})")
 
@@ -213,7 +219,6 @@ def build_factura_xml(si_name: str) -> tuple[str, dict]:
     # -------------------------
     # Output
     # -------------------------
-    xml_string = to_pretty_xml(factura)
     meta = {
         "clave_acceso": clave,
         "estab": codes["ce"],
@@ -221,7 +226,19 @@ def build_factura_xml(si_name: str) -> tuple[str, dict]:
         "secuencial": codes["secuencial"],
         "importe_total": importe_total,
     }
-    return xml_string, meta
+    comp = Comprobante.from_element(factura, meta)
+    meta["comprobante"] = comp  # live tree for the next stages (queue api writes it)
+    return comp.to_text(), meta
+
+def build_facturas_xml(si_names: list[str]):
+    """
+    Build many facturas with one prefetch of their master data.
+    Yields (si_name, xml_string, meta) in input order.
+    """
+    snapshots = load_factura_context(si_names)
+    for name in dict.fromkeys(si_names):
+        xml_string, meta = build_factura_xml(name, snapshot=snapshots[name])
+        yield name, xml_string, meta
 
 def build_nota_credito_xml(nc_name: str):
     """Build SRI Nota de Crédito XML (spec v2.31, aligned with authorized CN)."""
@@ -385,5 +402,7 @@ def build_nota_credito_xml(nc_name: str):
     ca.text = nc.name
 
     # Output
-    xml_string = etree.tostring(root, pretty_print=True, encoding="utf-8", xml_declaration=True).decode("utf-8")
-    return xml_string, {"clave_acceso": clave, "estab": ce, "pto_emi": pe, "secuencial": sec9}
+    meta = {"clave_acceso": clave, "estab": ce, "pto_emi": pe, "secuencial": sec9}
+    comp = Comprobante.from_element(root, meta)
+    meta["comprobante"] = comp
+    return comp.to_text(), meta
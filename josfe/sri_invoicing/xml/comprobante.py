@@ -0,0 +1,199 @@
+# apps/josfe/josfe/sri_invoicing/xml/comprobante.py
+"""
+In-memory comprobante: one lxml tree + its metadata, carried from build
+through sign through send. Bytes are produced only at the file boundary.
+
+The tree is always kept in the same shape xml.utils.format_xml_bytes writes
+(2-space indent, no other blank text), so serializing it gives the exact
+bytes the old build → format → reparse chain produced.
+"""
+from __future__ import annotations
+
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+import frappe
+from lxml import etree
+
+from josfe.sri_invoicing.xml import atomic
+
+# Live documents per process, keyed by file name (stage moves keep the name)
+LIVE_CACHE_SIZE = 256
+
+_LIVE: "OrderedDict[str, tuple]" = OrderedDict()
+_LIVE_LOCK = threading.Lock()
+_STATS = {"documents": 0, "parses": 0, "serializations": 0, "cache_hits": 0}
+
+
+def _count(key: str, n: int = 1) -> None:
+    _STATS[key] = _STATS.get(key, 0) + n
+
+
+class Comprobante:
+    """Parsed SRI document (factura, notaCredito, ...) plus infoTributaria metadata."""
+
+    __slots__ = ("root", "data", "parses", "meta")
+
+    def __init__(self, root: etree._Element, data: Optional[bytes] = None, parses: int = 0, meta: Optional[dict] = None):
+        self.root = root
+        self.data = data        # serialized bytes, valid until the tree changes
+        self.parses = parses    # times this document's bytes were parsed
+        self.meta = dict(meta or {})
+        _count("documents")
+        if parses:
+            _count("parses", parses)
+
+    # ------------------------------
+    # Constructors
+    # ------------------------------
+    @classmethod
+    def from_element(cls, root: etree._Element, meta: Optional[dict] = None) -> "Comprobante":
+        """Wrap a freshly built tree (builders); no parse involved."""
+        etree.indent(root, space="  ")
+        root.tail = None
+        return cls(root, meta=meta)
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "Comprobante":
+        """Parse once. Signed documents keep their bytes untouched in .data."""
+        root = etree.fromstring(data)
+        return cls(root, data=data, parses=1)
+
+    # ------------------------------
+    # Metadata (read from the tree, never by re-parsing bytes)
+    # ------------------------------
+    def _info(self, tag: str) -> str:
+        node = self.root.find(f"infoTributaria/{tag}")
+        if node is None:
+            vals = self.root.xpath(f'//*[local-name()="{tag}"]/text()')
+            return (vals[0] if vals else "").strip()
+        return (node.text or "").strip()
+
+    @property
+    def root_name(self) -> str:
+        return etree.QName(self.root).localname
+
+    @property
+    def clave(self) -> str:
+        return self.meta.get("clave_acceso") or self._info("claveAcceso")
+
+    @property
+    def ambiente_code(self) -> str:
+        return self._info("ambiente")
+
+    @property
+    def ambiente(self) -> str:
+        """'Pruebas' / 'Producción', as soap.* expects (1=Pruebas, 2=Producción)."""
+        v = self.ambiente_code
+        return "Producción" if v == "2" or v.lower().startswith("prod") else "Pruebas"
+
+    @property
+    def estab(self) -> str:
+        return self.meta.get("estab") or self._info("estab")
+
+    @property
+    def pto_emi(self) -> str:
+        return self.meta.get("pto_emi") or self._info("ptoEmi")
+
+    @property
+    def secuencial(self) -> str:
+        return self.meta.get("secuencial") or self._info("secuencial")
+
+    @property
+    def is_signed(self) -> bool:
+        return self.root.find("{http://www.w3.org/2000/09/xmldsig#}Signature") is not None
+
+    # ------------------------------
+    # Serialization (file boundary only)
+    # ------------------------------
+    def to_bytes(self) -> bytes:
+        if self.data is None:
+            self.data = etree.tostring(self.root, xml_declaration=True, encoding="utf-8", pretty_print=True)
+            _count("serializations")
+        return self.data
+
+    def to_text(self) -> str:
+        return self.to_bytes().decode("utf-8")
+
+    def set_signed(self, signed: bytes) -> None:
+        """Signer already filled the tree in place; keep its exact output bytes."""
+        self.data = signed
+
+    def normalize(self) -> etree._Element:
+        """Bring a parsed tree back to the format_xml_bytes shape before editing it."""
+        etree.indent(self.root, space="  ")
+        self.root.tail = None
+        self.data = None
+        return self.root
+
+
+# ------------------------------
+# Per-process live cache
+# ------------------------------
+def _stamp(path: str) -> tuple:
+    st = os.stat(path)
+    return (st.st_size, st.st_mtime_ns)
+
+
+def remember(path: str, comp: Comprobante) -> Comprobante:
+    """Register the document just written to `path` so later stages skip the parse."""
+    try:
+        stamp = _stamp(path)
+    except OSError:
+        return comp
+    with _LIVE_LOCK:
+        key = os.path.basename(path)
+        _LIVE[key] = (stamp, comp)
+        _LIVE.move_to_end(key)
+        while len(_LIVE) > LIVE_CACHE_SIZE:
+            _LIVE.popitem(last=False)
+    return comp
+
+
+def load(path: str) -> Comprobante:
+    """Comprobante for the file at `path`: live object if the file is unchanged, else one parse."""
+    stamp = _stamp(path)
+    key = os.path.basename(path)
+    with _LIVE_LOCK:
+        hit = _LIVE.get(key)
+        if hit and hit[0] == stamp:
+            _LIVE.move_to_end(key)
+            _count("cache_hits")
+            return hit[1]
+
+    with open(path, "rb") as f:
+        comp = Comprobante.from_bytes(f.read())
+    return remember(path, comp)
+
+
+def write(path: str, comp: Comprobante) -> str:
+    """Serialize at the file boundary (atomic replace) and keep the live object for the next stage."""
+    atomic.write_bytes(path, comp.to_bytes())
+    remember(path, comp)
+    return path
+
+
+def forget(path: str) -> None:
+    with _LIVE_LOCK:
+        _LIVE.pop(os.path.basename(path), None)
+
+
+# ------------------------------
+# Metrics
+# ------------------------------
+def parse_stats() -> Dict[str, Any]:
+    docs = _STATS.get("documents", 0)
+    return {
+        **_STATS,
+        "parses_per_document": round(_STATS.get("parses", 0) / docs, 3) if docs else 0,
+        "live": len(_LIVE),
+    }
+
+
+@frappe.whitelist()
+def get_parse_stats() -> Dict[str, Any]:
+    """Parse/serialize counters of the comprobante pipeline in the worker serving this request."""
+    frappe.only_for(("System Manager", "Accounts Manager"))
+    return parse_stats()
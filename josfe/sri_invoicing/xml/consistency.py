@@ -0,0 +1,339 @@
+# -*- coding: utf-8 -*-
+# apps/josfe/josfe/sri_invoicing/xml/consistency.py
+"""
+SRI/ tree vs SRI XML Queue.xml_file consistency scan.
+
+The stage folders (ARCHIVO, RIDE and .journal excluded) are walked once,
+directories in parallel, into a document → locations index; the index is
+joined with every queue row's xml_file in one query. A document is its file
+name with the .rechazado / .no_autorizado suffix dropped.
+
+Incremental: each directory listing is kept in SRI/.scan_index.json with the
+directory's mtime; an unchanged directory is not listed again (a directory's
+mtime moves whenever an entry is added, removed or renamed in it).
+
+Issue codes:
+- colgante    queue row whose xml_file is neither on disk nor in an archive
+- duplicado   file of a document whose row points at another existing file
+- huerfano    file of a document no queue row points at
+- compartido  same xml_file on more than one queue row
+- carpeta     file in a stage folder spelled with another casing
+              (e.g. FIRMADOS/RECHAZADOS next to FIRMADOS/Rechazados)
+
+repair=1 fixes what has one safe answer: deletes duplicados lying in
+GENERADOS/FIRMADOS/PENDIENTES, repoints a colgante row to its document's
+only unclaimed file, and moves carpeta files into the canonical folder
+(journaled, xml_file follows). Files or rows touched within
+journal.GRACE_SECONDS, or named by a pending journal, are left alone.
+huerfano and compartido are only reported.
+
+    bench --site <site> execute josfe.sri_invoicing.xml.consistency.scan
+    bench --site <site> execute josfe.sri_invoicing.xml.consistency.scan --kwargs "{'repair': 1}"
+"""
+from __future__ import annotations
+
+import json
+import os
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+
+import frappe
+from frappe.utils import add_to_date, get_datetime, now_datetime
+
+from josfe.sri_invoicing.xml import atomic, comprobante, journal, paths
+
+QUEUE_DTYPE = "SRI XML Queue"
+SCAN_WORKERS = 8
+SCAN_STATE = ".scan_index.json"
+# Listings of directories modified this recently are not cached (same-tick changes)
+RACY_SECONDS = 2
+REPORT_CACHE_KEY = "sri_consistency:last"
+SCAN_METHOD = "josfe.sri_invoicing.xml.consistency.scan_nightly_job"
+
+_SKIP_TOP = {paths.ARCHIVE, paths.RIDE, paths.JOURNAL}
+# Stages whose leftover copies may be deleted once the row points elsewhere
+_DISPOSABLE = {paths.GEN, paths.SIGNED, paths.SIGNED_SENT_PENDING}
+_WRAPPER_SUFFIX = re.compile(r"\.(rechazado|no_autorizado)(?=\.xml$)", re.I)
+
+
+def doc_key(filename: str) -> str:
+    return _WRAPPER_SUFFIX.sub("", filename)
+
+
+def _url(rel: str) -> str:
+    return paths.to_file_url("", rel)
+
+
+def _norm(url: str) -> str:
+    return paths.PRIVATE_PREFIX + os.path.normpath(paths.strip_private_prefix(url)).replace(os.sep, "/")
+
+
+def _abs(url: str) -> str:
+    return os.path.join(frappe.get_site_path("private", "files"), paths.strip_private_prefix(url))
+
+
+# ------------------------------
+# Walk (incremental, parallel)
+# ------------------------------
+def _state_path() -> str:
+    return paths.abs_path("", SCAN_STATE)
+
+
+def _load_state() -> Dict[str, list]:
+    try:
+        with open(_state_path(), "rb") as f:
+            return json.loads(f.read())
+    except (OSError, ValueError):
+        return {}
+
+
+def _list_dir(root: str, rel: str, cached: Optional[list]) -> Tuple[str, Optional[list], bool]:
+    """(rel, [mtime_ns, files, subdirs] or None if gone, reused)."""
+    path = os.path.join(root, rel)
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except OSError:
+        return rel, None, False
+    if cached and cached[0] == mtime:
+        return rel, cached, True
+
+    files, subdirs = [], []
+    try:
+        for entry in os.scandir(path):
+            if entry.name.startswith("."):
+                continue
+            if entry.is_dir(follow_symlinks=False):
+                if rel or entry.name not in _SKIP_TOP:
+                    subdirs.append(entry.name)
+            elif entry.is_file(follow_symlinks=False):
+                files.append(entry.name)
+    except OSError:
+        return rel, None, False
+    racy = time.time() - mtime / 1e9 < RACY_SECONDS
+    return rel, [0 if racy else mtime, sorted(files), sorted(subdirs)], False
+
+
+def walk(workers: int = SCAN_WORKERS) -> Tuple[List[str], Dict[str, int]]:
+    """Relative paths (under SRI/) of every file in the stage folders, plus walk counters."""
+    root = paths.abs_path("", "")
+    old_state = _load_state()
+    new_state: Dict[str, list] = {}
+    files: List[str] = []
+    stats = {"dirs": 0, "reused": 0}
+
+    frontier = [""]
+    with ThreadPoolExecutor(max_workers=max(1, int(workers)), thread_name_prefix="sri-consistency") as pool:
+        while frontier:
+            results = list(pool.map(lambda rel: _list_dir(root, rel, old_state.get(rel)), frontier))
+            frontier = []
+            for rel, listing, reused in results:
+                if listing is None:
+                    continue
+                new_state[rel] = listing
+                stats["dirs"] += 1
+                stats["reused"] += int(reused)
+                if rel:  # loose files directly under SRI/ belong to no stage
+                    files.extend(os.path.join(rel, f) for f in listing[1])
+                frontier.extend(os.path.join(rel, d) for d in listing[2])
+
+    atomic.write_bytes(_state_path(), json.dumps(new_state).encode("utf-8"))
+    return files, stats
+
+
+# ------------------------------
+# Index + join
+# ------------------------------
+def _locations(rel_files: List[str]) -> Dict[str, List[dict]]:
+    """document → [{url, rel, stage, canonical}] for every file found."""
+    out: Dict[str, List[dict]] = {}
+    for rel in rel_files:
+        rel = rel.replace(os.sep, "/")
+        url = _url(rel)
+        stage, shard, filename = paths.split_url(url)
+        canonical = rel if not stage else "/".join(p for p in (stage, shard, filename) if p)
+        out.setdefault(doc_key(filename), []).append({
+            "url": url, "rel": rel, "stage": stage, "canonical": canonical,
+        })
+    return out
+
+
+def _queue_rows() -> List[dict]:
+    return frappe.db.sql(
+        f"""
+        SELECT name, state, xml_file, modified
+        FROM `tab{QUEUE_DTYPE}`
+        WHERE IFNULL(xml_file, '') <> ''
+        """,
+        as_dict=True,
+    )
+
+
+def _indexed_urls() -> set:
+    """Old URLs SRI File Index still resolves (migrated or archived files)."""
+    return {u for (u,) in frappe.db.sql(f"SELECT legacy_url FROM `tab{paths.INDEX_DTYPE}`")}
+
+
+# ------------------------------
+# Scan
+# ------------------------------
+def scan(repair: int = 0, workers: int = SCAN_WORKERS) -> Dict[str, Any]:
+    """Walk SRI/, join with the queue, report (and with repair=1 fix) inconsistencies."""
+    t0 = time.monotonic()
+    rel_files, walk_stats = walk(workers)
+    locations = _locations(rel_files)
+    on_disk = {loc["url"] for locs in locations.values() for loc in locs}
+
+    rows = _queue_rows()
+    indexed = _indexed_urls()
+    by_url: Dict[str, List[dict]] = {}
+    for r in rows:
+        by_url.setdefault(_norm(r.xml_file), []).append(r)
+
+    issues: List[dict] = []
+    dangling: Dict[str, List[dict]] = {}  # document → rows
+    pointed_ok: Dict[str, set] = {}       # document → existing urls rows point at
+    for url, url_rows in by_url.items():
+        key = doc_key(os.path.basename(url))
+        if len(url_rows) > 1:
+            issues.append({"issue": "compartido", "url": url, "queue_rows": [r.name for r in url_rows]})
+        if url in on_disk or (url in indexed and paths.exists(url)):
+            pointed_ok.setdefault(key, set()).add(url)
+        else:
+            dangling.setdefault(key, []).extend(url_rows)
+
+    for key, key_rows in dangling.items():
+        unclaimed = [loc["url"] for loc in locations.get(key, []) if loc["url"] not in by_url]
+        for r in key_rows:
+            issues.append({"issue": "colgante", "url": r.xml_file, "queue_row": r.name,
+                           "state": r.state, "candidates": unclaimed})
+
+    for key, locs in locations.items():
+        for loc in locs:
+            if loc["canonical"] != loc["rel"]:
+                issues.append({"issue": "carpeta", "url": loc["url"], "canonical": _url(loc["canonical"])})
+            if loc["url"] in by_url:
+                continue
+            if pointed_ok.get(key):
+                issues.append({"issue": "duplicado", "url": loc["url"], "stage": loc["stage"],
+                               "kept": sorted(pointed_ok[key])})
+            elif key not in dangling:
+                issues.append({"issue": "huerfano", "url": loc["url"], "stage": loc["stage"]})
+
+    by_issue: Dict[str, int] = {}
+    for i in issues:
+        by_issue[i["issue"]] = by_issue.get(i["issue"], 0) + 1
+
+    report = {
+        "dirs": walk_stats["dirs"],
+        "dirs_reused": walk_stats["reused"],
+        "files": len(rel_files),
+        "rows": len(rows),
+        "by_issue": by_issue,
+        "issues": issues,
+        "repaired": _repair(issues, by_url) if int(repair) else {},
+        "elapsed_s": round(time.monotonic() - t0, 3),
+    }
+    frappe.logger("sri_flow").info(
+        f"[CONSISTENCY] files={report['files']} rows={report['rows']} dirs={report['dirs']} "
+        f"reused={report['dirs_reused']} by_issue={by_issue} repaired={report['repaired']}"
+    )
+    return report
+
+
+# ------------------------------
+# Repair
+# ------------------------------
+def _settled(url: str, pending: set, cutoff: float) -> bool:
+    """True when nothing may still be working on this file."""
+    if url in pending:
+        return False
+    try:
+        return os.stat(_abs(url)).st_mtime < cutoff
+    except OSError:
+        return False
+
+
+def _repair(issues: List[dict], by_url: Dict[str, List[dict]]) -> Dict[str, int]:
+    pending = journal.pending_urls()
+    cutoff = time.time() - journal.GRACE_SECONDS
+    row_cutoff = add_to_date(now_datetime(), seconds=-journal.GRACE_SECONDS)
+    done = {"duplicado": 0, "colgante": 0, "carpeta": 0}
+
+    # 1) Leftover copies of earlier stages
+    for i in issues:
+        if i["issue"] == "duplicado" and i["stage"] in _DISPOSABLE and _settled(i["url"], pending, cutoff):
+            path = _abs(i["url"])
+            comprobante.forget(path)
+            if atomic.remove(path):
+                done["duplicado"] += 1
+
+    # 2) Dangling rows with exactly one file to point at
+    claimed: set = set()
+    for i in issues:
+        if i["issue"] != "colgante" or len(i["candidates"]) != 1:
+            continue
+        target = i["candidates"][0]
+        rows = [r for r in by_url.get(_norm(i["url"]), []) if r.name == i["queue_row"]]
+        if target in claimed or not rows or i["url"] in pending:
+            continue
+        if get_datetime(rows[0].modified) > row_cutoff or not _settled(target, pending, cutoff):
+            continue
+        frappe.db.sql(
+            f"UPDATE `tab{QUEUE_DTYPE}` SET xml_file=%s WHERE name=%s AND xml_file=%s",
+            (target, i["queue_row"], i["url"]),
+        )
+        claimed.add(target)
+        done["colgante"] += 1
+    frappe.db.commit()
+
+    # 3) Files in a mis-cased stage folder → canonical folder, rows follow
+    for i in issues:
+        if i["issue"] != "carpeta" or not _settled(i["url"], pending, cutoff):
+            continue
+        src, dest = _abs(i["url"]), _abs(i["canonical"])
+        if not os.path.exists(src) or os.path.exists(dest):
+            continue
+        journal.record_move(i["url"], i["canonical"], src, dest)
+        comprobante.forget(src)
+        atomic.replace(src, dest)
+        frappe.db.sql(
+            f"UPDATE `tab{QUEUE_DTYPE}` SET xml_file=%s WHERE xml_file=%s",
+            (i["canonical"], i["url"]),
+        )
+        done["carpeta"] += 1
+    frappe.db.commit()
+    return done
+
+
+# ------------------------------
+# Scheduler + API
+# ------------------------------
+def scan_nightly() -> None:
+    """Daily hook: report-only scan in the background (large trees take a while)."""
+    frappe.enqueue(
+        SCAN_METHOD,
+        queue="long",
+        timeout=4 * 3600,
+        job_id=f"sri_consistency:{frappe.local.site}",
+        deduplicate=True,
+    )
+
+
+def scan_nightly_job() -> Dict[str, Any]:
+    journal.reconcile()
+    report = scan(repair=0)
+    frappe.cache().set_value(REPORT_CACHE_KEY, report)
+    return report
+
+
+@frappe.whitelist()
+def get_consistency_report(refresh: int = 0, repair: int = 0, limit: int = 500) -> Dict[str, Any]:
+    """Last nightly report (or a fresh scan); the issue list is capped at `limit` entries."""
+    frappe.only_for(("System Manager",))
+    report = None if int(refresh) or int(repair) else frappe.cache().get_value(REPORT_CACHE_KEY)
+    if not report:
+        report = scan(repair=int(repair))
+        frappe.cache().set_value(REPORT_CACHE_KEY, report)
+    return {**report, "issues": report["issues"][: max(0, int(limit))]}
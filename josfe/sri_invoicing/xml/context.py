@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+# apps/josfe/josfe/sri_invoicing/xml/context.py
+"""
+Prefetching context for the factura builder.
+
+load_factura_context() reads every Sales Invoice of a batch (with items and
+taxes) and all the master data the builder needs — Company, Credenciales SRI,
+FE Settings, company/warehouse addresses, customer Address and Contact — in a
+fixed number of bulk queries. Building N facturas then costs
+O(distinct masters) queries instead of O(N × lookups).
+"""
+from __future__ import annotations
+
+from collections import defaultdict
+from types import SimpleNamespace
+from typing import Dict, Iterable, List, Optional
+
+import frappe
+
+
+def _chunks(values: List[str], size: int = 500):
+    for i in range(0, len(values), size):
+        yield values[i:i + size]
+
+
+def _ambiente_code(label: Optional[str]) -> Optional[str]:
+    if not label:
+        return None
+    return "1" if label.strip().lower().startswith("prueb") else "2"
+
+
+def _linked_addresses(link_doctype: str, names: Iterable[str], prefer_title: Optional[str] = None) -> Dict[str, str]:
+    """
+    Bulk version of utils.get_company_address / get_warehouse_address:
+    first address_line1 per link_name, primary first, then oldest.
+    """
+    names = sorted({n for n in names if n})
+    out: Dict[str, str] = {}
+    for chunk in _chunks(names):
+        values: list = [link_doctype, tuple(chunk)]
+        sql = """
+            SELECT dl.link_name, a.address_line1
+            FROM `tabAddress` a
+            JOIN `tabDynamic Link` dl ON dl.parent = a.name
+            WHERE dl.link_doctype = %s
+              AND dl.link_name IN %s
+              AND a.disabled = 0
+        """
+        if prefer_title:
+            sql += " AND a.address_title = %s"
+            values.append(prefer_title)
+        sql += " ORDER BY dl.link_name, a.is_primary_address DESC, a.creation ASC"
+        for row in frappe.db.sql(sql, values, as_dict=True):
+            out.setdefault(row.link_name, row.address_line1 or "")
+    return out
+
+
+def _children(doctype: str, parents: List[str]) -> Dict[str, list]:
+    out: Dict[str, list] = defaultdict(list)
+    for chunk in _chunks(parents):
+        rows = frappe.get_all(
+            doctype,
+            filters={"parent": ["in", chunk], "parenttype": "Sales Invoice"},
+            fields=["*"],
+            order_by="parent asc, idx asc",
+        )
+        for r in rows:
+            out[r.parent].append(r)
+    return out
+
+
+def _by_name(doctype: str, names: Iterable[str], fields: List[str]) -> Dict[str, frappe._dict]:
+    names = sorted({n for n in names if n})
+    out: Dict[str, frappe._dict] = {}
+    for chunk in _chunks(names):
+        for r in frappe.get_all(doctype, filters={"name": ["in", chunk]}, fields=fields):
+            out[r.name] = r
+    return out
+
+
+class InvoiceRecord(SimpleNamespace):
+    """
+    Attribute view of a Sales Invoice row + its child tables.
+    (frappe._dict would shadow the `items` child table with dict.items.)
+    """
+
+    def get(self, key, default=None):
+        return getattr(self, key, default)
+
+
+class FacturaSnapshot:
+    """Everything build_factura_xml reads from the DB for one invoice (besides numbering)."""
+
+    __slots__ = ("si", "company", "ambiente", "dir_matriz", "dir_establecimiento",
+                 "obligado_contabilidad", "direccion_comprador", "info_adicional")
+
+    def __init__(self, **kw):
+        for k in self.__slots__:
+            setattr(self, k, kw.get(k))
+
+
+def load_factura_context(si_names: Iterable[str]) -> Dict[str, FacturaSnapshot]:
+    """Bulk-load Sales Invoices + masters; returns {si_name: FacturaSnapshot}."""
+    names = list(dict.fromkeys(n for n in si_names if n))
+    if not names:
+        return {}
+
+    # 1) Invoices, items, taxes (3 queries per 500 invoices)
+    invoices = {}
+    for chunk in _chunks(names):
+        for r in frappe.get_all("Sales Invoice", filters={"name": ["in", chunk]}, fields=["*"]):
+            invoices[r.name] = InvoiceRecord(**r)
+    missing = [n for n in names if n not in invoices]
+    if missing:
+        frappe.throw(f"Sales Invoice no encontrada: {', '.join(missing[:5])}")
+
+    items = _children("Sales Invoice Item", names)
+    taxes = _children("Sales Taxes and Charges", names)
+    for n, si in invoices.items():
+        si.items = items.get(n, [])
+        si.taxes = taxes.get(n, [])
+
+    # 2) Masters keyed by company / warehouse / address / contact
+    companies = _by_name("Company", (si.company for si in invoices.values()), ["*"])
+    amb_by_company = {
+        r.company: r.jos_ambiente
+        for r in frappe.get_all(
+            "Credenciales SRI",
+            filters={"company": ["in", list(companies) or [""]], "jos_activo": 1},
+            fields=["company", "jos_ambiente"],
+        )
+    }
+    try:
+        env_override = _ambiente_code(frappe.db.get_single_value("FE Settings", "env_override"))
+    except Exception:
+        env_override = None
+
+    matriz = _linked_addresses(
+        "Company",
+        (c.name for c in companies.values() if not c.get("custom_jos_direccion_matriz")),
+        prefer_title="Matriz",
+    )
+    warehouses = _linked_addresses(
+        "Warehouse", (si.get("custom_jos_level3_warehouse") for si in invoices.values())
+    )
+    addresses = _by_name("Address", (si.customer_address for si in invoices.values()), ["name", "address_line1"])
+    contacts = _by_name("Contact", (si.contact_person for si in invoices.values()), ["name", "email_id", "phone"])
+
+    # 3) Per-invoice snapshots (no further queries)
+    out: Dict[str, FacturaSnapshot] = {}
+    for n in names:
+        si = invoices[n]
+        company = companies.get(si.company) or frappe._dict(name=si.company)
+        addr = addresses.get(si.customer_address)
+        contact = contacts.get(si.contact_person)
+
+        # Same sources, same order as utils.get_info_adicional
+        info = []
+        if addr and addr.address_line1:
+            info.append({"nombre": "Dirección", "valor": addr.address_line1})
+        if contact and contact.email_id:
+            info.append({"nombre": "Email", "valor": contact.email_id})
+        if contact and contact.phone:
+            info.append({"nombre": "Teléfono", "valor": contact.phone})
+
+        out[n] = FacturaSnapshot(
+            si=si,
+            company=company,
+            ambiente=_ambiente_code(amb_by_company.get(si.company)) or env_override or "2",
+            dir_matriz=company.get("custom_jos_direccion_matriz") or matriz.get(company.name, ""),
+            dir_establecimiento=warehouses.get(si.get("custom_jos_level3_warehouse"), ""),
+            obligado_contabilidad="SI" if company.get("custom_jos_contabilidad") in ("1", 1, True, "SI") else "NO",
+            direccion_comprador=addr.address_line1 if addr else None,
+            info_adicional=info,
+        )
+    return out
@@ -0,0 +1,213 @@
+# -*- coding: utf-8 -*-
+# apps/josfe/josfe/sri_invoicing/xml/journal.py
+"""
+Intent journal tying SRI/ file moves to the DB transaction that repoints
+SRI XML Queue.xml_file.
+
+A file move and the UPDATE of xml_file cannot be atomic together, so every
+stage change is recorded first in SRI/.journal/<txn>.json (one file per open
+transaction, fsynced) and settled when the transaction ends:
+
+- move       old file renamed to new (_move_xml_file).
+             commit: nothing to do.   rollback: rename it back.
+- supersede  new file written next to the old one (AUTORIZADOS wrapper,
+             rechazado / no autorizado wrapper, bulk-signed copy).
+             commit: delete the old file.   rollback: delete the new file.
+
+frappe.db after_commit / after_rollback settle it in-process. A journal left
+by a crashed worker is settled by reconcile() (after_migrate, and a cron tick
+for journals older than GRACE_SECONDS) by looking at which URL the queue row
+actually holds. This replaces the per-transition scans for stale copies in
+GENERADOS/FIRMADOS/PENDIENTES.
+
+    bench --site <site> execute josfe.sri_invoicing.xml.journal.reconcile --kwargs "{'grace_seconds': 0}"
+"""
+from __future__ import annotations
+
+import json
+import os
+import time
+from typing import Any, Dict, List
+
+import frappe
+
+from josfe.sri_invoicing.xml import atomic, comprobante, paths
+
+QUEUE_DTYPE = "SRI XML Queue"
+MOVE = "move"
+SUPERSEDE = "supersede"
+# Journals younger than this may belong to a transaction still running elsewhere
+GRACE_SECONDS = 600
+
+
+def _journal_dir() -> str:
+    return paths.abs_path(paths.JOURNAL, "")
+
+
+# ------------------------------
+# Recording (inside the transaction)
+# ------------------------------
+def _current() -> Dict[str, Any]:
+    txn = getattr(frappe.local, "sri_journal", None)
+    if txn is None:
+        name = f"{int(time.time())}-{frappe.generate_hash(length=12)}"
+        txn = {
+            "name": name,
+            "path": os.path.join(_journal_dir(), f"{name}.json"),
+            "site": getattr(frappe.local, "site", None),
+            "ops": [],
+        }
+        frappe.local.sri_journal = txn
+        frappe.db.after_commit.add(_on_commit)
+        frappe.db.after_rollback.add(_on_rollback)
+    return txn
+
+
+def _record(op: str, old_url: str, new_url: str, old_abs: str, new_abs: str) -> None:
+    txn = _current()
+    txn["ops"].append({"op": op, "old_url": old_url, "new_url": new_url, "old_abs": old_abs, "new_abs": new_abs})
+    atomic.write_bytes(txn["path"], json.dumps({k: txn[k] for k in ("name", "site", "ops")}).encode("utf-8"))
+
+
+def record_move(old_url: str, new_url: str, old_abs: str, new_abs: str) -> None:
+    """Call before renaming old_abs → new_abs."""
+    _record(MOVE, old_url, new_url, old_abs, new_abs)
+
+
+def record_supersede(old_url: str, new_url: str) -> None:
+    """Call once new_url is written, before xml_file is repointed from old_url to it."""
+    if not old_url or not new_url or old_url == new_url:
+        return
+    old_abs, new_abs = paths.resolve(old_url), paths.resolve(new_url)
+    if os.path.abspath(old_abs) == os.path.abspath(new_abs):
+        return
+    _record(SUPERSEDE, old_url, new_url, old_abs, new_abs)
+
+
+# ------------------------------
+# Settling
+# ------------------------------
+def _commit_op(op: dict) -> None:
+    if op["op"] == SUPERSEDE and os.path.exists(op["new_abs"]):
+        comprobante.forget(op["old_abs"])
+        atomic.remove(op["old_abs"])
+
+
+def _undo_op(op: dict) -> None:
+    old_abs, new_abs = op["old_abs"], op["new_abs"]
+    if not os.path.exists(new_abs):
+        return
+    if op["op"] == MOVE:
+        if not os.path.exists(old_abs):
+            comprobante.forget(new_abs)
+            atomic.replace(new_abs, old_abs)
+    elif os.path.exists(old_abs):
+        comprobante.forget(new_abs)
+        atomic.remove(new_abs)
+
+
+def _settle(ops: List[dict], committed: bool) -> None:
+    for op in (ops if committed else reversed(ops)):
+        try:
+            (_commit_op if committed else _undo_op)(op)
+        except Exception:
+            frappe.log_error(frappe.get_traceback(), "SRI file journal")
+
+
+def _finish(committed: bool) -> None:
+    txn = getattr(frappe.local, "sri_journal", None)
+    frappe.local.sri_journal = None
+    if not txn:
+        return
+    _settle(txn["ops"], committed)
+    atomic.remove(txn["path"])
+
+
+def _on_commit() -> None:
+    _finish(True)
+
+
+def _on_rollback() -> None:
+    _finish(False)
+
+
+# ------------------------------
+# Recovery (journals of crashed workers)
+# ------------------------------
+def _chains(ops: List[dict]) -> List[List[dict]]:
+    """Group a transaction's ops per document: an op continuing from the previous op's new_url."""
+    chains: List[List[dict]] = []
+    by_tail: Dict[str, List[dict]] = {}
+    for op in ops:
+        chain = by_tail.pop(op["old_url"], None)
+        if chain is None:
+            chain = []
+            chains.append(chain)
+        chain.append(op)
+        by_tail[op["new_url"]] = chain
+    return chains
+
+
+def _read_ops(path: str) -> List[dict]:
+    try:
+        with open(path, "rb") as f:
+            return json.loads(f.read()).get("ops") or []
+    except (OSError, ValueError):
+        return []
+
+
+def _pointed(urls: set) -> set:
+    if not urls:
+        return set()
+    return {u for (u,) in frappe.db.sql(
+        f"SELECT xml_file FROM `tab{QUEUE_DTYPE}` WHERE xml_file IN %s", (tuple(urls),)
+    )}
+
+
+def pending_urls() -> set:
+    """URLs named by journals still on disk (transactions in flight or not yet reconciled)."""
+    folder = _journal_dir()
+    out: set = set()
+    if not os.path.isdir(folder):
+        return out
+    for entry in os.scandir(folder):
+        if not entry.name.endswith(".json"):
+            continue
+        for op in _read_ops(entry.path):
+            out.update((op["old_url"], op["new_url"]))
+    return out
+
+
+def reconcile(grace_seconds: int = GRACE_SECONDS) -> Dict[str, int]:
+    """
+    Settle journals whose transaction never reported back: a chain whose final
+    URL is what the queue row holds was committed; one whose first URL is still
+    there was rolled back; anything else is left alone and only dropped.
+    """
+    folder = _journal_dir()
+    counts = {"journals": 0, "committed": 0, "rolled_back": 0, "unmatched": 0}
+    if not os.path.isdir(folder):
+        return counts
+
+    cutoff = time.time() - max(0, int(grace_seconds))
+    for entry in sorted(os.scandir(folder), key=lambda e: e.name):
+        if not entry.name.endswith(".json") or entry.stat().st_mtime > cutoff:
+            continue
+
+        chains = _chains(_read_ops(entry.path))
+        pointed = _pointed({c[0]["old_url"] for c in chains} | {c[-1]["new_url"] for c in chains})
+        for chain in chains:
+            if chain[-1]["new_url"] in pointed:
+                _settle(chain, committed=True)
+                counts["committed"] += 1
+            elif chain[0]["old_url"] in pointed:
+                _settle(chain, committed=False)
+                counts["rolled_back"] += 1
+            else:
+                counts["unmatched"] += 1
+        atomic.remove(entry.path)
+        counts["journals"] += 1
+
+    if counts["journals"]:
+        frappe.logger("sri_flow").info(f"[JOURNAL] reconcile {counts}")
+    return counts
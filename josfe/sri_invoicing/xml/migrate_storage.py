@@ -0,0 +1,203 @@
+# -*- coding: utf-8 -*-
+# apps/josfe/josfe/sri_invoicing/xml/migrate_storage.py
+"""
+Move an existing flat SRI/ tree into the sharded layout (FE Settings.storage_layout).
+
+Every file lying directly in a stage folder (SRI/AUTORIZADOS/x.xml, ...) goes to
+SRI/<stage>/<YYYY>/<MM>/<EEE>/x.xml, with the shard taken from its clave de
+acceso (queue row first, file contents otherwise). Files without a readable
+clave stay where they are and are reported.
+
+Per batch, in this order:
+1. SRI File Index rows (old URL -> new URL, moved_at empty), the queue rows'
+   xml_file and any File attachment pointing at the old URL; commit.
+2. os.replace of each file, then moved_at is set; commit.
+A run interrupted between 1 and 2 leaves URLs resolvable both ways
+(paths.resolve), and the next run finishes the pending moves first.
+Run it with the pipeline idle: rows moving between stages meanwhile are
+skipped by the xml_file guard but their files may still be moved.
+
+    bench --site <site> execute josfe.sri_invoicing.xml.migrate_storage.migrate
+    bench --site <site> execute josfe.sri_invoicing.xml.migrate_storage.migrate --kwargs "{'dry_run': 0}"
+"""
+from __future__ import annotations
+
+import os
+import re
+from typing import Any, Dict, List, Optional
+
+import frappe
+from frappe.utils import now_datetime
+
+from josfe.sri_invoicing.core.validations.access_key_batch import validate_access_keys
+from josfe.sri_invoicing.xml import comprobante, paths
+
+QUEUE_DTYPE = "SRI XML Queue"
+BATCH_SIZE = 500
+
+_CLAVE = re.compile(rb"<claveAcceso>\s*(\d{49})\s*</claveAcceso>")
+
+
+def _clave_in_file(abs_path: str) -> str:
+    try:
+        with open(abs_path, "rb") as f:
+            m = _CLAVE.search(f.read())
+        return m.group(1).decode() if m else ""
+    except OSError:
+        return ""
+
+
+def _queue_by_url() -> Dict[str, tuple]:
+    rows = frappe.db.sql(
+        f"SELECT name, xml_file, clave_acceso FROM `tab{QUEUE_DTYPE}` WHERE xml_file LIKE %s",
+        (paths.to_file_url("", "").rstrip("/") + "/%",),
+    )
+    return {xml_file: (name, (clave or "").strip()) for name, xml_file, clave in rows}
+
+
+def _file_doc_urls() -> set:
+    return {u for (u,) in frappe.db.sql(
+        "SELECT DISTINCT file_url FROM `tabFile` WHERE file_url LIKE %s",
+        (paths.to_file_url("", "").rstrip("/") + "/%",),
+    )}
+
+
+def _flat_files() -> List[tuple]:
+    """(stage, filename) of files lying directly in a stage folder."""
+    out = []
+    for stage in paths.STAGE_DIRS:
+        folder = paths.abs_path(stage, "")
+        if not os.path.isdir(folder):
+            continue
+        out.extend((stage, e.name) for e in os.scandir(folder) if e.is_file())
+    return out
+
+
+def plan(limit: Optional[int] = None) -> Dict[str, Any]:
+    """Moves the migration would make, without touching anything."""
+    queue = _queue_by_url()
+    moves, no_clave, conflicts = [], [], []
+
+    candidates = _flat_files()
+    claves = [
+        queue.get(paths.to_file_url(stage, filename), (None, ""))[1]
+        or _clave_in_file(paths.abs_path(stage, filename))
+        for stage, filename in candidates
+    ]
+    valid = validate_access_keys(claves).well_formed if candidates else []
+
+    for (stage, filename), clave, ok in zip(candidates, claves, valid):
+        url = paths.to_file_url(stage, filename)
+        if not ok:
+            no_clave.append(url)
+            continue
+        shard = paths.clave_shard(clave)
+        dest = paths.abs_path(stage, filename, shard)
+        if os.path.exists(dest):
+            conflicts.append(url)
+            continue
+        moves.append({
+            "stage": stage,
+            "filename": filename,
+            "shard": shard,
+            "legacy_url": url,
+            "file_url": paths.to_file_url(stage, filename, shard),
+            "queue": queue.get(url, (None, ""))[0],
+        })
+        if limit and len(moves) >= int(limit):
+            break
+
+    return {"moves": moves, "no_clave": no_clave, "conflicts": conflicts}
+
+
+def _move(legacy_url: str, file_url: str) -> bool:
+    src = os.path.join(frappe.get_site_path("private", "files"), paths.strip_private_prefix(legacy_url))
+    dest = os.path.join(frappe.get_site_path("private", "files"), paths.strip_private_prefix(file_url))
+    if not os.path.exists(src):
+        return os.path.exists(dest)
+    os.makedirs(os.path.dirname(dest), exist_ok=True)
+    comprobante.forget(src)
+    os.replace(src, dest)
+    return True
+
+
+def _finish_pending() -> int:
+    """Complete moves recorded in SRI File Index by an interrupted run."""
+    pending = frappe.db.sql(
+        f"SELECT name, legacy_url, file_url FROM `tab{paths.INDEX_DTYPE}` WHERE moved_at IS NULL"
+    )
+    done = [name for name, legacy_url, file_url in pending if _move(legacy_url, file_url)]
+    if done:
+        frappe.db.sql(
+            f"UPDATE `tab{paths.INDEX_DTYPE}` SET moved_at=%s WHERE name IN %s",
+            (now_datetime(), tuple(done)),
+        )
+        frappe.db.commit()
+    return len(done)
+
+
+def _apply_batch(batch: List[dict], file_urls: set) -> int:
+    now = now_datetime()
+    user = frappe.session.user
+    for m in batch:
+        frappe.db.sql(
+            f"""
+            INSERT INTO `tab{paths.INDEX_DTYPE}`
+                (name, creation, modified, owner, modified_by, docstatus, idx,
+                 legacy_url, file_url, queue, moved_at)
+            VALUES (%s, %s, %s, %s, %s, 0, 0, %s, %s, %s, NULL)
+            ON DUPLICATE KEY UPDATE file_url=VALUES(file_url), queue=VALUES(queue),
+                modified=VALUES(modified), moved_at=NULL
+            """,
+            (frappe.generate_hash(length=10), now, now, user, user, m["legacy_url"], m["file_url"], m["queue"]),
+        )
+        if m["queue"]:
+            frappe.db.sql(
+                f"UPDATE `tab{QUEUE_DTYPE}` SET xml_file=%s WHERE name=%s AND xml_file=%s",
+                (m["file_url"], m["queue"], m["legacy_url"]),
+            )
+        if m["legacy_url"] in file_urls:
+            frappe.db.sql("UPDATE `tabFile` SET file_url=%s WHERE file_url=%s", (m["file_url"], m["legacy_url"]))
+    frappe.db.commit()
+
+    moved = [m["legacy_url"] for m in batch if _move(m["legacy_url"], m["file_url"])]
+    if moved:
+        frappe.db.sql(
+            f"UPDATE `tab{paths.INDEX_DTYPE}` SET moved_at=%s WHERE legacy_url IN %s",
+            (now_datetime(), tuple(moved)),
+        )
+        frappe.db.commit()
+    return len(moved)
+
+
+def migrate(dry_run: int = 1, limit: Optional[int] = None, batch_size: int = BATCH_SIZE) -> Dict[str, Any]:
+    """Shard the flat SRI/ tree; dry_run=1 (default) only reports what would move."""
+    frappe.only_for(("System Manager",))
+    if paths.layout() != paths.LAYOUT_SHARDED:
+        frappe.throw(
+            f"Configure FE Settings → Almacenamiento: Estructura de Carpetas = "
+            f"'{paths.LAYOUT_SHARDED}' antes de migrar."
+        )
+
+    resumed = 0 if int(dry_run) else _finish_pending()
+    p = plan(limit)
+    moved = 0
+    if not int(dry_run):
+        file_urls = _file_doc_urls()
+        size = max(1, int(batch_size))
+        for start in range(0, len(p["moves"]), size):
+            moved += _apply_batch(p["moves"][start:start + size], file_urls)
+
+    summary = {
+        "dry_run": int(dry_run),
+        "resumed": resumed,
+        "to_move": len(p["moves"]),
+        "moved": moved,
+        "no_clave": len(p["no_clave"]),
+        "conflicts": len(p["conflicts"]),
+        "no_clave_files": p["no_clave"][:100],
+        "conflict_files": p["conflicts"][:100],
+    }
+    counts = {k: v for k, v in summary.items() if not k.endswith("_files")}
+    frappe.logger("sri_flow").info(f"[STORAGE MIGRATE] {counts}")
+    return summary
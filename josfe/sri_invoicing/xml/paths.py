@@ -1,6 +1,7 @@
 # apps/josfe/josfe/sri_invoicing/xml/paths.py
 from __future__ import annotations
 import os
+import zipfile
 import frappe
 
 # Root under /private/files
@@ -13,6 +14,22 @@ SIGNED_SENT_PENDING = os.path.join(SIGNED, "PENDIENTES")
 SIGNED_REJECTED = os.path.join(SIGNED, "Rechazados")  # Capital R, rest lowercase
 AUTH = "AUTORIZADOS"
 NOT_AUTH = "NO_AUTORIZADOS"
+RIDE = "RIDE"
+ARCHIVE = "ARCHIVO"  # closed periods: ARCHIVO/<YYYY>/<MM>/<EEE>.zip
+JOURNAL = ".journal"  # pending file moves per open DB transaction (xml.journal)
+
+# Stage folders, nested ones first so URL parsing takes the longest match
+STAGE_DIRS = (SIGNED_SENT_PENDING, SIGNED_REJECTED, GEN, SIGNED, AUTH, NOT_AUTH)
+
+# FE Settings.storage_layout
+LAYOUT_FLAT = "Plano"
+LAYOUT_SHARDED = "Año/Mes/Establecimiento"
+
+PRIVATE_PREFIX = "/private/files/"
+INDEX_DTYPE = "SRI File Index"
+# SRI File Index points archived files at '<zip url>#<member>'
+MEMBER_SEP = "#"
+INDEX_HOPS = 3
 
 def _root_abs() -> str:
     base = frappe.get_site_path("private", "files", ROOT_FOLDER_NAME)
@@ -40,12 +57,123 @@ def rel_for_state(state: str, *, origin: str | None = None) -> str:
         return NOT_AUTH if (origin or "").lower().startswith("autoriz") else SIGNED_REJECTED
     return GEN  # fallback
 
-def abs_path(rel_dir: str, filename: str) -> str:
-    return os.path.join(_root_abs(), rel_dir, filename)
+def abs_path(rel_dir: str, filename: str, shard: str = "") -> str:
+    return os.path.join(_root_abs(), rel_dir, shard, filename)
 
-def to_file_url(rel_dir: str, filename: str) -> str:
-    rel = os.path.join(ROOT_FOLDER_NAME, rel_dir, filename).replace("\\", "/")
+def to_file_url(rel_dir: str, filename: str, shard: str = "") -> str:
+    rel = os.path.join(ROOT_FOLDER_NAME, rel_dir, shard, filename).replace("\\", "/")
     return f"/private/files/{rel}"
 
 def strip_private_prefix(file_url: str) -> str:
     return (file_url or "").replace("/private/files/", "", 1).lstrip("/")
+
+def ride_rel_dir(posting_date) -> str:
+    """RIDE PDFs: RIDE/mm-YYYY."""
+    from frappe.utils import getdate
+
+    d = getdate(posting_date)
+    return f"{RIDE}/{d.month:02d}-{d.year}"
+
+# ------------------------------
+# Sharded layout
+# ------------------------------
+def layout() -> str:
+    return frappe.db.get_single_value("FE Settings", "storage_layout", cache=True) or LAYOUT_FLAT
+
+def clave_shard(clave: str | None) -> str:
+    """
+    'YYYY/MM/EEE' taken from the clave de acceso (fecha de emisión + establecimiento),
+    so a document's folder follows from its key alone. '' for anything but a 49-digit key.
+    """
+    clave = (clave or "").strip()
+    if len(clave) != 49 or not clave.isdigit():
+        return ""
+    return f"{clave[4:8]}/{clave[2:4]}/{clave[24:27]}"
+
+def shard_for(clave: str | None) -> str:
+    """Shard for a new document under the configured layout ('' when Plano)."""
+    return clave_shard(clave) if layout() == LAYOUT_SHARDED else ""
+
+def split_url(file_url: str) -> tuple[str, str, str]:
+    """
+    '/private/files/SRI/<stage>/<shard>/<file>' -> (stage, shard, file).
+    stage is '' for URLs outside the known SRI stage folders.
+    """
+    rel = strip_private_prefix(file_url)
+    root = ROOT_FOLDER_NAME + "/"
+    if rel.startswith(root):
+        rel = rel[len(root):]
+        for stage in STAGE_DIRS:
+            if rel.upper().startswith(stage.upper() + "/"):
+                rest = rel[len(stage) + 1:]
+                return stage, os.path.dirname(rest), os.path.basename(rest)
+    return "", os.path.dirname(rel), os.path.basename(rel)
+
+def shard_of(file_url: str) -> str:
+    """Shard part of an SRI URL ('' for flat or unknown URLs)."""
+    stage, shard, _filename = split_url(file_url)
+    return shard if stage else ""
+
+def locate(file_url: str) -> tuple[str, str]:
+    """
+    Where the content of a /private/files URL lives now: (absolute path, archive member).
+    member is '' for plain files. Files moved by the layout migration or packed
+    into a period archive are followed through SRI File Index (a few hops, so a
+    flat URL reaches its sharded copy's archive); a URL whose migration move has
+    not happened yet finds the old file. Unknown URLs give the direct (possibly
+    missing) path so callers keep their own not-found handling.
+    """
+    site_files = frappe.get_site_path("private", "files")
+
+    def _abs(url: str) -> str:
+        return os.path.join(site_files, strip_private_prefix(url.split(MEMBER_SEP, 1)[0]))
+
+    direct = _abs(file_url or "")
+    if not file_url or os.path.exists(direct):
+        return direct, ""
+
+    seen, frontier = {file_url}, [file_url]
+    for _hop in range(INDEX_HOPS):
+        rows = frappe.db.sql(
+            f"SELECT legacy_url, file_url FROM `tab{INDEX_DTYPE}` WHERE legacy_url IN %s OR file_url IN %s",
+            (tuple(frontier), tuple(frontier)),
+        )
+        frontier = []
+        for legacy_url, current_url in rows:
+            for other in (current_url, legacy_url):
+                if other in seen:
+                    continue
+                seen.add(other)
+                path = _abs(other)
+                if os.path.exists(path):
+                    return path, other.partition(MEMBER_SEP)[2]
+                frontier.append(other)
+        if not frontier:
+            break
+    return direct, ""
+
+def resolve(file_url: str) -> str:
+    """
+    Absolute path of a /private/files URL (see locate). For a file packed into
+    an archive this is the missing original path: read it with read_bytes().
+    """
+    path, member = locate(file_url)
+    if member:
+        return os.path.join(frappe.get_site_path("private", "files"), strip_private_prefix(file_url))
+    return path
+
+def read_bytes(file_url: str) -> bytes | None:
+    """Content of a /private/files URL, from disk or its period archive; None if missing."""
+    path, member = locate(file_url)
+    try:
+        if member:
+            with zipfile.ZipFile(path) as zf:
+                return zf.read(member)
+        with open(path, "rb") as f:
+            return f.read()
+    except (OSError, KeyError, zipfile.BadZipFile):
+        return None
+
+def exists(file_url: str) -> bool:
+    path, member = locate(file_url)
+    return bool(member) or os.path.exists(path)
@@ -2,7 +2,7 @@
 # apps/josfe/josfe/sri_invoicing/xml/service.py
 
 from __future__ import annotations
-import os, re, tempfile, subprocess
+import os, re, tempfile, subprocess, time
 import frappe
 import html
 from frappe.utils import cstr, now_datetime, escape_html
@@ -10,8 +10,9 @@ from josfe.sri_invoicing.xml.utils import format_xml_bytes
 
 from josfe.sri_invoicing.doctype.sri_xml_queue.sri_xml_queue import SRIQueueState
 from josfe.sri_invoicing.xml.xades_template import inject_signature_template
-from josfe.sri_invoicing.xml import paths
-from josfe.sri_invoicing.core.transmission import soap, poller2
+from josfe.sri_invoicing.xml import atomic, comprobante, journal, paths
+from josfe.sri_invoicing.core.transmission import breaker, soap, poller2
+from josfe.sri_invoicing.core.queue import timings
 from josfe.sri_invoicing.xml.helpers import (
     _append_comment, _attach_private_file, _db_set_state, _format_msgs
 )
@@ -43,8 +44,8 @@ def _resolve_private_relpath(file_url: str) -> str | None:
     frappe.throw(f"Unrecognized file_url format: {file_url}")
 
 def _abs_from_url(file_url: str) -> str:
-    rel = _resolve_private_relpath(file_url)
-    return os.path.join(frappe.get_site_path("private", "files"), rel)
+    _resolve_private_relpath(file_url)  # rejects non-private URLs
+    return paths.resolve(file_url)
 
 def _read_bytes(file_url: str) -> bytes:
     p = _abs_from_url(file_url)
@@ -54,27 +55,42 @@ def _read_bytes(file_url: str) -> bytes:
         return f.read()
 
 def _move_xml_file(old_url: str, to_state: str, *, origin: str | None = None) -> str:
-    """Move working XML to the correct SRI/ folder; return new /private/files/..."""
+    """Move working XML to the correct SRI/ folder (same shard); return new /private/files/..."""
     if not old_url:
         return ""
-    site_files = frappe.get_site_path("private", "files")
-    old_rel = old_url.replace("/private/files/", "", 1).lstrip("/")
-    old_abs = os.path.join(site_files, old_rel)
+    old_abs = paths.resolve(old_url)
 
     filename = os.path.basename(old_abs)
+    shard = paths.shard_of(old_url)
     rel_dir = paths.rel_for_state(to_state, origin=origin)
-    dest_abs = paths.abs_path(rel_dir, filename)
+    dest_abs = paths.abs_path(rel_dir, filename, shard)
 
     if os.path.abspath(old_abs) == os.path.abspath(dest_abs):
-        return paths.to_file_url(rel_dir, filename)
+        return paths.to_file_url(rel_dir, filename, shard)
 
-    os.makedirs(os.path.dirname(dest_abs), exist_ok=True)
     if not os.path.exists(old_abs):
         frappe.throw(f"Source XML file not found: {old_abs}")
-    os.replace(old_abs, dest_abs)
-    return paths.to_file_url(rel_dir, filename)
+    new_url = paths.to_file_url(rel_dir, filename, shard)
+    journal.record_move(old_url, new_url, old_abs, dest_abs)  # undone if the transaction rolls back
+    atomic.replace(old_abs, dest_abs)
+    return new_url
 
-def _write_to_sri(rel_dir: str, filename: str, data: bytes) -> str:
+def _repoint_xml_file(qdoc, new_url: str) -> None:
+    """
+    Point the row at a freshly written file that replaces its current one; the
+    old file is deleted when the transaction commits (xml.journal), or the new
+    one if it rolls back.
+    """
+    journal.record_supersede(qdoc.xml_file, new_url)
+    qdoc.db_set("xml_file", new_url)
+
+def _write_to_sri(rel_dir: str, filename: str, data: bytes, *, comp=None, shard: str = "") -> str:
+    """
+    Write `data` under SRI/<rel_dir>/<shard>/<filename>.
+    comp: live Comprobante already in normalized shape; its bytes are written
+    as-is (no format pass) and it stays cached for the next stage.
+    shard: paths.shard_for(clave) for a new document, paths.shard_of(xml_file) afterwards.
+    """
     # --- Normalize: always pass a LOGICAL dir (without leading 'SRI/')
     def _normalize_rel_dir(rd: str) -> str:
         rd_in = (rd or "").strip().replace("\\", "/").lstrip("/")
@@ -95,69 +111,34 @@ def _write_to_sri(rel_dir: str, filename: str, data: bytes) -> str:
 
     rel_dir = _normalize_rel_dir(rel_dir)
 
-    dest = paths.abs_path(rel_dir, filename)  # paths.* adds the single 'SRI/' root
-    os.makedirs(os.path.dirname(dest), exist_ok=True)
+    dest = paths.abs_path(rel_dir, filename, shard)  # paths.* adds the single 'SRI/' root
 
-    # Normalize XML before saving (pretty/clean wrappers)
-    try:
-        data = format_xml_bytes(data or b"")
-    except Exception:
-        pass
+    if comp is not None:
+        data = comp.to_bytes()
+    else:
+        # Normalize XML before saving (pretty/clean wrappers)
+        try:
+            data = format_xml_bytes(data or b"")
+        except Exception:
+            pass
 
-    with open(dest, "wb") as f:
-        f.write(data or b"")
+    # 🟢 Human-friendly text for final states (AUTORIZADO/DEVUELTO/RECHAZADO), decided
+    # before the write so the file is written once. rel_dir is logical (no 'SRI/').
+    final = any(stage in rel_dir.upper() for stage in ["AUTORIZADOS", "DEVUELTOS", "RECHAZADOS"])
+    if final:
+        try:
+            data = html.unescape((data or b"").decode("utf-8", errors="ignore")).encode("utf-8")
+        except Exception as e:
+            frappe.log_error(f"Unescape final XML failed: {e}", "SRI XML Queue")
 
-    # 🟢 Human-friendly rewrite for final states (AUTORIZADO/DEVUELTO/RECHAZADO)
-    # rel_dir is logical (no 'SRI/'), so this check is reliable
-    try:
-        if any(stage in rel_dir.upper() for stage in ["AUTORIZADOS", "DEVUELTOS", "RECHAZADOS"]):
-            text = (data or b"").decode("utf-8", errors="ignore")
-            text = html.unescape(text)
-            with open(dest, "w", encoding="utf-8") as ftxt:
-                ftxt.write(text)
-    except Exception as e:
-        frappe.log_error(f"Unescape final XML failed: {e}", "SRI XML Queue")
+    # Temp file + fsync + rename: readers never see a truncated XML
+    atomic.write_bytes(dest, data or b"")
+    if comp is not None and not final:
+        comprobante.remember(dest, comp)
 
     frappe.logger("sri_flow").info(f"[WRITE] rel_dir={rel_dir} filename={filename} → {dest}")
-    return paths.to_file_url(rel_dir, filename)  # returns '/private/files/SRI/<rel_dir>/<filename>'
-
-
-def _cleanup_after_authorized(filename: str) -> None:
-    """When authorized, remove any duplicates from GENERADOS/FIRMADOS/PENDIENTES."""
-    try:
-        for rel in (paths.GEN, paths.SIGNED, paths.SIGNED_SENT_PENDING):
-            p = paths.abs_path(rel, filename)
-            if os.path.exists(p):
-                try:
-                    os.remove(p)
-                except Exception:
-                    pass
-    except Exception:
-        frappe.log_error(frappe.get_traceback(), "SRI cleanup_after_authorized")
+    return paths.to_file_url(rel_dir, filename, shard)  # '/private/files/SRI/<rel_dir>/<shard>/<filename>'
 
-def cleanup_pendiente_if_rechazado(new_url: str):
-    """
-    If a .rechazado.xml or .no_autorizado.xml exists,
-    remove the corresponding PENDIENTES .xml copy.
-    """
-    site_files = frappe.get_site_path("private", "files")
-    base = os.path.basename(new_url)
-
-    # strip suffixes like .rechazado.xml → .xml
-    if base.endswith(".rechazado.xml"):
-        orig = base.replace(".rechazado.xml", ".xml")
-    elif base.endswith(".no_autorizado.xml"):
-        orig = base.replace(".no_autorizado.xml", ".xml")
-    else:
-        return  # nothing to do
-
-    pendiente_path = os.path.join(site_files, "SRI", "FIRMADOS", "PENDIENTES", orig)
-    if os.path.exists(pendiente_path):
-        try:
-            os.remove(pendiente_path)
-            frappe.logger("sri_flow").info(f"🧹 Removed leftover pendiente: {pendiente_path}")
-        except Exception as e:
-            frappe.log_error(f"Failed to delete pendiente {pendiente_path}: {e}", "SRI XML Cleanup")
 
 # ------------------------------
 # XML helpers
@@ -183,17 +164,27 @@ def _extract_clave_acceso(xml_bytes: bytes) -> str | None:
     return None
 
 
+def is_id_43(msgs) -> bool:
+    """Detect SRI message id=43 "CLAVE ACCESO REGISTRADA" (already received earlier)."""
+    for m in msgs or []:
+        if (m.get("identificador") or "").strip() == "43":
+            return True
+        txt = ((m.get("mensaje") or "") + " " + (m.get("informacionAdicional") or "")).upper()
+        if "CLAVE ACCESO REGISTRADA" in txt:
+            return True
+    return False
+
+
 # ------------------------------
 # Signing
 # ------------------------------
 def _process_signing(qdoc):
-    """Sign XML with xmlsec1, then move into SRI/FIRMADOS/ and update xml_file field."""
+    """Sign XML (native XAdES-BES or xmlsec1, per FE Settings), then move into SRI/FIRMADOS/ and update xml_file field."""
+    t0 = time.monotonic()
     if not cstr(qdoc.xml_file):
         frappe.throw("No XML file path in this SRI XML Queue row.")
 
-    site_files = frappe.get_site_path("private", "files")
-    rel_old = (qdoc.xml_file or "").replace("/private/files/", "", 1).lstrip("/")
-    old_path = os.path.join(site_files, rel_old)
+    old_path = paths.resolve(qdoc.xml_file)
     if not os.path.exists(old_path):
         frappe.throw(f"XML file not found on disk: {old_path}")
 
@@ -204,13 +195,68 @@ def _process_signing(qdoc):
     if not os.path.exists(priv_pem) or not os.path.exists(cert_pem):
         frappe.throw("❌ PEM files not found. Ejecuta 'Validar Firma' en Credenciales SRI.")
 
-    # Inject signature template (ensures id="comprobante" on the document root)
-    with open(old_path, "r", encoding="utf-8") as f:
+    from josfe.sri_invoicing.doctype.fe_settings.fe_settings import get_settings
+    if (get_settings().signing_engine or "Nativo") == "xmlsec1":
+        comp = _sign_with_xmlsec1(old_path, priv_pem, cert_pem)
+    else:
+        comp = _sign_native(old_path, cred.name, priv_pem, cert_pem)
+
+    # ✅ Move to FIRMADOS and update DB immediately
+    new_url = _move_xml_file(qdoc.xml_file, "Firmado")
+    if new_url:
+        qdoc.db_set("xml_file", new_url)
+        qdoc.xml_file = new_url
+        comprobante.remember(_abs_from_url(new_url), comp)
+
+    # Bookkeeping
+    qdoc.db_set("last_error", "")
+    qdoc.db_set("last_transition_at", now_datetime())
+    qdoc.db_set("last_transition_by", frappe.session.user)
+    timings.record(qdoc, "Firmado", work_ms=timings.ms_since(t0))
+
+    # Timeline note
+    try:
+        from josfe.sri_invoicing.xml.helpers import _append_comment
+        _append_comment(qdoc, "✔ XML firmado correctamente.")
+    except Exception:
+        pass
+
+
+def _sign_native(path: str, cred_name: str, priv_pem: str, cert_pem: str):
+    """In-process XAdES-BES on the live tree (parsed only if this worker did not build it)."""
+    from josfe.sri_invoicing.core.signing import signer
+    from josfe.sri_invoicing.xml.xades_template import inject_signature_into
+
+    try:
+        material = signer.load_material(cred_name, priv_pem, cert_pem)
+        comp = comprobante.load(path)
+        root = inject_signature_into(comp.normalize(), material.cert_bits)
+    except Exception as e:
+        comprobante.forget(path)
+        frappe.throw(f"XML parse error antes de firmar: {frappe.utils.escape_html(str(e))}")
+
+    try:
+        comp.set_signed(signer.sign_tree(root, material.private_key))
+    except Exception as e:
+        # The live tree now carries a half-filled template; make the next try reparse the file
+        comprobante.forget(path)
+        ctx = f"[root={comp.root_name} id#comprobante={'YES' if root.get('id') == 'comprobante' else 'NO'}]"
+        frappe.throw(f"{ctx} Error firmando XML: {frappe.utils.escape_html(str(e))}")
+
+    comprobante.write(path, comp)
+    return comp
+
+
+def _sign_with_xmlsec1(path: str, priv_pem: str, cert_pem: str):
+    """Fallback engine: write the template, then run the xmlsec1 binary over it."""
+    comprobante.forget(path)
+    with open(path, "r", encoding="utf-8") as f:
         raw_xml = f.read()
+
+    # Inject signature template (ensures id="comprobante" on the document root)
     ready_xml = inject_signature_template(raw_xml, cert_pem)
     if ready_xml != raw_xml:
-        with open(old_path, "w", encoding="utf-8") as f:
-            f.write(ready_xml)
+        atomic.write_bytes(path, ready_xml.encode("utf-8"))
 
     # 🔁 Dynamic, future-proof signing for any SRI doc type
     from lxml import etree
@@ -225,38 +271,43 @@ def _process_signing(qdoc):
         frappe.throw(f"XML parse error antes de firmar: {frappe.utils.escape_html(str(e))}")
 
     try:
-        with open(old_path, "rb") as f:
+        with open(path, "rb") as f:
             signed = sign_with_xmlsec(f.read(), priv_pem, cert_pem)
-        with open(old_path, "wb") as f:
-            f.write(signed)
+        atomic.write_bytes(path, signed)
     except Exception as e:
         # Capture context: root, comprobante presence, and xmlsec stderr if any
         ctx = f"[root={root_name} id#comprobante={'YES' if has_comprobante else 'NO'}]"
         msg = getattr(e, "args", [str(e)])[0]
         frappe.throw(f"{ctx} Error ejecutando xmlsec1: {frappe.utils.escape_html(msg)}")
 
+    return comprobante.load(path)
 
-    # ✅ Move to FIRMADOS and update DB immediately
-    new_url = _move_xml_file(qdoc.xml_file, "Firmado")
-    if new_url:
-        qdoc.db_set("xml_file", new_url)
-        qdoc.xml_file = new_url
 
-    # Bookkeeping
-    qdoc.db_set("last_error", "")
-    qdoc.db_set("last_transition_at", now_datetime())
-    qdoc.db_set("last_transition_by", frappe.session.user)
-
-    # Timeline note
+def _park_unsent(qdoc, msgs) -> None:
+    """Recepción never answered: the comprobante was not received, so keep it Firmado and wait for SRI."""
     try:
-        from josfe.sri_invoicing.xml.helpers import _append_comment
-        _append_comment(qdoc, "✔ XML firmado correctamente.")
+        moved = _move_xml_file(qdoc.xml_file, "Firmado")
+        if moved:
+            qdoc.db_set("xml_file", moved)
+    except Exception:
+        frappe.log_error(frappe.get_traceback(), "SRI park move FIRMADO")
+    qdoc.db_set("state", SRIQueueState.Firmado.value)
+    qdoc.state = SRIQueueState.Firmado.value
+    breaker.park([qdoc.name], "; ".join(cstr(m) for m in msgs or [])[:500])
+    try:
+        _append_comment(qdoc, "⏸ SRI no respondió a la Recepción; comprobante en espera, se enviará automáticamente.")
     except Exception:
         pass
 
 
-def _process_transmission(qdoc, stage_state: str):
-    """Handle movement + calls for Enviado/Autorizado/Devuelto."""
+def _process_transmission(qdoc, stage_state: str, prefetched: dict | None = None):
+    """Handle movement + calls for Enviado/Autorizado/Devuelto.
+
+    prefetched: optional {"recepcion": {...}, "autorizacion": {...}, "clave": "..."}
+    with SRI responses already obtained elsewhere (bulk sender); the matching
+    SOAP calls are then skipped and only the state/file logic runs here.
+    """
+    prefetched = prefetched or {}
     if not cstr(qdoc.xml_file):
         frappe.throw("No XML file path in this SRI XML Queue row.")
 
@@ -272,72 +323,74 @@ def _process_transmission(qdoc, stage_state: str):
         except Exception:
             pass
 
-        # 2) Recepción (one call)
-        xml_bytes = None
-        try:
-            site_files = frappe.get_site_path("private", "files")
-            rel_old = (qdoc.xml_file or "").replace("/private/files/", "", 1).lstrip("/")
-            old_path = os.path.join(site_files, rel_old)
-            with open(old_path, "rb") as f:
-                xml_bytes = f.read()
-        except Exception:
-            pass
+        # 2) Recepción (one call, unless the bulk sender already made it)
+        comp = None
+        rc = prefetched.get("recepcion")
+        sent_ms = int(prefetched["seconds"] * 1000) if prefetched.get("seconds") is not None else None
+        if rc is None:
+            t_sri = time.monotonic()
+            try:
+                comp = comprobante.load(_abs_from_url(qdoc.xml_file))
+                frappe.logger("sri_flow").debug(f"[PARSE] q={qdoc.name} parses={comp.parses}")
+            except Exception:
+                pass
 
-        rc = {}
-        try:
-            from josfe.sri_invoicing.core.transmission import soap
-            rc = soap.enviar_recepcion(xml_bytes or b"")
-        except Exception:
-            rc = {}
+            try:
+                from josfe.sri_invoicing.core.transmission import soap
+                if comp is not None:
+                    rc = soap.enviar_recepcion(comp.to_bytes(), comp.ambiente)
+                else:
+                    rc = soap.enviar_recepcion(b"")
+            except Exception:
+                rc = {}
+            sent_ms = timings.ms_since(t_sri)
 
         r_estado = (rc.get("estado") or "").upper()
         r_msgs = rc.get("mensajes") or []
         ambiente = rc.get("ambiente") or "Pruebas"
         r_wrap = rc.get("xml_wrapper") or ""
 
-        # helper: detect id=43 "CLAVE ACCESO REGISTRADA"
-        def is_id_43(msgs):
-            for m in msgs or []:
-                if (m.get("identificador") or "").strip() == "43":
-                    return True
-                txt = ((m.get("mensaje") or "") + " " + (m.get("informacionAdicional") or "")).upper()
-                if "CLAVE ACCESO REGISTRADA" in txt:
-                    return True
-            return False
+        # 2b) No answer from Recepción (breaker open / connection error) → back to Firmado, parked
+        if breaker.failed(rc):
+            _park_unsent(qdoc, r_msgs)
+            return
+        if qdoc.get("waiting_sri"):
+            qdoc.db_set("waiting_sri", 0)
+
+        timings.record(qdoc, "Enviado", sri_ms=sent_ms, ambiente=ambiente)
 
         # 3) True reception DEVUELTA/RECHAZADO (not 43) → Rechazados + Devuelto
         if r_estado in {"DEVUELTA", "RECHAZADO"} and not is_id_43(r_msgs):
             frappe.flags.sri_devuelto_origin = "Recepción"
             base = os.path.basename(qdoc.xml_file).rsplit(".", 1)[0]
             rej_name = f"{base}.rechazado.xml"
-            url = _write_to_sri(paths.SIGNED_REJECTED, rej_name, (r_wrap or "").encode("utf-8"))
-            qdoc.db_set("xml_file", url)
-            
-            cleanup_pendiente_if_rechazado(url)
+            url = _write_to_sri(paths.SIGNED_REJECTED, rej_name, (r_wrap or "").encode("utf-8"),
+                                shard=paths.shard_of(qdoc.xml_file))
+            _repoint_xml_file(qdoc, url)  # PENDIENTES copy goes on commit
             try:
                 from josfe.sri_invoicing.xml.helpers import _append_comment, _format_msgs, _db_set_state
                 _append_comment(qdoc, _format_msgs("SRI (Recepción) DEVUELTA/RECHAZADO", r_msgs))
                 _db_set_state(qdoc, "Devuelto")
             except Exception:
                 qdoc.db_set("state", "Devuelto")
+            timings.record(qdoc, "Devuelto", ambiente=ambiente)
             return
 
         # 4) RECIBIDA or id=43 → try Autorización immediately
-        clave = ""
-        try:
-            import re as _re
-            m = _re.search(rb"<\s*claveAcceso\s*>\s*([0-9]+)\s*<\s*/\s*claveAcceso\s*>", xml_bytes or b"")
-            if m:
-                clave = m.group(1).decode().strip()
-        except Exception:
-            pass
-
-        auto = {}
-        try:
-            from josfe.sri_invoicing.core.transmission import soap
-            auto = soap.consultar_autorizacion(clave, ambiente)
-        except Exception:
-            auto = {}
+        clave = prefetched.get("clave") or ""
+        if not clave and comp is not None:
+            clave = comp.clave
+
+        auto = prefetched.get("autorizacion")
+        auth_ms = None
+        if auto is None:
+            t_sri = time.monotonic()
+            try:
+                from josfe.sri_invoicing.core.transmission import soap
+                auto = soap.consultar_autorizacion(clave, ambiente)
+            except Exception:
+                auto = {}
+            auth_ms = timings.ms_since(t_sri)
 
         a_estado = (auto.get("estado") or "").upper()
         a_msgs = auto.get("mensajes") or []
@@ -346,19 +399,16 @@ def _process_transmission(qdoc, stage_state: str):
         if a_estado == "AUTORIZADO" and a_wrap:
             base = os.path.basename(qdoc.xml_file).rsplit(".", 1)[0]
             # ✅ keep original filename (no .autorizado suffix)
-            file_url = _write_to_sri(paths.AUTH, f"{base}.xml", (a_wrap or "").encode("utf-8"))
-            qdoc.db_set("xml_file", file_url)
+            file_url = _write_to_sri(paths.AUTH, f"{base}.xml", (a_wrap or "").encode("utf-8"),
+                                     shard=paths.shard_of(qdoc.xml_file))
+            _repoint_xml_file(qdoc, file_url)  # PENDIENTES copy goes on commit
             try:
                 from josfe.sri_invoicing.xml.helpers import _append_comment, _format_msgs, _db_set_state
                 _append_comment(qdoc, _format_msgs("SRI (Autorización) AUTORIZADO", a_msgs) + f"\nArchivo: `{file_url}`")
                 _db_set_state(qdoc, "Autorizado")
             except Exception:
                 qdoc.db_set("state", "Autorizado")
-            try:
-                # ✅ remove stale copies (Generados/Firmados/Pendientes)
-                _cleanup_after_authorized(os.path.basename(file_url))
-            except Exception:
-                pass
+            timings.record(qdoc, "Autorizado", sri_ms=auth_ms, ambiente=ambiente)
             return
 
         if a_estado in {"NO AUTORIZADO", "RECHAZADO", "DEVUELTA"}:
@@ -366,10 +416,9 @@ def _process_transmission(qdoc, stage_state: str):
             base = os.path.basename(qdoc.xml_file).rsplit(".", 1)[0]
             nat_name = f"{base}.xml"
             if auto.get("xml_wrapper"):
-                nat_url = _write_to_sri(paths.NOT_AUTH, nat_name, auto["xml_wrapper"].encode("utf-8"))
-                qdoc.db_set("xml_file", nat_url)
-
-                cleanup_pendiente_if_rechazado(nat_url)
+                nat_url = _write_to_sri(paths.NOT_AUTH, nat_name, auto["xml_wrapper"].encode("utf-8"),
+                                        shard=paths.shard_of(qdoc.xml_file))
+                _repoint_xml_file(qdoc, nat_url)
             else:
                 moved = _move_xml_file(qdoc.xml_file, "Devuelto", origin="Autorización")
                 if moved:
@@ -380,6 +429,7 @@ def _process_transmission(qdoc, stage_state: str):
                 _db_set_state(qdoc, "Devuelto")
             except Exception:
                 qdoc.db_set("state", "Devuelto")
+            timings.record(qdoc, "Devuelto", sri_ms=auth_ms, ambiente=ambiente)
             return
 
         # 5) Still PPR — leave Enviado and schedule poller
@@ -389,30 +439,23 @@ def _process_transmission(qdoc, stage_state: str):
         except Exception:
             pass
         try:
-            from josfe.sri_invoicing.core.transmission import poller2
-            poller2.poll_autorizacion_job(queue_name=qdoc.name, clave=clave, ambiente=ambiente, attempt=0)
+            # Stored on the row; the poll_due scheduler tick queries Autorización later
+            poller2.schedule_poll(qdoc.name, clave, ambiente, attempt=0)
         except Exception:
-            frappe.enqueue(
-                "josfe.sri_invoicing.core.transmission.poller2.poll_autorizacion_job",
-                queue_name=qdoc.name, clave=clave, ambiente=ambiente, attempt=0,
-                queue="long", job_name=f"sri_poll:{qdoc.name}:0", enqueue_after_commit=True
-            )
+            frappe.log_error(frappe.get_traceback(), "SRI schedule_poll")
 
     elif state == SRIQueueState.Autorizado.value:
-        # ✅ ensure final file is only in AUTORIZADOS, clean old copies
-        filename = os.path.basename(qdoc.xml_file)
+        # ✅ ensure final file is in AUTORIZADOS (a move: no copy is left behind)
         new_url = _move_xml_file(qdoc.xml_file, "Autorizado")
         if new_url:
             qdoc.db_set("xml_file", new_url)
-            try:
-                _cleanup_after_authorized(filename)
-            except Exception:
-                pass
+        timings.record(qdoc, "Autorizado")
 
     elif state == SRIQueueState.Devuelto.value:
         new_url = _move_xml_file(qdoc.xml_file, "Devuelto", origin=origin)
         if new_url:
             qdoc.db_set("xml_file", new_url)
+        timings.record(qdoc, "Devuelto")
 
     # Bookkeeping (do not remove)
     qdoc.db_set("last_error", "")
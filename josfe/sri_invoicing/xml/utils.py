@@ -363,32 +363,65 @@ def _sri_codes_for_tax_row(tax_row, pct: D):
     return "2", "0", "0.00"
 
 
-def _iter_item_tax_splits(si, item):
+class TaxIndex:
     """
-    Read ERPNext Sales Taxes & Charges per-item split:
-      tax.item_wise_tax_detail[item_code] -> [rate, amount]
+    Per-invoice view of ERPNext's item_wise_tax_detail.
+    Each tax row's JSON is parsed once; per-item splits and SRI codes are
+    computed once and reused by map_tax_invoice / map_tax_item / the builder's
+    reconciliation check.
     """
-    out = []
-    for tax in (si.taxes or []):
-        details = getattr(tax, "item_wise_tax_detail", None)
-        if not details:
-            continue
-        try:
-            d = frappe.parse_json(details) or {}
-        except Exception:
-            d = {}
+
+    def __init__(self, si):
+        self.rows = []          # [(tax_row, {item_key: [rate, amount]})]
+        for tax in (si.taxes or []):
+            details = getattr(tax, "item_wise_tax_detail", None)
+            if not details:
+                continue
+            try:
+                d = frappe.parse_json(details) or {}
+            except Exception:
+                d = {}
+            self.rows.append((tax, d))
+        self._splits = {}       # id(item) -> [split, ...]
+        self._codes = {}        # (id(tax_row), pct) -> (codigo, codigoPorcentaje, tarifa)
+
+    def codes(self, tax_row, pct):
+        key = (id(tax_row), pct)
+        hit = self._codes.get(key)
+        if hit is None:
+            hit = self._codes[key] = _sri_codes_for_tax_row(tax_row, pct)
+        return hit
+
+    def splits(self, item) -> list[dict]:
+        hit = self._splits.get(id(item))
+        if hit is not None:
+            return hit
+
+        out = []
         key = item.item_code or item.item_name or item.name
-        val = d.get(key) or d.get(item.name)
-        if val is None:
-            continue
-        tax_rate   = D(val[0]) if isinstance(val, (list, tuple)) and len(val) >= 1 else D(getattr(tax, "rate", 0) or 0)
-        tax_amount = D(val[1]) if isinstance(val, (list, tuple)) and len(val) >= 2 else D("0")
+        for tax, d in self.rows:
+            val = d.get(key) or d.get(item.name)
+            if val is None:
+                continue
+            tax_rate   = D(val[0]) if isinstance(val, (list, tuple)) and len(val) >= 1 else D(getattr(tax, "rate", 0) or 0)
+            tax_amount = D(val[1]) if isinstance(val, (list, tuple)) and len(val) >= 2 else D("0")
+            # map_tax_item's lookup order (item_code, name, item_name), kept as before
+            item_val = d.get(item.item_code) or d.get(item.name) or d.get(item.item_name)
+            out.append({"row": tax, "rate": tax_rate, "amount": tax_amount, "item_val": item_val})
 
-        out.append({"row": tax, "rate": tax_rate, "amount": tax_amount})
-    return out
+        self._splits[id(item)] = out
+        return out
+
+
+def _iter_item_tax_splits(si, item, index: TaxIndex | None = None):
+    """
+    Read ERPNext Sales Taxes & Charges per-item split:
+      tax.item_wise_tax_detail[item_code] -> [rate, amount]
+    """
+    return (index or TaxIndex(si)).splits(item)
 
 
-def map_tax_invoice(si) -> list[dict]:
+def map_tax_invoice(si, index: TaxIndex | None = None) -> list[dict]:
     """
     Aggregate invoice totals per (codigo, codigoPorcentaje).
     Output: list of totalImpuesto dicts (SRI doesn't require <tarifa> at invoice level).
@@ -396,11 +429,12 @@ def map_tax_invoice(si) -> list[dict]:
     from collections import defaultdict
     buckets = defaultdict(lambda: D("0"))
     bases   = defaultdict(lambda: D("0"))
+    index = index or TaxIndex(si)
 
     for it in (si.items or []):
         base = D(getattr(it, "net_amount", getattr(it, "amount", 0)) or 0)
-        for split in _iter_item_tax_splits(si, it):
-            codigo, codigoPorcentaje, _ = _sri_codes_for_tax_row(split["row"], split["rate"])
+        for split in index.splits(it):
+            codigo, codigoPorcentaje, _ = index.codes(split["row"], split["rate"])
             key = (codigo, codigoPorcentaje)
             buckets[key] += D(split["amount"] or 0)
             bases[key]   += base
@@ -424,24 +458,24 @@ def map_tax_invoice(si) -> list[dict]:
     return out
 
 
-def map_tax_item(si, it) -> list[dict]:
+def map_tax_item(si, it, index: TaxIndex | None = None) -> list[dict]:
     """
     Build list of <impuesto> dicts for a Sales Invoice item.
-    Uses ERPNext's item_wise_tax_detail directly.
+    Uses ERPNext's item_wise_tax_detail (parsed once per invoice in TaxIndex).
     - <tarifa>  = percentage (val[0])
     - <valor>   = monetary amount (val[1])
     - <baseImponible> = it.net_amount
     """
     base = D(it.net_amount or it.amount or 0)
     impuestos = []
+    index = index or TaxIndex(si)
 
     # Walk ERP tax splits for this item
-    for split in _iter_item_tax_splits(si, it):
+    for split in index.splits(it):
         row = split["row"]
 
-        # Reparse to be safe → ERP stores [rate, amount]
-        raw = frappe.parse_json(row.item_wise_tax_detail or "{}") or {}
-        val = raw.get(it.item_code) or raw.get(it.name) or raw.get(it.item_name)
+        # ERP stores [rate, amount]
+        val = split["item_val"]
 
         if not (isinstance(val, (list, tuple)) and len(val) >= 2):
             continue
@@ -449,7 +483,7 @@ def map_tax_item(si, it) -> list[dict]:
         rate_pct = D(val[0])    # % (e.g. 15.0)
         amount_val = D(val[1])  # money (e.g. 65217.39)
 
-        codigo, codigoPorcentaje, _ = _sri_codes_for_tax_row(row, rate_pct)
+        codigo, codigoPorcentaje, _ = index.codes(row, rate_pct)
 
         impuestos.append({
             "codigo": codigo,
@@ -34,12 +34,12 @@ def _ensure_root_has_comprobante_id(root: etree._Element) -> None:
     root.set("id", "comprobante")
 
 
-def _read_cert_bits(cert_pem_path: str) -> tuple[str, str, int, str]:
+def cert_bits_from_pem(pem_data: bytes) -> tuple[str, str, int, str]:
     """
     Returns (cert_b64_der, issuer_name, serial_number, sha1_digest_b64)
+    for the first certificate in a PEM blob.
     """
-    with open(cert_pem_path, "rb") as f:
-        cert = x509.load_pem_x509_certificate(f.read())
+    cert = x509.load_pem_x509_certificate(pem_data)
 
     # b64 DER for <ds:X509Certificate>
     cert_der = cert.public_bytes(serialization.Encoding.DER)
@@ -56,6 +56,11 @@ def _read_cert_bits(cert_pem_path: str) -> tuple[str, str, int, str]:
     return cert_b64, issuer_name, serial_number, sha1_b64
 
 
+def _read_cert_bits(cert_pem_path: str) -> tuple[str, str, int, str]:
+    with open(cert_pem_path, "rb") as f:
+        return cert_bits_from_pem(f.read())
+
+
 def inject_signature_template(xml_text: str, cert_pem_path: str) -> str:
     """
     Inject a VALID XMLDSig + XAdES-BES template into the document.
@@ -64,10 +69,38 @@ def inject_signature_template(xml_text: str, cert_pem_path: str) -> str:
       - SignedInfo has 3 References: #comprobante (with enveloped + c14n transforms), #SignedProperties (Type attr), #KeyInfo
       - Root carries id="comprobante"
     """
-    cert_b64, issuer_name, serial_number, cert_sha1_b64 = _read_cert_bits(cert_pem_path)
-
-    # Parse source
     root = etree.fromstring(xml_text.encode("utf-8"))
+    _append_signature_template(root, _read_cert_bits(cert_pem_path))
+
+    # Return pretty-stable bytes
+    return format_xml_bytes(
+        etree.tostring(root, encoding="utf-8", xml_declaration=False)
+    ).decode("utf-8")
+
+
+def inject_signature_tree(xml_text: str, cert_bits: tuple) -> etree._Element:
+    """
+    Same template as inject_signature_template, but returns the lxml root
+    (already in its pretty-printed shape) so the native signer can sign it
+    without another serialize/parse round trip.
+    Serializing it with pretty_print gives exactly inject_signature_template's text.
+    """
+    parser = etree.XMLParser(remove_blank_text=True, encoding="utf-8")
+    root = etree.fromstring(xml_text.encode("utf-8"), parser=parser)
+    return inject_signature_into(root, cert_bits)
+
+
+def inject_signature_into(root: etree._Element, cert_bits: tuple) -> etree._Element:
+    """Template on an already parsed tree (e.g. a live Comprobante), left in pretty-printed shape."""
+    _append_signature_template(root, cert_bits)
+    etree.indent(root, space="  ")
+    # pretty_print leaves no trailing whitespace after the root element
+    root.tail = None
+    return root
+
+
+def _append_signature_template(root: etree._Element, cert_bits: tuple) -> None:
+    cert_b64, issuer_name, serial_number, cert_sha1_b64 = cert_bits
     _ensure_root_has_comprobante_id(root)
 
     # IDs
@@ -148,11 +181,6 @@ def inject_signature_template(xml_text: str, cert_pem_path: str) -> str:
     # Append signature to root (end of document)
     root.append(signature)
 
-    # Return pretty-stable bytes
-    return format_xml_bytes(
-        etree.tostring(root, encoding="utf-8", xml_declaration=False)
-    ).decode("utf-8")
-
 
 def sign_with_xmlsec(input_xml: bytes, key_pem_path: str, cert_pem_path: str) -> bytes:
     """